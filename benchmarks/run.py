@@ -0,0 +1,314 @@
+"""Offline benchmarks for gf_selection and the Dash callbacks.
+
+Run all benchmarks and save the timings into benchmarks/results/<commit>.json with
+
+    poetry run python benchmarks/run.py
+
+and compare against an earlier run with
+
+    poetry run python benchmarks/run.py --compare benchmarks/results/<old commit>.json
+
+The comparison lists benchmarks that got slower than --threshold and exits with status 1 if there are any.
+The plan cache is disabled, so every benchmark measures the calculation itself. Nothing needs a network
+connection or a browser, the callbacks are called directly as functions.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+
+project_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+results_folder = os.path.join(project_folder, "benchmarks", "results")
+sys.path.insert(0, project_folder)
+
+# Representative dives: depth (m), bottom time (min), pDCS, helium %, repetitive dive times and surface time (min)
+CASES = {
+    "shallow": dict(D=18, T=40, pdcs=0.02, he=0, dive_times=[40, 30], surface_time=60),
+    "deep": dict(D=45, T=20, pdcs=0.02, he=35, dive_times=[12, 8], surface_time=90),
+    "long": dict(D=30, T=120, pdcs=0.02, he=0, dive_times=[20, 15], surface_time=120),
+}
+
+BENCHMARKS = {}
+
+
+def benchmark(name, cases=CASES):
+    """Register a benchmark for every case. The decorated function gets the case parameters and returns
+    the function to time, so that preparations are not part of the timing."""
+    def decorator(prepare):
+        if cases is None:
+            BENCHMARKS[name] = lambda: prepare()
+        else:
+            for case_name, case in cases.items():
+                BENCHMARKS[f"{name}[{case_name}]"] = lambda case=case: prepare(**case)
+        return prepare
+    return decorator
+
+
+def time_function(func, repeat=5, min_time=0.02):
+    """Seconds per call for every repeat. Fast functions are called several times per repeat."""
+    func()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return timings, number
+
+
+def import_modules():
+    # app enables the cache and creates a job queue on import, point both into a temporary folder
+    folder = tempfile.mkdtemp(prefix="gf-benchmark-")
+    os.environ["GF_CACHE_PATH"] = os.path.join(folder, "cache.sqlite")
+    os.environ["GF_JOBS_PATH"] = os.path.join(folder, "jobs.sqlite")
+    from src import app, deco_planner, gf_selection, replay
+    gf_selection.disable_cache()
+    return app, deco_planner, gf_selection, replay
+
+
+app, deco_planner, gf_selection, replay = import_modules()
+
+
+def import_time(module):
+    """Cumulative import time of module in a fresh interpreter in seconds, as reported by -X importtime."""
+    command = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+    stderr = subprocess.run(command, cwd=project_folder, capture_output=True, text=True, check=True).stderr
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = [field.strip() for field in line.removeprefix("import time:").split("|")]
+        if fields[-1] == module:
+            return int(fields[1]) / 1e6
+    raise RuntimeError(f"python -X importtime did not report {module}")
+
+
+@benchmark("import_gf_selection", cases=None)
+def _():
+    def run():
+        seconds = import_time("src.gf_selection")
+        if seconds > gf_selection.IMPORT_TIME_BUDGET:
+            raise RuntimeError(f"Importing gf_selection took {seconds:.3f} s, the budget is {gf_selection.IMPORT_TIME_BUDGET} s")
+    return run
+
+
+@benchmark("get_standair_tdt")
+def _(D, T, pdcs, **_):
+    return lambda: gf_selection.get_standair_tdt(D, T, pdcs)
+
+
+@benchmark("get_standair_tdt_grid", cases=None)
+def _():
+    D, T, pdcs = np.meshgrid(np.arange(6, 62, 0.5), np.arange(5, 205, 1.0), np.linspace(0.005, 0.05, 46), indexing="ij")
+    return lambda: gf_selection.get_standair_tdt(D, T, pdcs)
+
+
+@benchmark("get_gf_tdt")
+def _(D, T, he, **_):
+    return lambda: gf_selection.get_gf_tdt(T, D, 80, he, 21)
+
+
+@benchmark("get_gf_tdt_schreiner")
+def _(D, T, he, **_):
+    return lambda: gf_selection.get_gf_tdt(T, D, 80, he, 21, backend="schreiner")
+
+
+@benchmark("fit_gf_to_tdt")
+def _(D, T, pdcs, he, **_):
+    TDT = gf_selection.get_standair_tdt(D, T, pdcs)
+    return lambda: gf_selection.fit_gf_to_tdt(T, D, TDT, he=he)
+
+
+@benchmark("fit_gf_to_tdt_schreiner")
+def _(D, T, pdcs, he, **_):
+    TDT = gf_selection.get_standair_tdt(D, T, pdcs)
+    return lambda: gf_selection.fit_gf_to_tdt(T, D, TDT, he=he, backend="schreiner")
+
+
+@benchmark("plan_deco")
+def _(D, T, pdcs, he, **_):
+    TDT = gf_selection.get_standair_tdt(D, T, pdcs)
+    return lambda: deco_planner.plan_deco(T, D, TDT, he=he, parallel=False)
+
+
+@benchmark("replay_dives", cases=None)
+def _():
+    """A batch of logged profiles: descent, bottom, ascent at 9 m/min with stops at 6 m and 3 m, 20 s samples."""
+    rng = np.random.default_rng(0)
+    dives = []
+    for k in range(replay.BATCH_SIZE):
+        D, T = rng.uniform(12, 45), rng.uniform(15, 60)
+        depths = np.concatenate(([0], np.full(int(T * 3), D), np.arange(D, 6, -3), np.full(9, 6), np.full(9, 3), [0]))
+        times = np.arange(len(depths)) / 3
+        gas = np.ones(len(depths))
+        dives.append(replay.LoggedDive("benchmark", str(k), times, depths, 0.68 * gas, 0 * gas, 85, 40))
+    return lambda: replay.replay_dives(dives)
+
+
+@benchmark("get_max_ceiling")
+def _(D, dive_times, surface_time, **_):
+    return lambda: gf_selection.get_max_ceiling(D, dive_times, surface_time, 80)
+
+
+@benchmark("def_find_no_deco_gf_high")
+def _(D, dive_times, surface_time, **_):
+    return lambda: gf_selection.def_find_no_deco_gf_high(D, dive_times, surface_time)
+
+
+@benchmark("second_dive_no_dec_time")
+def _(D, dive_times, surface_time, **_):
+    D_feet = D * gf_selection.FEET_IN_METER
+    return lambda: gf_selection.second_dive_no_dec_time(dive_times[0], surface_time, D_feet)
+
+
+@benchmark("second_dive_no_dec_time_grid", cases=None)
+def _():
+    first_dive_time, surface_time, D_feet = np.meshgrid(np.arange(5, 100, 5), np.arange(10, 300, 10), np.arange(35, 140, 5))
+    return lambda: gf_selection.second_dive_no_dec_time(first_dive_time, surface_time, D_feet)
+
+
+def tdt_grid():
+    df = pd.DataFrame([(D, T, 0.02) for D in range(10, 42, 4) for T in range(10, 90, 10)], columns=["D", "T", "pdcs"])
+    df["TDT"] = gf_selection.get_standair_tdt(df["D"].to_numpy(), df["T"].to_numpy(), df["pdcs"].to_numpy())
+    return df
+
+
+@benchmark("parallelize_dataframe", cases=None)
+def _():
+    df = tdt_grid()
+    # Start the worker pool before timing
+    gf_selection.get_pool()
+    return lambda: gf_selection.parallelize_dataframe(df.copy(), gf_selection.fit_gf_to_tdt_df)
+
+
+@benchmark("fit_gf_to_tdt_df_numpy", cases=None)
+def _():
+    df = tdt_grid()
+    return lambda: gf_selection.fit_gf_to_tdt_df(df.copy(), engine="numpy")
+
+
+@benchmark("app.compute_pdcs_results")
+def _(D, T, pdcs, **_):
+    return lambda: app.compute_pdcs_results(D, T, pdcs)
+
+
+@benchmark("app.calculate_he_results")
+def _(D, T, pdcs, he, **_):
+    TDT = gf_selection.get_standair_tdt(D, T, pdcs)
+    return lambda: app.calculate_he_results(1, T, D, TDT, he, pdcs * 100)
+
+
+@benchmark("app.compute_final_results")
+def _(D, T, pdcs, he, surface_time, **_):
+    # The GF High comes from the earlier steps, which the browser keeps in its stores
+    gf_high = gf_selection.lookup_gf_high(T, D, pdcs, he=he) - max(37 - surface_time / 5, 0)
+    return lambda: app.compute_final_results(D, T, 21, he, gf_high)
+
+
+@benchmark("app.pdcs_job_round_trip")
+def _(D, T, pdcs, **_):
+    """Submit the pDCS job and poll until the result is rendered, like the browser does."""
+    def run():
+        # Without clearing, the job queue returns the stored result of the previous round
+        app.job_queue.cache.clear()
+        job, _ = app.submit_pdcs_job(1, pdcs * 100, T, D, None)
+        while app.calculate_pdcs_results(1, job, pdcs * 100)[-1] is False:
+            time.sleep(0.005)
+    return run
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=project_folder,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmarks(names, repeat=5):
+    results = {}
+    for name in names:
+        # Keep the output readable, some functions print their results
+        with contextlib.redirect_stdout(io.StringIO()):
+            func = BENCHMARKS[name]()
+            timings, number = time_function(func, repeat)
+        results[name] = {
+            "min": min(timings),
+            "median": float(np.median(timings)),
+            "mean": float(np.mean(timings)),
+            "repeat": repeat,
+            "number": number,
+        }
+        print(f"{name:45s} {results[name]['median'] * 1000:12.3f} ms")
+    return results
+
+
+def compare(results, previous, threshold):
+    """Print the change of every benchmark and return the names of the ones slower than threshold."""
+    regressions = []
+    print(f"\nCompared to {previous['commit']}:")
+    for name, result in results.items():
+        if name not in previous["results"]:
+            continue
+        ratio = result["median"] / previous["results"][name]["median"]
+        flag = ""
+        if ratio > threshold:
+            regressions.append(name)
+            flag = "  SLOWER"
+        print(f"{name:45s} {ratio:8.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", "--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="result file, by default benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown ratio counted as a regression")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if args.filter in name]
+    commit = git_commit()
+    results = run_benchmarks(names, args.repeat)
+    gf_selection.close_pool()
+
+    output = args.output or os.path.join(results_folder, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump({
+            "commit": commit,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "results": results,
+        }, file, indent=2)
+    print(f"Saved {output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,25 @@
+import os
+import json
+import logging
 import dash
-from dash import html, dcc, Input, Output, State
-import math
-from src import gf_selection
+import flask
+from dash import html, dcc, Input, Output, State, ClientsideFunction, no_update
+from src import batch, gf_selection, jobs, metrics
+
+# All gunicorn workers share the same cache file, so repeated clicks are just lookups
+gf_selection.enable_cache(os.environ.get("GF_CACHE_PATH", gf_selection.DEFAULT_CACHE_PATH))
+
+# Plan calculations run in a local process pool, web workers only schedule them and poll for results
+job_queue = jobs.JobQueue(
+    os.environ.get("GF_JOBS_PATH", jobs.DEFAULT_JOBS_PATH),
+    max_workers=int(os.environ.get("GF_JOB_WORKERS", 2)),
+)
+POLL_INTERVAL = 500  # ms
+
+# Set GF_METRICS=1 to count plan simulations per callback, see /metrics and the callback log lines
+if os.environ.get("GF_METRICS"):
+    metrics.enable()
+    logging.basicConfig(level=logging.INFO)
 
 # Initialize the app
 app = dash.Dash(
@@ -14,6 +32,48 @@ app.title = "Dive Gradient Factor Calculator"
 server = app.server
 
 
+@server.route("/cache-stats")
+def cache_stats():
+    return gf_selection.plan_cache.stats()
+
+
+@server.route("/metrics")
+def metrics_endpoint():
+    if not metrics.enabled:
+        return "Metrics are disabled, set GF_METRICS=1 to enable them\n", 404, {"Content-Type": "text/plain"}
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+
+@server.route("/api/plans", methods=["POST"])
+def plans_endpoint():
+    """Calculate a batch of plans, see src/batch.py for the fields.
+
+    The body is a JSON list of plans, {"plans": [...]}, or NDJSON with one plan per line. Results come back
+    as {"results": [...]} in the order of the plans, or as NDJSON lines {"index": i, ...} as soon as they
+    are ready when the request has ?stream=1 or accepts application/x-ndjson.
+    """
+    request = flask.request
+    try:
+        if request.mimetype == "application/x-ndjson":
+            plans = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        else:
+            plans = request.get_json(force=True, silent=True)
+            if isinstance(plans, dict):
+                plans = plans.get("plans")
+        plans = batch.parse_plans(plans)
+    except ValueError as error:
+        # batch.PlanError or invalid NDJSON
+        return flask.jsonify(error=str(error)), 400
+
+    if request.args.get("stream") or request.accept_mimetypes.best == "application/x-ndjson":
+        def generate():
+            for index, result in batch.iter_results(plans):
+                yield json.dumps({"index": index, **result}) + "\n"
+        return flask.Response(flask.stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    return flask.jsonify(results=batch.results_in_order(plans))
+
+
 # Layout
 app.layout = html.Div(
     [
@@ -62,6 +122,7 @@ app.layout = html.Div(
                                 dcc.Input(id="pdcs", type="number", value=2.0, style={"marginBottom": "10px"}),
                                 html.Button("Next", id="pdcs-next-button", n_clicks=0),
                                 html.Div(id="pdcs-results", style={"marginTop": "10px"}),  # Spacing for clarity
+                                dcc.Interval(id="pdcs-interval", interval=POLL_INTERVAL, disabled=True),
                             ],
                             style={"flex": "1", "padding": "10px"},  # Styling for the left container
                         ),
@@ -158,7 +219,8 @@ app.layout = html.Div(
             ↓ Are you actually making critical decisions based on a random web page?
             """)
         ], id="during-dive", className="card"),
-        html.Div(id="final-results", className="card"),        
+        html.Div(id="final-results", className="card"),
+        dcc.Interval(id="final-interval", interval=POLL_INTERVAL, disabled=True),
         html.Div([
             dcc.Markdown("""
             # References
@@ -201,11 +263,15 @@ app.layout = html.Div(
         dcc.Store(id="gf_high", data=-1),
         dcc.Store(id="gf_high_he", data=-1),
         dcc.Store(id="gf_high_surface_time", data=-1),
+        dcc.Store(id="pdcs-job", data=None),
+        dcc.Store(id="final-job", data=None),
     ]
 )
 
-# Callback for initial calculation
-@app.callback(
+# The PRT and EAD step and the surface time step are closed form formulas, so they run in the browser,
+# see assets/wizard.js
+app.clientside_callback(
+    ClientsideFunction(namespace="wizard", function_name="initial_results"),
     Output("initial-results", "children"),
     Output("references", "style"),
     Output("pdcs-question", "style"),
@@ -213,53 +279,85 @@ app.layout = html.Div(
     Input("initial-calculate-button", "n_clicks"),
     State("depth", "value"),
     State("time", "value"),
-    State("o2_percentage", "value")
+    State("o2_percentage", "value"),
 )
-def calculate_initial_results(n_clicks, D, T, o2_percentage):
-    if n_clicks == 0:
-        return "", {"display": "none"}, {"display": "none"}, 30
 
-    # Perform initial calculations
-    prt = (D / 10 + 1) * math.sqrt(T)
-    P_inert_gas = (D / 10 + 1) * (1 - o2_percentage / 100)
-    EAD = (P_inert_gas / 0.79 - 1) * 10
 
-    initial_results = f"""
-    As the first step we will calculate Pressure Root Time (PRT) for your dive, which is pressure at the bottom (in bar) multiplied by the square root of bottom time (in minutes). PRT can be thought of a measure of nitrogen load.
+def merge_job_metrics(job):
+    """Count the work of a finished background job for the callback that received the result."""
+    data = job_queue.metrics(job)
+    if data is not None:
+        metrics.merge(data)
 
-    Pressure Root Time (PRT) for your dive is {prt:.1f}.
-    
-    According to research, the ZHL-16C decompression algorithm may need adjustment if the PRT exceeds 25. [[6]](#references) This value can be directly used to choose your GF with either [analysis in this repository](https://nbviewer.org/github/hjpulkki/gf-recommendation/blob/main/notebooks/PRT_and_GF.ipynb) or by using a graph from Fraedrich [2]](#references) also mentioned in the [Theoretical diver blog](https://thetheoreticaldiver.org/wordpress/index.php/2019/06/16/setting-gradient-factors-based-on-published-probability-of-dcs/).
 
-    We can also calculate the equivalent air depth (EAD). It can be used to plan a dive with similar nitrogen load and decompression obligation to be approximated using the StandardAir model. [[7]](#references)
+def progress_indicator(status):
+    _, (fraction, message) = status
+    return html.Div([
+        html.Progress(value=str(fraction), max="1", style={"width": "100%"}),
+        html.Div(message or "Calculating..."),
+    ])
 
-    Equivalent Air Depth (EAD): {EAD:.1f} meters
-    """
 
-    return dcc.Markdown(initial_results), {"display": "block"}, {"display": "block"}, EAD
+def compute_pdcs_results(EAD, T, pdcs):
+    """Background job for the pDCS step."""
+    TDT = gf_selection.get_standair_tdt(EAD, T, pdcs)
+    fig = gf_selection.standair_plot(EAD, T, pdcs)
+    jobs.report_progress(0.3, "Fitting GF High to the StandardAir decompression time")
+    gf_high = gf_selection.lookup_gf_high(T, EAD, pdcs)
+    return float(TDT), fig, gf_high
+
+
+# Callbacks for PDCS question and results
+@app.callback(
+    Output("pdcs-job", "data"),
+    Output("pdcs-interval", "disabled"),
+    Input("pdcs-next-button", "n_clicks"),
+    State("pdcs", "value"),
+    State("time", "value"),
+    Input("ead", "data"),
+    State("pdcs-job", "data"),
+)
+@metrics.instrument("submit_pdcs_job")
+def submit_pdcs_job(n_clicks, pdcs_percentage, T, EAD, previous_job):
+    if n_clicks == 0:
+        return None, True
+
+    if job_queue.key("pdcs", EAD, T, pdcs_percentage/100) == previous_job:
+        # Same inputs, the results on the page are still valid
+        return no_update, no_update
+    job = job_queue.submit("pdcs", compute_pdcs_results, EAD, T, pdcs_percentage/100)
+    if previous_job is not None:
+        # Inputs have changed, this session does not wait for the old result anymore
+        job_queue.cancel(previous_job)
+    return job, False
 
 
-# Callback for PDCS question and results
 @app.callback(
     Output("pdcs-results", "children"),
     Output("pdcs-graph", "children"),
     Output("he-question", "style"),
     Output("tdt", "data"),
     Output("gf_high", "data"),
-    Input("pdcs-next-button", "n_clicks"),
+    Output("pdcs-interval", "disabled", allow_duplicate=True),
+    Input("pdcs-interval", "n_intervals"),
+    Input("pdcs-job", "data"),
     State("pdcs", "value"),
-    State("time", "value"),
-    Input("ead", "data"),
+    prevent_initial_call=True,
 )
-def calculate_pdcs_results(n_clicks, pdcs_percentage, T, EAD):
+@metrics.instrument("calculate_pdcs_results")
+def calculate_pdcs_results(n_intervals, job, pdcs_percentage):
     pdcs = pdcs_percentage/100
-    if n_clicks == 0:
-        return "", "", {"display": "none"}, -1, -1
+    if job is None:
+        return "", "", {"display": "none"}, -1, -1, True
 
-    TDT = gf_selection.get_standair_tdt(EAD, T, pdcs)
-    fig = gf_selection.standair_plot(EAD, T, pdcs)
+    status = job_queue.status(job)
+    if status[0] in ("pending", "running"):
+        return progress_indicator(status), no_update, no_update, no_update, no_update, False
+    merge_job_metrics(job)
+    if status[0] == "error":
+        return "Calculation failed. Please check the inputs.", "", {"display": "none"}, -1, -1, True
 
-    gf_high = gf_selection.fit_gf_to_tdt(T, EAD, TDT)
+    TDT, fig, gf_high = status[1]
 
     pdcs_results = f"""
     According to the StandardAir model [7], the Total Decompression Time (TDT) for this dive should be {TDT:.0f} minutes with probability of Decompression Sickness (DCS) being {100*pdcs:.1f}%.
@@ -271,7 +369,7 @@ def calculate_pdcs_results(n_clicks, pdcs_percentage, T, EAD):
 
     pdcs_results = dcc.Markdown(pdcs_results),
     pdcs_graph = dcc.Graph(figure=fig, style={"flex": "1", "padding": "10px", "minHeight": "400px"}),
-    return pdcs_results, pdcs_graph, {"display": "block"}, TDT,  gf_high
+    return pdcs_results, pdcs_graph, {"display": "block"}, TDT,  gf_high, True
 
 
 # Callback for helium percentage question and results
@@ -284,12 +382,14 @@ def calculate_pdcs_results(n_clicks, pdcs_percentage, T, EAD):
     State("ead", "data"),
     Input("tdt", "data"),
     State("he_percentage", "value"),
+    State("pdcs", "value"),
 )
-def calculate_he_results(n_clicks, T, EAD, TDT, he_percentage):
+@metrics.instrument("calculate_he_results")
+def calculate_he_results(n_clicks, T, EAD, TDT, he_percentage, pdcs_percentage):
     if n_clicks == 0:
         return "", {"display": "none"}, -1
 
-    gf_high = gf_selection.fit_gf_to_tdt(T, EAD, TDT, he=he_percentage)
+    gf_high = gf_selection.lookup_gf_high(T, EAD, pdcs_percentage/100, he=he_percentage)
 
     he_results = f"""
     For a total decompression time of {TDT:.0f} minutes (on 21/{he_percentage}), the Gradient Factors can be set to {gf_high}/{gf_high}.
@@ -298,63 +398,86 @@ def calculate_he_results(n_clicks, T, EAD, TDT, he_percentage):
     return dcc.Markdown(he_results), {"display": "block"}, gf_high
 
 
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace="wizard", function_name="surface_time_results"),
     Output("surface-time-results", "children"),
     Output("gf_high_surface_time", "data"),
     Output("personal-adjustment", "style"),
     Input("surface-next-button", "n_clicks"),
+    Input("gf_high_he", "data"),
     State("surface_time", "value"),
-    State("gf_high_he", "data")
 )
-def calculate_surface_time_results(n_clicks, surface_time, gf_high):
-    if n_clicks == 0:
-        return "", -1, {"display": "none"}
 
-    gf_high = gf_high - max(37 - surface_time * 60 / 5, 0)
 
-    surface_time_results = f"""
-    Updated GF High is {gf_high}
-    """
+def compute_final_results(D, T, o2_percentage, he_percentage, gf_high):
+    """Background job for the final plan."""
+    jobs.report_progress(0.5, "Calculating the dive profile")
+    result = gf_selection.get_gf_tdt(T, D, gf_high, he_percentage, o2_percentage, plot_figure=True)
+    if result.status != gf_selection.PLAN_OK:
+        raise ValueError(f"The plan can't be calculated: {result.status}")
+    return result.fig
 
-    return dcc.Markdown(surface_time_results), gf_high, {"display": "block"}
 
 @app.callback(
     Output("low-gradient-info", "style"),
     Output("during-dive", "style"),
-    Output("final-results", "style"),
-    Output("final-results", "children"),
-    Input("initial-calculate-button", "n_clicks"),
-    Input("pdcs-next-button", "n_clicks"),
-    Input("he-next-button", "n_clicks"),
-    Input("surface-next-button", "n_clicks"),
+    Output("final-job", "data"),
+    Output("final-interval", "disabled"),
+    Input("gf_high", "data"),
+    Input("gf_high_he", "data"),
+    Input("gf_high_surface_time", "data"),
     State("depth", "value"),
     State("time", "value"),
     State("o2_percentage", "value"),
-    State("pdcs", "value"),
     State("he_percentage", "value"),
-    State("surface_time", "value"),
+    State("final-job", "data"),
 )
-def calculate_final_results(n_clicks, n_clicks2, n_clicks3, n_clicks4, D, T, o2_percentage, pdcs_percentage, he_percentage, surface_time):
-    pdcs = pdcs_percentage/100
-    final_results = ""
+@metrics.instrument("calculate_final_results")
+def calculate_final_results(gf_high, gf_high_he, gf_high_surface_time, D, T, o2_percentage, he_percentage, previous_job):
+    # The plan uses the GF High of the last step done, the stores are -1 until their step is done
     low_gradient_info = {"display": "none"}
     during_dive = {"display": "none"}
-    final_results_style = {"display": "none"}
-    if n_clicks2 > 0:
-        P_inert_gas = (D / 10 + 1) * (1 - o2_percentage / 100)
-        EAD = (P_inert_gas / 0.79 - 1) * 10
-        TDT = gf_selection.get_standair_tdt(EAD, T, pdcs)
-        gf_high = gf_selection.fit_gf_to_tdt(T, EAD, TDT, he=he_percentage)
-        gf_high -= max(37 - surface_time * 60 / 5, 0)
-        _, fig = gf_selection.get_gf_tdt(T, D, gf_high, he_percentage, o2_percentage, plot_figure=True)
-        final_results = [dcc.Markdown("""# Current plan"""), dcc.Graph(figure=fig)]
-        final_results_style = {"display": "block"}
-    
-    if n_clicks4 > 0:
+    job = None
+    final_gf_high = next((gf for gf in (gf_high_surface_time, gf_high_he, gf_high) if gf != -1), -1)
+    if final_gf_high != -1:
+        job = job_queue.key("final", D, T, o2_percentage, he_percentage, final_gf_high)
+        if job != previous_job:
+            job_queue.submit("final", compute_final_results, D, T, o2_percentage, he_percentage, final_gf_high)
+    if previous_job is not None and previous_job != job:
+        job_queue.cancel(previous_job)
+
+    if gf_high_surface_time != -1:
         low_gradient_info = {"display": "block"}
         during_dive = {"display": "block"}
 
-    return low_gradient_info, during_dive, final_results_style, final_results
+    if job is not None and job == previous_job:
+        # The plan has not changed, so the figure is not polled and sent again
+        return low_gradient_info, during_dive, no_update, no_update
+    return low_gradient_info, during_dive, job, job is None
+
+
+@app.callback(
+    Output("final-results", "style"),
+    Output("final-results", "children"),
+    Output("final-interval", "disabled", allow_duplicate=True),
+    Input("final-interval", "n_intervals"),
+    Input("final-job", "data"),
+    prevent_initial_call=True,
+)
+@metrics.instrument("poll_final_results")
+def poll_final_results(n_intervals, job):
+    if job is None:
+        return {"display": "none"}, "", True
+
+    status = job_queue.status(job)
+    if status[0] in ("pending", "running"):
+        return {"display": "block"}, progress_indicator(status), False
+    merge_job_metrics(job)
+    if status[0] == "error":
+        return {"display": "none"}, "", True
+
+    final_results = [dcc.Markdown("""# Current plan"""), dcc.Graph(figure=status[1])]
+    return {"display": "block"}, final_results, True
 
 
 # Run the app
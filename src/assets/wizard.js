@@ -0,0 +1,49 @@
+// Clientside callbacks for the wizard steps that are closed form formulas, registered in app.py.
+// They run in the browser, so clicking Next on these steps does not call the server.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    wizard: {
+        initial_results: function (n_clicks, D, T, o2_percentage) {
+            if (n_clicks === 0) {
+                return ["", {"display": "none"}, {"display": "none"}, 30];
+            }
+            if (D == null || T == null || o2_percentage == null) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+
+            var prt = (D / 10 + 1) * Math.sqrt(T);
+            var P_inert_gas = (D / 10 + 1) * (1 - o2_percentage / 100);
+            var EAD = (P_inert_gas / 0.79 - 1) * 10;
+
+            var initial_results = [
+                "As the first step we will calculate Pressure Root Time (PRT) for your dive, which is pressure at the bottom (in bar) multiplied by the square root of bottom time (in minutes). PRT can be thought of a measure of nitrogen load.",
+                "",
+                "Pressure Root Time (PRT) for your dive is " + prt.toFixed(1) + ".",
+                "",
+                "According to research, the ZHL-16C decompression algorithm may need adjustment if the PRT exceeds 25. [[6]](#references) This value can be directly used to choose your GF with either [analysis in this repository](https://nbviewer.org/github/hjpulkki/gf-recommendation/blob/main/notebooks/PRT_and_GF.ipynb) or by using a graph from Fraedrich [2]](#references) also mentioned in the [Theoretical diver blog](https://thetheoreticaldiver.org/wordpress/index.php/2019/06/16/setting-gradient-factors-based-on-published-probability-of-dcs/).",
+                "",
+                "We can also calculate the equivalent air depth (EAD). It can be used to plan a dive with similar nitrogen load and decompression obligation to be approximated using the StandardAir model. [[7]](#references)",
+                "",
+                "Equivalent Air Depth (EAD): " + EAD.toFixed(1) + " meters",
+            ].join("\n");
+
+            return [markdownComponent(initial_results), {"display": "block"}, {"display": "block"}, EAD];
+        },
+
+        surface_time_results: function (n_clicks, gf_high_he, surface_time) {
+            // gf_high_he is -1 until the helium step is done
+            if (n_clicks === 0 || gf_high_he === -1) {
+                return ["", -1, {"display": "none"}];
+            }
+            if (surface_time == null) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+
+            var gf_high = gf_high_he - Math.max(37 - surface_time * 60 / 5, 0);
+            return [markdownComponent("Updated GF High is " + gf_high), gf_high, {"display": "block"}];
+        },
+    },
+});
+
+function markdownComponent(text) {
+    return {"namespace": "dash_core_components", "type": "Markdown", "props": {"children": text}};
+}
@@ -0,0 +1,136 @@
+"""Batch planning for the REST endpoint.
+
+A plan has the same inputs as the steps of the web app: depth (m), time (bottom time in minutes),
+o2_percentage, he_percentage, pdcs (%) and surface_time (hours since the previous dive, None for the first
+dive of the day). The results are the numbers the app shows for it: EAD, StandardAir TDT, GF High, GF High
+adjusted for helium and GF High adjusted for the surface interval. A plan with a TDT of 0 is a no deco dive,
+there is no decompression to fit GF High to, so its GF High results are None.
+
+Identical plans are calculated once, and every step runs on arrays of plans, see
+gf_selection.lookup_gf_high_many.
+"""
+import math
+import numpy as np
+
+try:
+    from . import gf_selection
+except ImportError:
+    import gf_selection
+
+FIELDS = ["depth", "time", "o2_percentage", "he_percentage", "pdcs", "surface_time"]
+DEFAULTS = {"o2_percentage": 21, "he_percentage": 0, "pdcs": 2.0, "surface_time": None}
+REQUIRED = ["depth", "time"]
+
+# Plans per chunk of a streamed batch
+CHUNK_SIZE = 500
+
+
+class PlanError(ValueError):
+    """Invalid plan in a batch request."""
+
+
+def parse_plans(plans):
+    """Validate plans (a list of dicts) and return them as a float array with a column per field.
+
+    Missing optional fields get their default value and a missing surface_time is NaN.
+    """
+    if not isinstance(plans, list):
+        raise PlanError("Expected a list of plans")
+    rows = []
+    for index, plan in enumerate(plans):
+        if not isinstance(plan, dict):
+            raise PlanError(f"Plan {index}: expected an object")
+        unknown = set(plan) - set(FIELDS)
+        if unknown:
+            raise PlanError(f"Plan {index}: unknown fields {', '.join(sorted(unknown))}")
+        row = []
+        for field in FIELDS:
+            value = plan.get(field, DEFAULTS.get(field))
+            if value is None:
+                if field in REQUIRED:
+                    raise PlanError(f"Plan {index}: {field} is required")
+                value = math.nan
+            elif isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise PlanError(f"Plan {index}: {field} must be a number")
+            row.append(float(value))
+        depth, time, o2, he, pdcs, surface_time = row
+        if depth <= 0 or time <= 0:
+            raise PlanError(f"Plan {index}: depth and time must be positive")
+        if not (0 < o2 and 0 <= he and o2 + he <= 100):
+            raise PlanError(f"Plan {index}: invalid gas {o2}/{he}")
+        if not 0 < pdcs < 100:
+            raise PlanError(f"Plan {index}: pdcs must be between 0 and 100 %")
+        if surface_time < 0:
+            raise PlanError(f"Plan {index}: surface_time can't be negative")
+        rows.append(row)
+    return np.array(rows, dtype=float).reshape(-1, len(FIELDS))
+
+
+def calculate(plans):
+    """Results for an array of plans from parse_plans, one dict per row."""
+    depth, time, o2, he, pdcs, surface_time = plans.T
+    pdcs = pdcs / 100
+
+    P_inert_gas = (depth / 10 + 1) * (1 - o2 / 100)
+    # Shallow nitrox dives have less nitrogen than air at the surface, they count as surface dives
+    EAD = np.maximum((P_inert_gas / 0.79 - 1) * 10, 0)
+    TDT = gf_selection.get_standair_tdt(EAD, time, pdcs)
+
+    # Both GF High lookups in one call, for the plans that need decompression
+    n = len(plans)
+    deco = TDT > 0
+    m = int(deco.sum())
+    gf_highs = gf_selection.lookup_gf_high_many(
+        np.concatenate((time[deco], time[deco])), np.concatenate((EAD[deco], EAD[deco])),
+        np.concatenate((pdcs[deco], pdcs[deco])), np.concatenate((np.zeros(m), he[deco])),
+    )
+    gf_high = np.full(n, np.nan)
+    gf_high_he = np.full(n, np.nan)
+    gf_high[deco], gf_high_he[deco] = gf_highs[:m], gf_highs[m:]
+    # Same adjustment as the surface interval step of the app, no adjustment for the first dive
+    adjustment = np.where(np.isnan(surface_time), 0, np.maximum(37 - surface_time * 60 / 5, 0))
+    gf_high_surface_time = gf_high_he - adjustment
+
+    return [
+        {
+            "ead": float(EAD[i]),
+            "tdt": float(TDT[i]),
+            "gf_high": int(gf_high[i]) if deco[i] else None,
+            "gf_high_he": int(gf_high_he[i]) if deco[i] else None,
+            "gf_high_surface_time": float(gf_high_surface_time[i]) if deco[i] else None,
+        }
+        for i in range(n)
+    ]
+
+
+def iter_results(plans, chunk_size=CHUNK_SIZE):
+    """Calculate distinct plans in chunks and yield (index, result) for every plan of the batch.
+
+    Results come in the order of the first occurrence of each distinct plan, so duplicates of a plan are
+    yielded together with it.
+    """
+    # NaN never equals itself, so np.unique would keep every plan without surface_time apart
+    keys = np.nan_to_num(plans, nan=-1.0)
+    unique, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    order = np.argsort(first)
+    duplicates = np.argsort(inverse, kind="stable")
+    starts = np.searchsorted(inverse[duplicates], np.arange(len(unique) + 1))
+    for start in range(0, len(order), chunk_size):
+        chunk = order[start:start + chunk_size]
+        for u, result in zip(chunk, calculate(plans[first[chunk]])):
+            for index in duplicates[starts[u]:starts[u + 1]]:
+                yield int(index), result
+
+
+def results_in_order(plans):
+    """Results for an array of plans from parse_plans, in the same order."""
+    results = [None] * len(plans)
+    for index, result in iter_results(plans, chunk_size=max(len(plans), 1)):
+        results[index] = result
+    return results
+
+
+def plan_batch(plans):
+    """Results for a list of plan dicts, in the same order."""
+    return results_in_order(parse_plans(plans))
@@ -0,0 +1,222 @@
+"""Decompression planner for dives with deco gases.
+
+plan_deco searches deco gases, their switch depths and GF High together for a square dive with a target
+StandardAir TDT. Every gas configuration is fitted like gf_selection.fit_gf_to_tdt: its GF High is the
+highest one with longer decompression than the target. StandardAir gives the decompression time that is
+acceptable on air, so the best configurations are the ones where that time buys the lowest GF High, that
+is the most conservative gradient factors. Ties go to fewer deco gases and then to the shorter TDT.
+
+A configuration is infeasible when its decompression is not longer than the target even at the lowest GF
+High of the grid. Its gf_high is NaN and its tdt is the decompression time at that GF. Infeasible plans
+rank after all feasible ones, the ones closest to the target first.
+
+The descent and bottom are simulated once and shared by all configurations. Before the full search, every
+configuration gets a lower bound for its GF High from a cheaper run that breathes a single gas for the
+whole ascent, with no more nitrogen and helium than any gas of the configuration. The tissues never load
+more than with the configuration itself, so the ascent is never longer (with helium the M-values depend
+on the tissue mix and the bound is approximate). Configurations are fitted in waves, most promising first,
+and the ones whose bound can no longer reach the best found so far are skipped.
+
+Fitting a chunk of configurations is a handful of vectorized ascent simulations, so the worker pool only
+pays off for large searches: the cost of the search is estimated from the time of the bound fit, and the
+pool is used when that is over parallel_seconds. The default gases give about 20 configurations, which
+are fitted in a fraction of a second in the calling process.
+
+    result = plan_deco(T=25, D=45, TDT=60, he=20, time_budget=5)
+    for plan in result.plans:
+        print(plan.gf_high, plan.tdt, plan.deco_gases)
+"""
+import time
+import itertools
+import collections
+import multiprocessing
+import numpy as np
+
+try:
+    from . import gf_selection, metrics, zhl16c
+except ImportError:
+    import gf_selection
+    import metrics
+    import zhl16c
+
+# Deco gases to choose from as (o2, he) percentages
+DEFAULT_GASES = [(50, 0), (80, 0), (100, 0)]
+MAX_DECO_GASES = 2
+MAX_PPO2 = 1.6  # bar
+# Switch depths tried for every gas: its maximum operating depth on the stop grid and this many stops shallower
+SWITCH_STEPS = 2
+STOP_INTERVAL = 3
+LAST_STOP = 3
+# Same GF High grid as fit_gf_to_tdt
+GF_MAX = 100
+GF_MIN = 6
+# Estimated seconds of a search in one process above which the configurations are fitted in the worker pool
+PARALLEL_SECONDS = 1.0
+
+DecoGas = collections.namedtuple("DecoGas", ["switch_depth", "o2", "he"])
+# deco_gases is a tuple of DecoGas, deepest switch first, and empty for the bottom gas only. gf_high is
+# NaN and feasible False when no GF High on the grid gives longer decompression than the target.
+DecoPlan = collections.namedtuple("DecoPlan", ["deco_gases", "gf_high", "tdt", "feasible"])
+# complete is False when the time budget ran out before every configuration was fitted or pruned
+PlannerResult = collections.namedtuple("PlannerResult", ["plans", "evaluated", "pruned", "complete", "seconds"])
+
+
+def max_operating_depth(o2, max_ppo2=MAX_PPO2):
+    """Deepest depth in meters where the partial pressure of oxygen stays below max_ppo2."""
+    return float(zhl16c.pressure_to_depth(max_ppo2 / (o2 / 100)))
+
+
+def switch_depths(o2, D, max_ppo2=MAX_PPO2, switch_steps=SWITCH_STEPS):
+    """Switch depths to try for a gas: the deepest stop above D within the maximum operating depth and
+    switch_steps stops shallower."""
+    deepest = min(max_operating_depth(o2, max_ppo2), D - 1e-9)
+    deepest = np.floor(deepest / STOP_INTERVAL + 1e-9) * STOP_INTERVAL
+    depths = deepest - STOP_INTERVAL * np.arange(switch_steps + 1)
+    return [float(depth) for depth in depths if depth >= LAST_STOP]
+
+
+def candidate_configurations(D, o2=21, gases=DEFAULT_GASES, max_gases=MAX_DECO_GASES, max_ppo2=MAX_PPO2,
+                             switch_steps=SWITCH_STEPS):
+    """All gas configurations for a dive to D: up to max_gases gases richer in oxygen than the bottom gas,
+    each richer gas switched to at a shallower depth. The first one is the bottom gas only."""
+    gases = sorted({(float(gas_o2), float(gas_he)) for gas_o2, gas_he in gases if gas_o2 > o2})
+    configurations = [()]
+    for k in range(1, max_gases + 1):
+        for mixes in itertools.combinations(gases, k):
+            if len({gas_o2 for gas_o2, _ in mixes}) < k:
+                continue
+            options = [switch_depths(gas_o2, D, max_ppo2, switch_steps) for gas_o2, _ in mixes]
+            for depths in itertools.product(*options):
+                if all(deeper > shallower for deeper, shallower in zip(depths, depths[1:])):
+                    configurations.append(tuple(DecoGas(depth, *mix) for depth, mix in zip(depths, mixes)))
+    return configurations
+
+
+def _bound_gas(configuration, o2, he):
+    """(o2, he) of the gas with the least nitrogen and helium of the bottom gas and the configuration."""
+    mixes = [(o2, he)] + [(gas.o2, gas.he) for gas in configuration]
+    n2 = min(100 - gas_o2 - gas_he for gas_o2, gas_he in mixes)
+    bound_he = min(gas_he for _, gas_he in mixes)
+    return 100 - n2 - bound_he, bound_he
+
+
+def _deco_gas_arrays(configurations):
+    """Configurations as a zhl16c deco_gases list of (N,) arrays, padded with gases that are never used."""
+    n_gases = max([len(configuration) for configuration in configurations] + [0])
+    switch = np.full((len(configurations), n_gases), np.nan)
+    mixes = np.zeros((len(configurations), n_gases, 2))
+    for row, configuration in enumerate(configurations):
+        for column, gas in enumerate(configuration):
+            switch[row, column] = gas.switch_depth
+            mixes[row, column] = gas.o2, gas.he
+    return [(switch[:, column], mixes[:, column, 0], mixes[:, column, 1]) for column in range(n_gases)]
+
+
+def _fit_deco_gases(task):
+    """GF High and TDT for every configuration of a task, the worker function of plan_deco.
+
+    task is (bottom, TDT, n, deco_gases) with a single dive in bottom and deco_gases from _deco_gas_arrays
+    for n configurations. GF High is NaN where no GF on the grid gives longer decompression than TDT.
+    """
+    bottom, TDT, n, deco_gases = task
+
+    def deco_longer_than_tdt(rows, gf):
+        gases = [tuple(x[rows] for x in gas) for gas in deco_gases]
+        result = zhl16c.simulate_ascent(bottom, gf, max_tdt=TDT, deco_gases=gases)
+        return result.failed | result.cut_off | (result.tdt > TDT)
+
+    gf_high = gf_selection.search_gf_high_batch(deco_longer_than_tdt, GF_MAX, GF_MIN, n)
+    result = zhl16c.simulate_ascent(bottom, np.nan_to_num(gf_high, nan=GF_MIN), deco_gases=deco_gases)
+    return gf_high, np.where(result.failed, np.inf, result.tdt)
+
+
+def _fit_indexed(item):
+    index, task = item
+    return index, _fit_deco_gases(task)
+
+
+def _rank(plan):
+    if plan.feasible:
+        return (0, plan.gf_high, len(plan.deco_gases), plan.tdt)
+    return (1, -plan.tdt, len(plan.deco_gases), 0)
+
+
+def _evaluate(tasks, pool):
+    """(index, result) of every task in the order they complete."""
+    if pool is None:
+        return map(_fit_indexed, enumerate(tasks))
+    return pool.imap_unordered(_fit_indexed, enumerate(tasks))
+
+
+def plan_deco(T, D, TDT, o2=21, he=0, gases=DEFAULT_GASES, max_gases=MAX_DECO_GASES, max_ppo2=MAX_PPO2,
+              switch_steps=SWITCH_STEPS, top=5, time_budget=None, parallel=True, num_workers=None,
+              chunk_size=32, parallel_seconds=PARALLEL_SECONDS):
+    """Best deco gas configurations and GF High for a square dive with target total decompression time TDT.
+
+    T (min), D (m), o2 and he (%) describe the dive and bottom gas, gases are the (o2, he) deco gases to
+    choose from, see candidate_configurations. Returns a PlannerResult with the top best DecoPlans.
+
+    time_budget is in seconds. It is checked every time a chunk of chunk_size configurations is fitted,
+    and the search returns the best plans so far once it is over. With parallel, waves of a chunk per
+    worker run in the worker pool of gf_selection when fitting all configurations in this process is
+    estimated to take longer than parallel_seconds.
+    """
+    start = time.perf_counter()
+    bottom = zhl16c.simulate_bottom(T, D, he=he, o2=o2)
+    configurations = candidate_configurations(D, o2, gases, max_gases, max_ppo2, switch_steps)
+
+    # Lower bounds from single gas ascents, one per distinct bound gas
+    bound_gases = [_bound_gas(configuration, o2, he) for configuration in configurations]
+    distinct = sorted(set(bound_gases))
+    bound_arrays = [(np.full(len(distinct), np.inf), *np.array(distinct, dtype=float).T)]
+    bound_start = time.perf_counter()
+    bound_gf, _ = _fit_deco_gases((bottom, TDT, len(distinct), bound_arrays))
+    # A chunk costs about as much as the bound fit, which runs the same search for a few rows
+    serial_seconds = (time.perf_counter() - bound_start) * -(-len(configurations) // chunk_size)
+    # A configuration can be feasible even when its bound gas isn't
+    bound_gf = dict(zip(distinct, np.nan_to_num(bound_gf, nan=GF_MIN)))
+    bounds = np.array([bound_gf[gas] for gas in bound_gases])
+
+    pool = None
+    wave_size = chunk_size
+    num_workers = num_workers or multiprocessing.cpu_count()
+    if parallel and num_workers > 1 and serial_seconds > parallel_seconds:
+        pool = gf_selection.get_pool(num_workers)
+        # Smaller chunks when there are too few configurations to give every worker a full one
+        chunk_size = max(1, min(chunk_size, -(-len(configurations) // num_workers)))
+        wave_size = chunk_size * num_workers
+
+    order = sorted(range(len(configurations)), key=lambda k: (bounds[k], len(configurations[k])))
+    plans = []
+    evaluated = pruned = 0
+    complete = True
+    while order:
+        if len(plans) >= top and plans[top - 1].feasible:
+            # A configuration can't get a GF High below its bound
+            threshold = plans[top - 1].gf_high
+            kept = [k for k in order if bounds[k] <= threshold]
+            pruned += len(order) - len(kept)
+            order = kept
+            if not order:
+                break
+        wave, order = order[:wave_size], order[wave_size:]
+        chunks = [wave[i:i + chunk_size] for i in range(0, len(wave), chunk_size)]
+        tasks = [(bottom, TDT, len(chunk), _deco_gas_arrays([configurations[k] for k in chunk])) for chunk in chunks]
+        remaining = len(chunks)
+        for index, (gf_high, tdt) in _evaluate(tasks, pool):
+            for k, gf, deco_time in zip(chunks[index], gf_high, tdt):
+                feasible = not np.isnan(gf)
+                plans.append(DecoPlan(configurations[k], int(gf) if feasible else np.nan, float(deco_time), feasible))
+            evaluated += len(chunks[index])
+            remaining -= 1
+            if time_budget is not None and time.perf_counter() - start > time_budget and (remaining or order):
+                # The workers finish the chunks they were given, their results are dropped
+                complete = False
+                break
+        plans.sort(key=_rank)
+        if not complete:
+            break
+
+    metrics.increment("deco_configurations", evaluated, result="evaluated")
+    metrics.increment("deco_configurations", pruned, result="pruned")
+    return PlannerResult(plans[:top], evaluated, pruned, complete, time.perf_counter() - start)
@@ -0,0 +1,101 @@
+"""Dive day planner with the tissue state carried over from dive to dive.
+
+The tissue state of the diver is kept as a snapshot after every dive and surface interval, so planning
+the next dive continues from the last snapshot instead of simulating the earlier dives again, and planning
+a day costs the same for every dive.
+
+The GF recommendation for a dive follows gf_selection.find_no_deco_gf_high: it is the highest GF High at
+which the dive, starting from the current tissues, needs decompression. When the dive is planned at the
+no deco limit of the tables, as in the repetitive dive analysis, that is the GF at which the dive computer
+agrees with the tables. All GF candidates are simulated with a single vectorized zhl16c call. Runs that
+fail count as not needing deco in both. Unlike find_no_deco_gf_high, which takes the highest ceiling of
+the first and second dive, only the ceiling of the dive being planned counts, so the two agree when the
+earlier dives were no deco dives.
+"""
+import collections
+import numpy as np
+
+try:
+    from . import zhl16c
+except ImportError:
+    import zhl16c
+
+# GF High candidates, the same range as find_no_deco_gf_high
+GF_CANDIDATES = np.arange(120, 50, -1)
+
+# gf_high is None when the dive needs no deco at any candidate, tissues is the snapshot after the dive
+PlannedDive = collections.namedtuple(
+    "PlannedDive", ["depth", "time", "surface_time", "gf_high", "dive_gf", "tdt", "max_ceiling", "tissues"]
+)
+
+
+def tissue_snapshot(tissues):
+    """Tissues of a single diver as a (2, 16) array of N2 and He pressures."""
+    return np.stack([tissues.n2[0], tissues.he[0]])
+
+
+def tissues_from_snapshot(snapshot):
+    snapshot = np.asarray(snapshot, dtype=float)
+    return zhl16c.Tissues(snapshot[0][np.newaxis].copy(), snapshot[1][np.newaxis].copy())
+
+
+def no_deco_gf_high(tissues, depth, time, he=0, o2=21, gf_candidates=GF_CANDIDATES):
+    """Highest GF High at which the dive needs decompression, None if it needs none at any candidate.
+
+    A run that fails, which only happens with very long decompression, counts as not needing deco, like
+    the -100 ceiling of get_max_ceiling in find_no_deco_gf_high and get_gf_to_repetative_dives.
+    """
+    n = len(gf_candidates)
+    repeated = zhl16c.Tissues(np.repeat(tissues.n2, n, axis=0), np.repeat(tissues.he, n, axis=0))
+    result = zhl16c.simulate_square_dives(time, depth, gf_candidates, he=he, o2=o2, tissues=repeated)
+    needs_deco = (result.max_ceiling > 0) & ~result.failed
+    if not needs_deco.any():
+        return None
+    return int(np.max(np.asarray(gf_candidates)[needs_deco]))
+
+
+class DiveDay:
+    """Dives of one day, planned one after another.
+
+    snapshot is the tissue state to start from (see tissue_snapshot), for example from a plan saved
+    earlier, by default a diver saturated with air at the surface.
+    """
+
+    def __init__(self, snapshot=None, gf_candidates=GF_CANDIDATES):
+        self.tissues = zhl16c.surface_tissues(1) if snapshot is None else tissues_from_snapshot(snapshot)
+        self.gf_candidates = gf_candidates
+        self.dives = []
+
+    def snapshot(self):
+        """Current tissue state as a (2, 16) array."""
+        return tissue_snapshot(self.tissues)
+
+    def add_dive(self, depth, time, surface_time=0, he=0, o2=21, gf_high=None):
+        """Plan the next dive after surface_time minutes at the surface and return a PlannedDive.
+
+        The dive is simulated with gf_high, by default the recommendation, and the tissues after it are
+        the starting point of the next dive.
+        """
+        tissues = zhl16c.surface_interval(self.tissues, surface_time) if surface_time > 0 else self.tissues
+        recommendation = no_deco_gf_high(tissues, depth, time, he, o2, self.gf_candidates)
+        dive_gf = gf_high if gf_high is not None else recommendation
+        if dive_gf is None:
+            # No deco at any GF, the profile is the same for all of them
+            dive_gf = int(np.max(self.gf_candidates))
+
+        result = zhl16c.simulate_square_dives(time, depth, dive_gf, he=he, o2=o2, tissues=tissues)
+        dive = PlannedDive(
+            depth, time, surface_time, recommendation, dive_gf,
+            float(result.tdt[0]), float(result.max_ceiling[0]), tissue_snapshot(result.tissues),
+        )
+        self.tissues = result.tissues
+        self.dives.append(dive)
+        return dive
+
+
+def plan_dive_day(depths, times, surface_times, he=0, o2=21):
+    """Plan a list of dives. surface_times[k] is the time at the surface before dive k (minutes), the first
+    one is normally 0. Returns a list of PlannedDive."""
+    day = DiveDay()
+    return [day.add_dive(depth, time, surface_time, he, o2)
+            for depth, time, surface_time in zip(depths, times, surface_times)]
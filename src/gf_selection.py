@@ -1,12 +1,15 @@
 import os
 import sys
 import math
+import atexit
+import collections
 import numpy as np
-import pandas as pd
-from matplotlib import pyplot as plt
-from multiprocessing import Pool, cpu_count
-import plotly.graph_objects as go
-import plotly.express as px
+
+# pandas, plotting libraries, multiprocessing and pydplan are imported where they are needed. This keeps
+# importing this module fast for the web app, which mostly needs get_standair_tdt and the GF table.
+# tests/test_import_time.py checks that, and that python -X importtime reports at most IMPORT_TIME_BUDGET
+# seconds for this module including numpy.
+IMPORT_TIME_BUDGET = 0.2
 
 # script_dir = Path(__file__).resolve().parent
 #data_dir = script_dir.parent / "data"
@@ -17,43 +20,108 @@ data_folder = os.path.join(project_folder, "data")
 
 sys.path.insert(0, os.path.abspath(pyplan_root))
 
-from pydplan.pydplan_profiletools import calculatePlan, DivePlan, TankType
-
+try:
+    from .plan_cache import PlanCache, DEFAULT_CACHE_PATH
+    from . import gf_table, metrics, padi, standair, zhl16c
+    from .standair import a, b, c, d, f, g, FEET_IN_METER
+except ImportError:
+    # Imported as a top level module from the notebooks
+    from plan_cache import PlanCache, DEFAULT_CACHE_PATH
+    import gf_table
+    import metrics
+    import padi
+    import standair
+    import zhl16c
+    from standair import a, b, c, d, f, g, FEET_IN_METER
 
-# Source: Van Liew, H. D., and E. T. Flynn. A simple probabilistic model for estimating the risk of standard air dives. NEDU TR 04-42, Navy Experimental Diving Unit, 2004.
-a = -6.022169
-b = 86.596315
-c = 25.091718
-d = 0.002929
-f = 0.918547
-g = -170.304442
-
-FEET_IN_METER = 3.2808399
 
 # These are based on PADI tables Product No. 66054 Ver 1.2 (Rev. 02/03)
 # https://www.a1scubadiving.com/wp-content/uploads/2018/06/PADI-Recreational-Dive-Table-Planner.pdf
-btt = pd.read_csv(os.path.join(data_folder, "bottom_time.csv"))
-sfi = pd.read_csv(os.path.join(data_folder, "surface_interval.csv"))
-rnt = pd.read_csv(os.path.join(data_folder, "residual_nitrogen_time.csv"))
+# The tables are loaded on first use: btt, sfi and rnt as DataFrames and padi_tables compiled for lookups.
+PADI_CSV_FILES = {
+    "btt": os.path.join(data_folder, "bottom_time.csv"),
+    "sfi": os.path.join(data_folder, "surface_interval.csv"),
+    "rnt": os.path.join(data_folder, "residual_nitrogen_time.csv"),
+}
+PADI_TABLES_CACHE = os.path.join(data_folder, "padi_tables.npz")
+_padi_dataframes = None
+_padi_tables = None
+
+
+def load_padi_dataframes():
+    global _padi_dataframes
+    if _padi_dataframes is None:
+        import pandas as pd
+        _padi_dataframes = {name: pd.read_csv(path) for name, path in PADI_CSV_FILES.items()}
+    return _padi_dataframes
+
+
+def get_padi_tables():
+    """Compiled PADI tables, read from the binary cache if it is newer than the CSV files."""
+    global _padi_tables
+    if _padi_tables is None:
+        csv_time = max(os.path.getmtime(path) for path in PADI_CSV_FILES.values())
+        if os.path.exists(PADI_TABLES_CACHE) and os.path.getmtime(PADI_TABLES_CACHE) >= csv_time:
+            _padi_tables = padi.load_tables(PADI_TABLES_CACHE)
+        else:
+            dfs = load_padi_dataframes()
+            _padi_tables = padi.compile_tables(dfs["btt"], dfs["sfi"], dfs["rnt"])
+            try:
+                padi.save_tables(_padi_tables, PADI_TABLES_CACHE)
+            except OSError:
+                # Read only data folder, compile again next time
+                pass
+    return _padi_tables
+
+
+def __getattr__(name):
+    if name in PADI_CSV_FILES:
+        return load_padi_dataframes()[name]
+    if name == "padi_tables":
+        return get_padi_tables()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Shared cache for plan calculations, see enable_cache
+plan_cache = None
+
+
+def enable_cache(path=DEFAULT_CACHE_PATH, **kwargs):
+    """Cache results of get_gf_tdt and fit_gf_to_tdt in a file shared by all processes."""
+    global plan_cache
+    plan_cache = PlanCache(path, **kwargs)
+    return plan_cache
+
+
+def disable_cache():
+    global plan_cache
+    plan_cache = None
 
 
 def get_standair_tdt(D, T, pdcs):
-    D_feet = D * FEET_IN_METER
-    logit = math.log(pdcs / (1 - pdcs))
-    numerator = b*(D_feet-c)*(1-np.exp(-d * T**f))
-    TDT = numerator / (logit - a) + g
-
-    # Negative values correspond to no deco. Set TDT to 0.
-    TDT = np.clip(TDT, a_min=0, a_max = np.inf)
-    
-    return TDT
+    # Negative values correspond to no deco and are set to 0. D, T and pdcs can be arrays, see standair.
+    return standair.tdt(D, T, pdcs)
 
 def standair_plot(D, T_ref, pdcs_ref):
+    if plan_cache is None:
+        fig = _standair_figure(D, T_ref, pdcs_ref)
+    else:
+        fig = plan_cache.memoize("standair_plot", _standair_figure, D, T_ref, pdcs_ref)
+    TDT_ref = get_standair_tdt(D, T_ref, pdcs_ref)
+    print(f"According to the StandardAir model [7], the Total Decompression Time (TDT) for this dive should be {TDT_ref:.0f} minutes with probability of Decompression Sickness (DCS) being {100*pdcs_ref:.1f}%.")
+    return fig
+
+
+@metrics.timed("figure")
+def _standair_figure(D, T_ref, pdcs_ref):
+    import plotly.graph_objects as go
+
     T = np.linspace(0, T_ref * 2, 100)
     fig = go.Figure()
 
-    for pdcs in [0.01, 0.015, 0.02, 0.025, 0.03,]:
-        TDT = get_standair_tdt(D, T, pdcs)
+    pdcs_values = np.array([0.01, 0.015, 0.02, 0.025, 0.03,])
+    TDT_curves = get_standair_tdt(D, T, pdcs_values[:, np.newaxis])
+    for pdcs, TDT in zip(pdcs_values, TDT_curves):
         fig.add_trace(go.Scatter(
             x=T,
             y=TDT,
@@ -78,12 +146,83 @@ def standair_plot(D, T_ref, pdcs_ref):
         legend=dict(title='Probability of DCS'),
         template='plotly_white'
     )
-    # fig.show()
-    print(f"According to the StandardAir model [7], the Total Decompression Time (TDT) for this dive should be {TDT_ref:.0f} minutes with probability of Decompression Sickness (DCS) being {100*pdcs:.1f}%.")
     return fig
 
 
-def get_gf_tdt(T, D, gf_high, he, o2, plot_figure=False):
+# Status of a PlanResult
+PLAN_OK = "ok"
+# The plan went over the iteration limit of calculatePlan or the max_deco_time of zhl16c, which only
+# happens with very long decompression. tdt is inf.
+PLAN_ITERATION_LIMIT = "iteration_limit"
+# The simulation was stopped once the decompression time was longer than max_tdt. tdt is a lower bound.
+PLAN_CUT_OFF = "cut_off"
+
+
+class PlanResult(collections.namedtuple("PlanResult", ["tdt", "fig"])):
+    """Result of get_gf_tdt. It unpacks as (tdt, fig) like the tuple get_gf_tdt used to return, so
+    deco_time, fig = get_gf_tdt(...) keeps working, and status is an extra attribute."""
+
+    def __new__(cls, tdt, status, fig):
+        self = super().__new__(cls, tdt, fig)
+        self.status = status
+        return self
+
+    def __getnewargs__(self):
+        # Used by pickle, e.g. in the plan cache
+        return self.tdt, self.status, self.fig
+
+    def __repr__(self):
+        return f"PlanResult(tdt={self.tdt!r}, status={self.status!r}, fig={self.fig!r})"
+
+
+def get_gf_tdt(T, D, gf_high, he, o2, plot_figure=False, backend="pydplan", max_tdt=None, deco_gases=()):
+    """Total decompression time of a square dive with symmetric gradient factors.
+
+    Returns a PlanResult that unpacks as (tdt, fig). tdt is always a number, so result.tdt > target works
+    for every result.status, and fig is the profile figure if plot_figure, otherwise None.
+    backend="pydplan" runs calculatePlan, backend="schreiner" uses the closed form stop solver in zhl16c.
+    With max_tdt the schreiner backend stops as soon as the decompression time is longer than max_tdt.
+    calculatePlan can't be stopped early, so pydplan always simulates the whole plan and fit_gf_to_tdt
+    saves calculatePlan runs by starting its search from the schreiner fit instead.
+
+    deco_gases is a tuple of (switch_depth, o2, he) gases for the ascent, deepest switch first, see
+    zhl16c.simulate_ascent. Only the schreiner backend supports them.
+    """
+    deco_gases = tuple(tuple(gas) for gas in deco_gases)
+    if backend == "pydplan":
+        # calculatePlan ignores max_tdt, so plans for different targets share the cache entry
+        max_tdt = None
+    if plan_cache is None:
+        return _calculate_gf_tdt(T, D, gf_high, he, o2, plot_figure, backend, max_tdt, deco_gases)
+    # Results with a figure are kept under their own name, so the plain results stay small
+    name = "gf_tdt_result_figure" if plot_figure else "gf_tdt_result"
+    return plan_cache.memoize(name, _calculate_gf_tdt, T, D, gf_high, he, o2, plot_figure, backend, max_tdt, deco_gases)
+
+
+def _calculate_gf_tdt(T, D, gf_high, he, o2, plot_figure=False, backend="pydplan", max_tdt=None, deco_gases=()):
+    if backend == "schreiner":
+        metrics.increment("simulations", backend=backend)
+        with metrics.phase("simulate"):
+            result = zhl16c.simulate_square_dives(T, D, gf_high, he=he, o2=o2, record_profile=plot_figure,
+                                                  max_tdt=max_tdt, deco_gases=deco_gases)
+        if result.failed[0]:
+            metrics.increment("fallbacks", reason="iteration_limit")
+            return PlanResult(math.inf, PLAN_ITERATION_LIMIT, None)
+        if result.cut_off[0]:
+            metrics.increment("cut_offs")
+            return PlanResult(float(result.tdt[0]), PLAN_CUT_OFF, None)
+        fig = None
+        if plot_figure:
+            times, depths, _ = result.profile
+            fig = _profile_figure(times[:, 0], depths[:, 0], o2, he, gf_high, gf_high)
+        return PlanResult(float(result.tdt[0]), PLAN_OK, fig)
+    elif backend != "pydplan":
+        raise ValueError(f"Unknown backend {backend}")
+    if deco_gases:
+        raise ValueError("Deco gases are only supported by the schreiner backend")
+
+    from pydplan.pydplan_profiletools import calculatePlan, DivePlan, TankType
+
     dive_plan = DivePlan()
     dive_plan.setDefaults()
 
@@ -107,76 +246,454 @@ def get_gf_tdt(T, D, gf_high, he, o2, plot_figure=False):
     dive_plan.tankList[TankType.DECO2].use = False
     dive_plan.tankList[TankType.TRAVEL].use = False
 
+    metrics.increment("simulations", backend=backend)
     try:
-        model_run = calculatePlan(dive_plan)
+        with metrics.phase("simulate"):
+            model_run = calculatePlan(dive_plan)
     except ValueError:
-        return -1
+        metrics.increment("fallbacks", reason="iteration_limit")
+        return PlanResult(math.inf, PLAN_ITERATION_LIMIT, None)
 
     dive_time = dive_plan.profileSampled[-1].time/60
     tdt_gf = dive_time-T
 
     fig = None
     if plot_figure:
-        fig = px.line(
-            x=[x.time/60 for x in dive_plan.profileSampled], 
-            y=[-x.depth for x in dive_plan.profileSampled], 
-        )
-        
-        fig.update_layout(
-        title=f"Dive profile. Gas: {o2}/{he} GF: {dive_plan.GFlow*100:.0f}/{dive_plan.GFhigh*100:.0f}",
-            xaxis_title='Time',
-            yaxis_title='Depth',
-            legend=dict(title='Legend'),
-            template='plotly_white'
+        fig = _profile_figure(
+            [x.time/60 for x in dive_plan.profileSampled],
+            [x.depth for x in dive_plan.profileSampled],
+            o2, he, dive_plan.GFlow*100, dive_plan.GFhigh*100,
         )
 
-    return tdt_gf, fig
+    return PlanResult(tdt_gf, PLAN_OK, fig)
+
+
+def profile_breakpoints(times, depths):
+    """Reduce a sampled dive profile to the points where the ascent or descent rate changes.
+
+    Drawing straight lines between the breakpoints gives the same profile, with a few dozen points instead
+    of one per sample.
+    """
+    times = np.asarray(times, dtype=float)
+    depths = np.asarray(depths, dtype=float)
+    if len(times) <= 2:
+        return times, depths
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.diff(depths) / np.diff(times)
+    keep = np.ones(len(times), dtype=bool)
+    keep[1:-1] = ~np.isclose(rate[1:], rate[:-1], rtol=1e-6, atol=1e-9)
+    return times[keep], depths[keep]
 
-def fit_gf_to_tdt(T, D, TDT, he=0, o2=21, verbose=False):
-    for gf_high in range(100, 5, -1):
-        deco_time, _ = get_gf_tdt(T, D, gf_high, he, o2)
-        if deco_time > TDT:
-            if verbose:
-                print(f"Found {gf_high} for {T} min and {D}m")
-            break
+
+@metrics.timed("figure")
+def _profile_figure(times, depths, o2, he, gf_low, gf_high):
+    import plotly.express as px
+
+    times, depths = profile_breakpoints(times, depths)
+    fig = px.line(
+        x=times,
+        y=-depths,
+    )
+
+    fig.update_layout(
+        title=f"Dive profile. Gas: {o2}/{he} GF: {gf_low:.0f}/{gf_high:.0f}",
+        xaxis_title='Time',
+        yaxis_title='Depth',
+        legend=dict(title='Legend'),
+        template='plotly_white'
+    )
+    return fig
+
+def search_gf_high(predicate, gf_max, gf_min, precision=1, start=None):
+    """Find the highest GF on a grid from gf_max down to gf_min for which predicate(gf) is True.
+
+    The predicate must be monotonic in GF: if it holds for some GF it holds for every lower GF too,
+    which is the case for decompression time and ceilings in ZHL-16C. Bisection over the grid needs
+    about log2(n) predicate calls instead of n. Returns None if the predicate is False on the whole grid.
+
+    start is a guess for the answer, e.g. the result of a neighbouring dive. The search gallops outwards
+    from it before bisecting, so a correct guess is confirmed with two predicate calls. The result does
+    not depend on the guess.
+    """
+    predicate = metrics.counted(predicate, "search_steps")
+    n = int(math.floor((gf_max - gf_min) / precision + 1e-9))
+    # The answer is the smallest grid index k in [lo, hi] with predicate True, n + 1 if there is none
+    lo, hi = 0, n + 1
+    if start is not None:
+        k = min(max(int(round((gf_max - start) / precision)), 0), n)
+        step = 1
+        if predicate(gf_max - k * precision):
+            hi = k
+            while hi - step >= 0:
+                if not predicate(gf_max - (hi - step) * precision):
+                    lo = hi - step + 1
+                    break
+                hi -= step
+                step *= 2
+        else:
+            lo = k + 1
+            while lo + step - 1 <= n:
+                if predicate(gf_max - (lo + step - 1) * precision):
+                    hi = lo + step - 1
+                    break
+                lo += step
+                step *= 2
+    while lo < hi:
+        k = (lo + hi) // 2
+        if predicate(gf_max - k * precision):
+            hi = k
+        else:
+            lo = k + 1
+    if lo > n:
+        return None
+    gf_high = gf_max - lo * precision
+    return int(gf_high) if float(precision).is_integer() else round(gf_high, 10)
+
+
+def search_gf_high_batch(predicate, gf_max, gf_min, n_rows, precision=1):
+    """Vectorized search_gf_high for n_rows searches at once.
+
+    predicate(rows, gf) gets the indices of the rows still being searched and an array of GF candidates
+    for them, and returns a boolean array. Rows where the predicate is never True get NaN.
+    """
+    n = int(math.floor((gf_max - gf_min) / precision + 1e-9))
+    lo = np.zeros(n_rows, dtype=int)
+    hi = np.full(n_rows, n + 1)
+    while (lo < hi).any():
+        rows = np.flatnonzero(lo < hi)
+        k = (lo[rows] + hi[rows]) // 2
+        metrics.increment("search_steps", len(rows))
+        result = np.asarray(predicate(rows, gf_max - k * precision), dtype=bool)
+        hi[rows] = np.where(result, k, hi[rows])
+        lo[rows] = np.where(result, lo[rows], k + 1)
+    gf_high = np.round(gf_max - lo * precision, 10)
+    return np.where(lo > n, np.nan, gf_high)
+
+
+def fit_gf_to_tdt(T, D, TDT, he=0, o2=21, verbose=False, search="bisect", precision=1, backend="pydplan", start=None):
+    """Find the highest GF High for which ZHL-16C gives longer decompression than TDT.
+
+    search="linear" steps GF High down one point at a time from 100, search="bisect" gives the same
+    result with about 7 plan calculations and also supports a finer GF grid through precision.
+    backend is passed to get_gf_tdt. start is a guess for the bisection, see search_gf_high. Without it
+    the pydplan bisection starts from the schreiner fit, which is usually within a few GF points.
+    """
+    if plan_cache is not None and not verbose:
+        # The result does not depend on start, so it is left out of the key
+        return plan_cache.memoize(
+            "fit_gf_to_tdt", lambda *args: _fit_gf_to_tdt(*args, start=start),
+            T, D, TDT, he, o2, verbose, search, precision, backend,
+        )
+    return _fit_gf_to_tdt(T, D, TDT, he, o2, verbose, search, precision, backend, start)
+
+
+def _fit_gf_to_tdt(T, D, TDT, he, o2, verbose, search, precision, backend, start=None):
+    if search == "linear":
+        for gf_high in range(100, 5, -1):
+            if get_gf_tdt(T, D, gf_high, he, o2, backend=backend, max_tdt=TDT).tdt > TDT:
+                if verbose:
+                    print(f"Found {gf_high} for {T} min and {D}m")
+                break
+    elif search == "bisect":
+        if backend == "schreiner":
+            gf_high = _schreiner_gf_high(T, D, TDT, he, o2, precision, start)
+        else:
+            if start is None and D > 0:
+                # The ascent simulations of zhl16c cost next to nothing compared to calculatePlan and can
+                # be cut off at TDT, so the guess leaves only a few calculatePlan runs for the gallop
+                start = _schreiner_gf_high(T, D, TDT, he, o2, precision)
+
+            def deco_longer_than_tdt(gf):
+                # The iteration limit is only reached with very long decompression, its tdt is inf
+                return get_gf_tdt(T, D, gf, he, o2, backend=backend).tdt > TDT
+
+            gf_high = search_gf_high(deco_longer_than_tdt, 100, 6, precision, start)
+        if gf_high is None:
+            # Same as the linear sweep running out of GFs
+            metrics.increment("fallbacks", reason="no_gf_found")
+            gf_high = 6
+        elif verbose:
+            print(f"Found {gf_high} for {T} min and {D}m")
+    else:
+        raise ValueError(f"Unknown search mode {search}")
     if verbose:
         print(f"For a total decompression time of {TDT:.0f} minutes (on 21/{he}), the Gradient Factors can be set to {gf_high}/{gf_high}.")
     return gf_high
 
 
-def parallelize_dataframe(df, func):
-    num_cores = cpu_count()
-    df_split = [df.iloc[i::num_cores] for i in range(num_cores)]
-    with Pool(num_cores) as pool:
-        df = pd.concat(pool.map(func, df_split))
-    return df
+def _schreiner_gf_high(T, D, TDT, he, o2, precision, start=None):
+    """Bisection of fit_gf_to_tdt with the schreiner backend, None if no GF gives longer deco than TDT."""
+    # Descent and bottom don't depend on GF, so every candidate only simulates the ascent
+    bottom = zhl16c.simulate_bottom(T, D, he=he, o2=o2)
+
+    def deco_longer_than_tdt(gf):
+        metrics.increment("ascent_simulations", backend="schreiner")
+        result = zhl16c.simulate_ascent(bottom, gf, max_tdt=TDT)
+        # Failing means very long decompression
+        return bool(result.failed[0] or result.cut_off[0] or result.tdt[0] > TDT)
+
+    return search_gf_high(deco_longer_than_tdt, 100, 6, precision, start)
+
 
+def lookup_gf_high(T, D, pdcs, he=0, exact=False):
+    """GF High for a StandardAir TDT with accepted pDCS from the precomputed table.
 
-def fit_gf_to_tdt_df(df):
-    df['gf_high'] = df.apply(lambda row: fit_gf_to_tdt(row['T'], row['D'], row['TDT'], verbose=False), axis=1)
+    The table answer is never above the exact fit and at most gf_table.MAX_ERROR points below it. Falls
+    back to fit_gf_to_tdt with calculatePlan when the table is not built, the table can't answer within
+    that bound or exact=True.
+    """
+    table = None if exact else gf_table.load_table()
+    if table is not None:
+        gf_high = table.lookup(D, T, he, pdcs)
+        if gf_high is not None:
+            return gf_high
+    if not exact:
+        metrics.increment("fallbacks", reason="gf_table_miss")
+
+    TDT = get_standair_tdt(D, T, pdcs)
+    return fit_gf_to_tdt(T, D, TDT, he=he)
+
+
+def lookup_gf_high_many(T, D, pdcs, he=0, exact=False, parallel_threshold=32):
+    """Vectorized lookup_gf_high for arrays of dives, returns an integer array.
+
+    All dives are looked up from the table at once. Dives the table can't answer are fitted once per
+    distinct dive, in the worker pool when there are at least parallel_threshold of them.
+    """
+    import pandas as pd
+
+    T, D, pdcs, he = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (T, D, pdcs, he)])
+    gf_high = np.full(T.shape, np.nan)
+    table = None if exact else gf_table.load_table()
+    if table is not None:
+        gf_high = table.lookup_many(D, T, he, pdcs)
+
+    missing = np.isnan(gf_high)
+    if missing.any():
+        metrics.increment("fallbacks", int(missing.sum()), reason="gf_table_miss")
+        df = pd.DataFrame({'T': T[missing], 'D': D[missing], 'TDT': get_standair_tdt(D[missing], T[missing], pdcs[missing]), 'he': he[missing]})
+        unique = df.drop_duplicates().reset_index(drop=True)
+        if len(unique) >= parallel_threshold:
+            unique = parallelize_dataframe(unique, fit_gf_to_tdt_df)
+        else:
+            unique = fit_gf_to_tdt_df(unique)
+        gf_high[missing] = df.merge(unique, on=['T', 'D', 'TDT', 'he'], how='left')['gf_high'].to_numpy()
+    return gf_high.astype(int)
+
+
+# Worker pool kept between parallelize_dataframe calls
+_pool = None
+_pool_size = None
+
+
+def get_pool(num_workers=None):
+    """Return the shared worker pool, creating it on first use or when the worker count changes."""
+    from multiprocessing import Pool, cpu_count
+
+    global _pool, _pool_size
+    num_workers = num_workers or cpu_count()
+    if _pool is None or _pool_size != num_workers:
+        close_pool()
+        _pool = Pool(num_workers)
+        _pool_size = num_workers
+    return _pool
+
+
+def close_pool():
+    global _pool, _pool_size
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+    _pool = None
+    _pool_size = None
+
+
+atexit.register(close_pool)
+
+
+def estimate_row_cost(df):
+    """Relative cost of each row, based on the length of the profile that has to be simulated."""
+    import pandas as pd
+
+    time_columns = [c for c in ['T', 'TDT', 'first_dive_time', 'no_deco_time', 'surface_time'] if c in df]
+    if not time_columns:
+        return pd.Series(1.0, index=df.index)
+    return df[time_columns].clip(lower=0).sum(axis=1)
+
+
+def dataframe_chunks(df, chunk_size, cost=estimate_row_cost, groups=None):
+    """Split df into chunks of about chunk_size rows for parallelize_dataframe.
+
+    Rows are sorted by cost(df), most expensive first, so that the long rows are started first. With
+    groups, a list of columns, the rows of a group are kept in the same chunk instead and the groups are
+    in the order of their values, which is what warm started functions need (see WARM_START_GROUPS).
+    """
+    groups = [c for c in groups or [] if c in df]
+    if groups:
+        order = np.lexsort([df[c].to_numpy() for c in reversed(groups)])
+        keys = df[groups].to_numpy()[order]
+        group_starts = np.flatnonzero((keys[1:] != keys[:-1]).any(axis=1)) + 1
+        splits = []
+        for start in group_starts:
+            if start - (splits[-1] if splits else 0) >= chunk_size:
+                splits.append(start)
+        return [df.iloc[rows] for rows in np.split(order, splits) if len(rows)]
+
+    order = np.argsort(-cost(df).to_numpy(), kind="stable") if cost is not None else np.arange(len(df))
+    return [df.iloc[order[i:i + chunk_size]] for i in range(0, len(df), chunk_size)]
+
+
+def parallelize_dataframe(df, func, num_workers=None, chunk_size=None, cost=estimate_row_cost, progress=False,
+                          groups=None):
+    """Apply func to chunks of df in the shared worker pool and concatenate the results.
+
+    Rows are handed out in small chunks so that idle workers keep picking up work instead of one worker
+    finishing a long static share alone, see dataframe_chunks for cost and groups. groups defaults to
+    WARM_START_GROUPS of func. progress can be True to print progress or a callable taking (rows_done,
+    rows_total). Row order of df is kept if the index is unique.
+    """
+    import pandas as pd
+
+    pool = get_pool(num_workers)
+    if chunk_size is None:
+        chunk_size = max(1, len(df) // (_pool_size * 16))
+    if groups is None:
+        # functools.partial keeps the function in func
+        groups = WARM_START_GROUPS.get(getattr(getattr(func, "func", func), "__name__", None))
+
+    chunks = dataframe_chunks(df, chunk_size, cost, groups)
+
+    results = []
+    rows_done = 0
+    for result in pool.imap_unordered(func, chunks):
+        results.append(result)
+        rows_done += len(result)
+        if callable(progress):
+            progress(rows_done, len(df))
+        elif progress:
+            print(f"\rProcessed {rows_done}/{len(df)} rows", end="", file=sys.stderr)
+    if progress is True:
+        print(file=sys.stderr)
+
+    if not results:
+        return df
+    result = pd.concat(results)
+    if df.index.is_unique:
+        result = result.loc[df.index]
+    return result
+
+
+def warm_start_order(df, sweep_column, group_columns):
+    """Visit order and neighbours for a warm started sweep.
+
+    Rows are grouped by group_columns and ordered by increasing exposure (sweep_column) inside each group.
+    Returns a list of (position, neighbour_position) pairs, where the neighbour is the previous row of the
+    group, or the first row of the previous group for the first row of a group (None for the very first).
+    """
+    group_columns = [c for c in group_columns if c in df]
+    order = np.lexsort([df[sweep_column].to_numpy()] + [df[c].to_numpy() for c in reversed(group_columns)])
+    keys = df[group_columns].to_numpy()
+    visits = []
+    group_start = None
+    previous = None
+    for position in order:
+        if previous is not None and (keys[position] == keys[previous]).all():
+            neighbour = previous
+        else:
+            neighbour = group_start
+            group_start = position
+        visits.append((position, neighbour))
+        previous = position
+    return visits
+
+
+# Columns of the rows that warm started functions solve one after another, parallelize_dataframe keeps them
+# in the same chunk
+WARM_START_GROUPS = {
+    "fit_gf_to_tdt_df": ['D', 'he', 'o2', 'pdcs'],
+    "get_gf_to_repetative_dives": ['depth', 'first_dive_time'],
+}
+
+
+def fit_gf_to_tdt_df(df, engine="pydplan", warm_start=True):
+    """Add gf_high column with fit_gf_to_tdt.
+
+    engine="numpy" runs the search for all rows together with the vectorized zhl16c engine. With
+    warm_start, rows with the same depth are solved in order of bottom time, and every search starts from
+    the answer of the previous row, which is usually correct or close to it. The result is the same.
+    """
+    if engine == "pydplan" and warm_start:
+        T = df['T'].to_numpy(dtype=float)
+        D = df['D'].to_numpy(dtype=float)
+        TDT = df['TDT'].to_numpy(dtype=float)
+        he = df['he'].to_numpy(dtype=float) if 'he' in df else np.zeros(len(df))
+        gf_high = np.zeros(len(df), dtype=int)
+        for position, neighbour in warm_start_order(df, 'T', WARM_START_GROUPS["fit_gf_to_tdt_df"]):
+            start = None if neighbour is None else gf_high[neighbour]
+            gf_high[position] = fit_gf_to_tdt(T[position], D[position], TDT[position], he=he[position], start=start)
+        df['gf_high'] = gf_high
+    elif engine == "pydplan":
+        df['gf_high'] = df.apply(lambda row: fit_gf_to_tdt(row['T'], row['D'], row['TDT'], he=row.get('he', 0), verbose=False), axis=1)
+    elif engine == "numpy":
+        T = df['T'].to_numpy(dtype=float)
+        D = df['D'].to_numpy(dtype=float)
+        TDT = df['TDT'].to_numpy(dtype=float)
+        he = df['he'].to_numpy(dtype=float) if 'he' in df else np.zeros(len(df))
+        bottom = zhl16c.simulate_bottom(T, D, he=he, o2=21)
+
+        def deco_longer_than_tdt(rows, gf):
+            result = zhl16c.simulate_ascent(bottom, gf, rows=rows, max_tdt=TDT[rows])
+            return result.failed | result.cut_off | (result.tdt > TDT[rows])
+
+        gf_high = search_gf_high_batch(deco_longer_than_tdt, 100, 6, len(df))
+        df['gf_high'] = np.nan_to_num(gf_high, nan=6).astype(int)
+    else:
+        raise ValueError(f"Unknown engine {engine}")
     return df
 
 
 def second_dive_no_dec_time(first_dive_time, surface_time, D_feet):
-    """Determine of the maximum no decompression time for a second dive, based on the PADI dive table."""
-    depths = btt.columns[1:].astype(int)
-    planned_depth = depths[depths >= D_feet].values[0]
-    possible_pressure_groups = btt.loc[btt[planned_depth.astype(str)] >= first_dive_time, 'Pressure group'].values
-    if len(possible_pressure_groups) == 0:
-        # The first dive to {D_feet} feet for {first_dive_time} minutes is not a no deco dive.
-        return 0
-    pressure_group = btt.loc[btt[planned_depth.astype(str)] >= first_dive_time, 'Pressure group'].values[0]
-    
-    next_pressure_group = sfi.loc[sfi[pressure_group] >= surface_time,'Next pressure group'].values[0]
-
-    residual_nitrogen = rnt.loc[rnt['Depth (fsw)'] == planned_depth, next_pressure_group].values[0]
-    
-    no_deco_time = (btt[planned_depth.astype(str)] - residual_nitrogen).max()
+    """Determine of the maximum no decompression time for a second dive, based on the PADI dive table.
+
+    Accepts scalars or arrays. Returns 0 if the first dive is not a no deco dive and NaN if the dive is
+    outside of the tables.
+    """
+    no_deco_time = padi.second_dive_no_dec_time(get_padi_tables(), first_dive_time, surface_time, D_feet)
+    if np.ndim(first_dive_time) == 0 and np.ndim(surface_time) == 0 and np.ndim(D_feet) == 0:
+        return no_deco_time[0]
     return no_deco_time
 
-def get_max_ceiling(d_meters, dive_durations, surface_time, gf_high, plot_figure=False):
-    """Determine the maximum ceiling for the second dive, based on ZHL-16C model with symmetric gradient factors."""
-    first_dive_gf = 115
+# GF of the first dive of a repetitive dive run
+FIRST_DIVE_GF = 115
+
+RepetitiveDiveRun = collections.namedtuple("RepetitiveDiveRun", ["max_ceiling", "times", "depths", "ceilings"])
+
+
+def get_max_ceiling(d_meters, dive_durations, surface_time, gf_high, plot_figure=False, backend="pydplan"):
+    """Determine the maximum ceiling for the second dive, based on ZHL-16C model with symmetric gradient factors.
+
+    backend="pydplan" runs calculatePlan, backend="schreiner" uses the closed form stop solver in zhl16c.
+    """
+    run = run_repetitive_dives(d_meters, dive_durations, surface_time, gf_high, backend)
+    if plot_figure:
+        plot_repetitive_dives(run, gf_high)
+    return run.max_ceiling
+
+
+def run_repetitive_dives(d_meters, dive_durations, surface_time, gf_high, backend="pydplan"):
+    """Simulate repetitive dives to d_meters, the first one with GF 115 and the next ones with gf_high.
+
+    Returns a RepetitiveDiveRun with the maximum ceiling, and the profile (minutes and meters) and
+    ceilings of the run. max_ceiling is -100 when the plan can't be calculated.
+    """
+    first_dive_gf = FIRST_DIVE_GF
+
+    if backend == "schreiner":
+        return _run_repetitive_dives_schreiner(d_meters, dive_durations, surface_time, first_dive_gf, gf_high)
+    elif backend != "pydplan":
+        raise ValueError(f"Unknown backend {backend}")
+
+    from pydplan.pydplan_profiletools import calculatePlan, DivePlan, TankType
 
     dive_plan = DivePlan()
     dive_plan.setDefaults()
@@ -204,33 +721,171 @@ def get_max_ceiling(d_meters, dive_durations, surface_time, gf_high, plot_figure
     dive_plan.nDives = len(dive_durations)
     dive_plan.surfaceTime = surface_time
     dive_plan.diveDurations = [60*t for t in dive_durations]
-    dive_plan.diveGFs = [first_dive_gf/100, gf_high/100]
+    dive_plan.diveGFs = [first_dive_gf/100] + [gf_high/100] * (len(dive_durations) - 1)
 
+    metrics.increment("simulations", backend=backend)
     try:
-        model_run = calculatePlan(dive_plan)
+        with metrics.phase("simulate"):
+            model_run = calculatePlan(dive_plan)
     except ValueError:
         # This is probably a deco dive because of going over the iteration limit
-        return -100
-    
-    if plot_figure:
-        plt.plot([x.time/60 for x in dive_plan.profileSampled], [-x.depth for x in dive_plan.profileSampled])
-        plt.title(f"Dive profile. GF: {dive_plan.GFlow*100:.0f}/{dive_plan.GFhigh*100:.0f}")
-    
-    max_ceiling = max([max(mp.ceilings) for mp in model_run])
-    return max_ceiling
+        metrics.increment("fallbacks", reason="iteration_limit")
+        return RepetitiveDiveRun(-100, [], [], [])
+
+    ceilings = [max(mp.ceilings) for mp in model_run]
+    return RepetitiveDiveRun(
+        max(ceilings),
+        [x.time/60 for x in dive_plan.profileSampled],
+        [x.depth for x in dive_plan.profileSampled],
+        ceilings,
+    )
+
 
-def def_find_no_deco_gf_high(d_meters, dive_times, surface_time):
+# Profile of the first dive, runtime at the start of the second dive and the bottom phase of the second dive
+RepetitiveDivePrefix = collections.namedtuple("RepetitiveDivePrefix", ["times", "depths", "ceilings", "offset", "bottom"])
+
+
+def _repetitive_dives_prefix(d_meters, dive_durations, surface_time, first_dive_gf):
+    """Simulate the part of a repetitive dive run that does not depend on gf_high: the first dive, the
+    surface interval and the descent and bottom of the second dive. None if the first dive fails."""
+    metrics.increment("simulations", backend="schreiner")
+    with metrics.phase("simulate"):
+        result = zhl16c.simulate_square_dives(dive_durations[0], d_meters, first_dive_gf, record_profile=True)
+    if result.failed[0]:
+        return None
+    times, depths, ceilings = result.profile
+    tissues = zhl16c.surface_interval(result.tissues, surface_time)
+    bottom = zhl16c.simulate_bottom(dive_durations[1], d_meters, tissues=tissues) if len(dive_durations) > 1 else None
+    return RepetitiveDivePrefix(
+        list(times[:, 0]), list(depths[:, 0]), list(ceilings[:, 0]), result.runtime[0] + surface_time, bottom,
+    )
+
+
+def _run_repetitive_dives_schreiner(d_meters, dive_durations, surface_time, first_dive_gf, gf_high, prefix=None):
+    """prefix from _repetitive_dives_prefix can be shared by runs with different gf_high."""
+    if prefix is None:
+        prefix = _repetitive_dives_prefix(d_meters, dive_durations, surface_time, first_dive_gf)
+    if prefix is None:
+        # Same as calculatePlan going over the iteration limit
+        metrics.increment("fallbacks", reason="iteration_limit")
+        return RepetitiveDiveRun(-100, [], [], [])
+    times = list(prefix.times)
+    depths = list(prefix.depths)
+    ceilings = list(prefix.ceilings)
+    offset = prefix.offset
+    bottom = prefix.bottom
+    for duration in dive_durations[1:]:
+        if bottom is None:
+            bottom = zhl16c.simulate_bottom(duration, d_meters, tissues=tissues)
+        metrics.increment("ascent_simulations", backend="schreiner")
+        with metrics.phase("simulate"):
+            result = zhl16c.simulate_ascent(bottom, gf_high, record_profile=True)
+        if result.failed[0]:
+            # Same as calculatePlan going over the iteration limit
+            metrics.increment("fallbacks", reason="iteration_limit")
+            return RepetitiveDiveRun(-100, [], [], [])
+        dive_times, dive_depths, dive_ceilings = result.profile
+        times.extend(offset + dive_times[:, 0])
+        depths.extend(dive_depths[:, 0])
+        ceilings.extend(dive_ceilings[:, 0])
+        offset += result.runtime[0] + surface_time
+        tissues = zhl16c.surface_interval(result.tissues, surface_time)
+        bottom = None
+    return RepetitiveDiveRun(float(max(ceilings)), times, depths, ceilings)
+
+
+def plot_repetitive_dives(run, gf_high):
+    from matplotlib import pyplot as plt
+
+    with metrics.phase("figure"):
+        plt.plot(run.times, [-depth for depth in run.depths])
+        plt.title(f"Dive profile. GF: {gf_high:.0f}/{gf_high:.0f}")
+
+
+def find_no_deco_gf_high(d_meters, dive_times, surface_time, search="bisect", backend="pydplan", start=None):
+    """Find out the high GF which barely allow doing the second dive without decompression stops.
+
+    Returns the GF together with the RepetitiveDiveRun that decided it, so the profile can be plotted
+    without simulating the dives again, or (-1, None) if there is no such GF. search="linear" scans GF
+    High down from 120, search="bisect" uses search_gf_high, optionally starting from a guess.
+    """
+    runs = {}
+    prefix = None
+    if backend == "schreiner":
+        # The first dive, the surface interval and the bottom of the second dive are the same for every GF
+        prefix = _repetitive_dives_prefix(d_meters, dive_times, surface_time, FIRST_DIVE_GF)
+
+    def needs_deco(gf_high):
+        if backend == "schreiner":
+            run = _run_repetitive_dives_schreiner(d_meters, dive_times, surface_time, FIRST_DIVE_GF, gf_high, prefix)
+        else:
+            run = run_repetitive_dives(d_meters, dive_times, surface_time, gf_high, backend)
+        if run.max_ceiling > 0:
+            runs[gf_high] = run
+            return True
+        return False
+
+    gf_high = None
+    if search == "linear":
+        for gf in range(120, 50, -1):
+            if needs_deco(gf):
+                gf_high = gf
+                break
+    elif search == "bisect":
+        gf_high = search_gf_high(needs_deco, 120, 51, start=start)
+    else:
+        raise ValueError(f"Unknown search mode {search}")
+
+    if gf_high is None:
+        metrics.increment("fallbacks", reason="no_gf_found")
+        print("Error: Dive is not possible to do with out deco with gf_high <= 120")
+        return -1, None
+    return gf_high, runs[gf_high]
+
+
+def def_find_no_deco_gf_high(d_meters, dive_times, surface_time, backend="pydplan", start=None, search="bisect", plot_figure=False):
     """Find out the high GF which barely allow doing the second dive without decompression stops."""
-    for gf_high in range(120,50,-1):
-        max_ceiling = get_max_ceiling(d_meters, dive_times, surface_time, gf_high, plot_figure=False)
-        if max_ceiling > 0:
-            get_max_ceiling(d_meters, dive_times, surface_time, gf_high, plot_figure=True)
-            return gf_high
-            
-    print("Error: Dive is not possible to do with out deco with gf_high <= 120")
-    return -1
+    gf_high, run = find_no_deco_gf_high(d_meters, dive_times, surface_time, search, backend, start)
+    if plot_figure and run is not None:
+        plot_repetitive_dives(run, gf_high)
+    return gf_high
 
-def get_gf_to_repetative_dives(df):
-    """Process a dataframe with def_find_no_deco_gf_high"""
-    df['gf_high'] = df.apply(lambda x: def_find_no_deco_gf_high(x['depth'], [x['first_dive_time'], x['no_deco_time']], x['surface_time']), axis=1)
+def get_gf_to_repetative_dives(df, engine="pydplan", warm_start=True):
+    """Process a dataframe with def_find_no_deco_gf_high
+
+    engine="numpy" runs the search for all rows together with the vectorized zhl16c engine. With
+    warm_start, rows of the same first dive are solved in order of surface time, and every search starts
+    from the answer of the previous row. The result is the same.
+    """
+    if engine == "pydplan" and warm_start:
+        gf_high = np.zeros(len(df), dtype=int)
+        for position, neighbour in warm_start_order(df, 'surface_time', WARM_START_GROUPS["get_gf_to_repetative_dives"]):
+            row = df.iloc[position]
+            start = 120 if neighbour is None else gf_high[neighbour]
+            gf_high[position] = def_find_no_deco_gf_high(
+                row['depth'], [row['first_dive_time'], row['no_deco_time']], row['surface_time'], start=start,
+            )
+        df['gf_high'] = gf_high
+    elif engine == "pydplan":
+        df['gf_high'] = df.apply(lambda x: def_find_no_deco_gf_high(x['depth'], [x['first_dive_time'], x['no_deco_time']], x['surface_time']), axis=1)
+    elif engine == "numpy":
+        depth = df['depth'].to_numpy(dtype=float)
+        second_dive_time = df['no_deco_time'].to_numpy(dtype=float)
+
+        # The first dive, the surface interval and the bottom of the second dive do not depend on the GF
+        # of the second dive
+        first_dive = zhl16c.simulate_square_dives(df['first_dive_time'].to_numpy(dtype=float), depth, FIRST_DIVE_GF)
+        tissues = zhl16c.surface_interval(first_dive.tissues, df['surface_time'].to_numpy(dtype=float))
+        bottom = zhl16c.simulate_bottom(second_dive_time, depth, tissues=tissues)
+
+        def second_dive_needs_deco(rows, gf):
+            second_dive = zhl16c.simulate_ascent(bottom, gf, rows=rows)
+            max_ceiling = np.maximum(first_dive.max_ceiling[rows], second_dive.max_ceiling)
+            # get_max_ceiling returns a negative value when the plan can't be calculated
+            return (max_ceiling > 0) & ~second_dive.failed
+
+        gf_high = search_gf_high_batch(second_dive_needs_deco, 120, 51, len(df))
+        df['gf_high'] = np.nan_to_num(gf_high, nan=-1).astype(int)
+    else:
+        raise ValueError(f"Unknown engine {engine}")
     return df
@@ -0,0 +1,199 @@
+"""Precomputed GF High table over depth, bottom time, helium percentage and pDCS.
+
+Build the table with
+
+    poetry run python -m src.gf_table
+
+which runs fit_gf_to_tdt for every grid point and saves the result into the data folder. The web app
+then answers GF High queries from the memory mapped table.
+
+A query is answered with the lowest GF High of the grid points around it, minus SAFETY_MARGIN when it is
+not on a grid point, so the answer is never less conservative than the exact fit as long as the fit does
+not dip below the grid points inside the cell. Inside a cell the fit can be up to the spread of its grid
+points above the answer, so cells where that could be more than MAX_ERROR points are answered with the
+exact fit instead. When the table is built, the exact fit is also calculated at VALIDATION_SAMPLES points
+inside every cell, and cells where a table answer came out above the fit or more than MAX_ERROR points
+below it are marked invalid and fall back to the exact fit too.
+"""
+import os
+import sys
+import argparse
+import functools
+import itertools
+import numpy as np
+
+project_folder = os.path.join(os.path.dirname(__file__), "..")
+data_folder = os.path.join(project_folder, "data")
+
+TABLE_PATH = os.path.join(data_folder, "gf_high_table.npy")
+AXES_PATH = os.path.join(data_folder, "gf_high_table_axes.npz")
+
+# Order of the table dimensions
+AXIS_NAMES = ["D", "T", "he", "pdcs"]
+DEFAULT_AXES = {
+    "D": np.arange(6, 61, 1),
+    "T": np.concatenate((np.arange(10, 60, 5), np.arange(60, 210, 10))),
+    "he": np.arange(0, 65, 5),
+    "pdcs": np.array([0.005, 0.01, 0.015, 0.02, 0.025, 0.03, 0.04, 0.05]),
+}
+# Table answers are at most this many GF points below the exact fit
+MAX_ERROR = 3
+# Subtracted from answers between grid points, where the integer steps of the fit can go below the grid
+SAFETY_MARGIN = 1
+# Validation points per cell when the table is built
+VALIDATION_SAMPLES = 4
+# fit_gf_to_tdt backend for the fit_gf_to_tdt_df engine the table is built with
+BACKENDS = {"pydplan": "pydplan", "numpy": "schreiner"}
+
+
+class GFTable:
+    """GF High values on a regular grid, see the module docstring for how queries are answered.
+
+    valid is a boolean array with one value per grid cell, None if every cell is valid. backend is the
+    fit_gf_to_tdt backend the values were calculated with, misses should be fitted with the same one.
+    """
+
+    def __init__(self, values, axes, valid=None, backend="pydplan"):
+        self.values = values
+        self.axes = [list(map(float, axes[name])) for name in AXIS_NAMES]
+        self.valid = valid
+        self.backend = backend
+
+    def lookup(self, D, T, he, pdcs):
+        """GF High for a single dive, None when the dive has to be fitted exactly."""
+        gf_high = self.lookup_many(D, T, he, pdcs)[()]
+        return None if np.isnan(gf_high) else int(gf_high)
+
+    def lookup_many(self, D, T, he, pdcs):
+        """Vectorized lookup for arrays of dives. NaN where a dive has to be fitted exactly."""
+        point = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (D, T, he, pdcs)])
+        inside = np.ones(point[0].shape, dtype=bool)
+        lower = []
+        weights = []
+        for value, axis in zip(point, self.axes):
+            axis = np.asarray(axis)
+            # Values within float noise of a grid line are on it, for example an EAD of 45.00000000000001
+            j = np.clip(np.searchsorted(axis, value), 1, len(axis) - 1)
+            nearest = axis[np.where(value - axis[j - 1] < axis[j] - value, j - 1, j)]
+            value = np.where(np.isclose(value, nearest), nearest, value)
+            inside &= (axis[0] <= value) & (value <= axis[-1])
+            i = np.clip(np.searchsorted(axis, value, side="right") - 1, 0, len(axis) - 2)
+            lower.append(i)
+            weights.append((value - axis[i]) / (axis[i + 1] - axis[i]))
+
+        # Lowest and highest value of the grid points the dive depends on, the ones with a positive weight
+        low = np.full(inside.shape, np.inf)
+        high = np.full(inside.shape, -np.inf)
+        corners = np.zeros(inside.shape, dtype=int)
+        for corner in itertools.product((0, 1), repeat=len(point)):
+            used = np.ones(inside.shape, dtype=bool)
+            for offset, w in zip(corner, weights):
+                used &= (w > 0) if offset else (w < 1)
+            index = tuple(i + offset for i, offset in zip(lower, corner))
+            value = self.values[index].astype(float)
+            low = np.where(used, np.minimum(low, value), low)
+            high = np.where(used, np.maximum(high, value), high)
+            corners += used
+
+        margin = np.where(corners > 1, SAFETY_MARGIN, 0)
+        answered = inside & (high - low + margin <= MAX_ERROR)
+        if self.valid is not None:
+            answered &= self.valid[tuple(lower)]
+        return np.where(answered, low - margin, np.nan)
+
+
+_table = None
+
+
+def load_table(table_path=TABLE_PATH, axes_path=AXES_PATH):
+    """Load the table memory mapped.
+
+    Returns None if the table has not been built, or if it was built with the numpy engine, which has not
+    been validated against calculatePlan.
+    """
+    global _table
+    if _table is None:
+        if not (os.path.exists(table_path) and os.path.exists(axes_path)):
+            return None
+        with np.load(axes_path) as data:
+            axes = {name: data[name] for name in AXIS_NAMES}
+            valid = data["valid"] if "valid" in data else None
+            backend = str(data["backend"]) if "backend" in data else "pydplan"
+        _table = GFTable(np.load(table_path, mmap_mode="r"), axes, valid, backend)
+    return _table if _table.backend == "pydplan" else None
+
+
+def _fit(df, engine):
+    try:
+        from . import gf_selection
+    except ImportError:
+        import gf_selection
+
+    df['TDT'] = gf_selection.get_standair_tdt(df['D'].to_numpy(), df['T'].to_numpy(), df['pdcs'].to_numpy())
+    func = functools.partial(gf_selection.fit_gf_to_tdt_df, engine=engine)
+    return gf_selection.parallelize_dataframe(df, func)['gf_high'].to_numpy()
+
+
+def validation_points(axes, samples=VALIDATION_SAMPLES, seed=0):
+    """samples points inside every cell of the grid, as arrays in AXIS_NAMES order.
+
+    The first point of a cell is its centre. The others are random, with every coordinate on the lower
+    grid line of the cell half of the time, because queries often have a helium percentage or pDCS that is
+    on the grid.
+    """
+    rng = np.random.default_rng(seed)
+    grids = np.meshgrid(*[np.arange(len(axes[name]) - 1) for name in AXIS_NAMES], indexing="ij")
+    cells = [grid.ravel() for grid in grids]
+    points = []
+    for name, cell in zip(AXIS_NAMES, cells):
+        axis = np.asarray(axes[name], dtype=float)
+        fraction = rng.uniform(0, 1, (samples, len(cell)))
+        fraction[rng.uniform(0, 1, fraction.shape) < 0.5] = 0
+        fraction[0] = 0.5
+        points.append((axis[cell] + fraction * (axis[cell + 1] - axis[cell])).ravel())
+    return points
+
+
+def build_table(axes=DEFAULT_AXES, table_path=TABLE_PATH, axes_path=AXES_PATH, engine="pydplan",
+                samples=VALIDATION_SAMPLES):
+    """Run fit_gf_to_tdt for every grid point and the validation points and save the results.
+
+    engine is passed to fit_gf_to_tdt_df. Returns the GFTable.
+    """
+    import pandas as pd
+
+    combinations = list(itertools.product(*[axes[name] for name in AXIS_NAMES]))
+    df = pd.DataFrame(combinations, columns=AXIS_NAMES)
+    # parallelize_dataframe keeps the row order, which is the order of the grid
+    values = _fit(df, engine).astype(np.uint8).reshape([len(axes[name]) for name in AXIS_NAMES])
+    table = GFTable(values, axes, backend=BACKENDS[engine])
+
+    points = validation_points(axes, samples)
+    exact = _fit(pd.DataFrame(dict(zip(AXIS_NAMES, points))), engine)
+    error = exact - table.lookup_many(*points)
+    cell = tuple(
+        np.clip(np.searchsorted(table.axes[k], points[k], side="right") - 1, 0, len(table.axes[k]) - 2)
+        for k in range(len(AXIS_NAMES))
+    )
+    # Cells where the table was too high or too low at a validation point, unanswered points are NaN
+    valid = np.ones([len(axes[name]) - 1 for name in AXIS_NAMES], dtype=bool)
+    valid[tuple(c[(error < 0) | (error > MAX_ERROR)] for c in cell)] = False
+    table.valid = valid
+
+    answered = ~np.isnan(table.lookup_many(*points))
+    print(f"{valid.mean():.1%} of the cells are valid, {answered.mean():.1%} of the validation points are "
+          f"answered from the table, {np.nanmean(error[answered]):.2f} points below the exact fit on average",
+          file=sys.stderr)
+
+    np.save(table_path, values)
+    np.savez_compressed(axes_path, valid=valid, backend=np.array(table.backend),
+             **{name: np.asarray(axes[name], dtype=float) for name in AXIS_NAMES})
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the GF High table into the data folder.")
+    parser.add_argument("--engine", choices=sorted(BACKENDS), default="pydplan",
+                        help="fit_gf_to_tdt_df engine, the app only uses tables built with pydplan")
+    args = parser.parse_args()
+    build_table(engine=args.engine)
@@ -0,0 +1,168 @@
+"""Background jobs for expensive Dash callbacks.
+
+Callbacks submit work to a local process pool and return immediately, and a dcc.Interval polls the job
+status. Job status, progress and results are kept in a PlanCache file, so any gunicorn worker can answer
+a poll. The process that submits a job records a "submitted" marker in the same file, so identical jobs
+submitted from different workers or sessions are computed only once. Sessions waiting for a job are
+counted there too, and a job is only cancelled when no session waits for it anymore. Only successful
+results are kept, a job that failed is started again by the next submit.
+"""
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from . import metrics
+    from .plan_cache import PlanCache, DEFAULT_CACHE_PATH
+except ImportError:
+    import metrics
+    from plan_cache import PlanCache, DEFAULT_CACHE_PATH
+
+DEFAULT_JOBS_PATH = DEFAULT_CACHE_PATH + ".jobs"
+# Jobs without a result this many seconds after they were submitted are reported as errors
+JOB_TIMEOUT = 300
+
+# Set in the job process while a job is running, see report_progress
+_current_job = None
+
+
+def report_progress(fraction, message=""):
+    """Report progress (0..1) of the running job. Does nothing outside of a job."""
+    if _current_job is not None:
+        cache, key = _current_job
+        cache.set("progress:" + key, (fraction, message))
+
+
+def _run_job(path, key, name, func, args, collect_metrics=False):
+    global _current_job
+    cache = PlanCache(path)
+    _current_job = (cache, key)
+    if collect_metrics:
+        # Only the metrics of this job are sent back
+        metrics.enable()
+        metrics.reset()
+    start = time.perf_counter()
+    error = None
+    try:
+        result = func(*args)
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        _current_job = None
+    if collect_metrics:
+        metrics.observe("job", time.perf_counter() - start, job=name, status="done" if error is None else "error")
+        cache.set("metrics:" + key, metrics.snapshot())
+    # The result is written last, so the metrics are there when a poll sees the job done. Errors go to the
+    # submitted marker instead of the results, so the next submit runs the job again.
+    if error is None:
+        cache.set("result:" + key, ("done", result))
+    else:
+        cache.update("submitted:" + key, lambda found, marker: (marker[:2] if found else (os.getpid(), time.time())) + (error,))
+
+
+class JobQueue:
+    """Deduplicating job queue on top of a process pool."""
+
+    def __init__(self, path=DEFAULT_JOBS_PATH, max_workers=None, ttl=3600, timeout=JOB_TIMEOUT):
+        self.cache = PlanCache(path, ttl=ttl)
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+        self._pid = None
+        self._futures = {}
+
+    def _get_executor(self):
+        # Each gunicorn worker gets its own pool after forking
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(self.max_workers)
+            self._pid = os.getpid()
+            self._futures = {}
+        return self._executor
+
+    def key(self, name, *args):
+        """Key of the job submit(name, func, *args) would start."""
+        return self.cache.make_key(name, *args)
+
+    def submit(self, name, func, *args):
+        """Start func(*args) in the background unless an identical job exists. Returns the job key.
+
+        The caller counts as waiting for the job until it calls cancel.
+        """
+        key = self.key(name, *args)
+        self.cache.update("waiting:" + key, lambda found, count: (count if found else 0) + 1)
+        if self.cache.get("result:" + key)[0]:
+            return key
+
+        # Claim the job unless another process or an earlier call has, that was not too long ago and the
+        # job has not failed. The marker is (pid, time, error).
+        claim = (os.getpid(), time.time(), None)
+
+        def claim_unless_submitted(found, marker):
+            if found and marker[2] is None and claim[1] - marker[1] < self.timeout:
+                return marker
+            return claim
+
+        submitted = self.cache.update("submitted:" + key, claim_unless_submitted)
+        if submitted != claim:
+            return key
+        try:
+            future = self._get_executor().submit(_run_job, self.cache.path, key, name, func, args, metrics.enabled)
+        except BrokenProcessPool:
+            # A job process died, which breaks the whole pool
+            self._executor = None
+            future = self._get_executor().submit(_run_job, self.cache.path, key, name, func, args, metrics.enabled)
+        self._futures[key] = future
+        return key
+
+    def status(self, key):
+        """Return (state, value) where state is "done", "error", "running" or "pending".
+
+        value is the result for "done", an error message or traceback for "error" and (fraction, message)
+        otherwise. Jobs that were cancelled, whose process died or that have no result timeout seconds
+        after they were submitted are errors, so that pollers stop.
+        """
+        found, result = self.cache.get("result:" + key)
+        if found:
+            self._futures.pop(key, None)
+            return result
+        future = self._futures.get(key)
+        if future is not None and future.done():
+            self._futures.pop(key)
+            # _run_job records its result or error before it returns, unless it never ran or its process died
+            if future.cancelled() or future.exception() is not None:
+                error = "The job was cancelled" if future.cancelled() else f"The job failed: {future.exception()!r}"
+                # Polls from other processes see the error too, and the next submit starts the job again
+                self.cache.update("submitted:" + key, lambda found, marker: marker[:2] + (error,) if found else None)
+                return "error", error
+        found, submitted = self.cache.get("submitted:" + key)
+        if not found:
+            return "error", "The job was cancelled"
+        if submitted[2] is not None:
+            return "error", submitted[2]
+        if time.time() - submitted[1] > self.timeout:
+            return "error", "The job timed out"
+        found, progress = self.cache.get("progress:" + key)
+        if found:
+            return "running", progress
+        return "pending", (0, "")
+
+    def cancel(self, key):
+        """Stop waiting for a job. The job is cancelled if nobody else waits for it and it has not started
+        yet in this process. A running job finishes, but nobody waits for it."""
+        waiting = self.cache.update("waiting:" + key, lambda found, count: count - 1 if found and count > 1 else None)
+        if waiting is not None:
+            return
+        future = self._futures.pop(key, None)
+        if future is not None and future.cancel():
+            self.cache.update("submitted:" + key, lambda found, marker: None)
+
+    def metrics(self, key):
+        """Metrics recorded by a finished job when metrics are enabled, see metrics.merge. Returns them only
+        once, so that polling the same job again does not count them twice."""
+        found, data = self.cache.get("metrics:" + key)
+        if not found or data is None:
+            return None
+        self.cache.set("metrics:" + key, None)
+        return data
@@ -0,0 +1,217 @@
+"""Opt-in counters and timings for the plan calculations.
+
+gf_selection counts simulations, GF search steps and fallbacks (such as calculatePlan going over its
+iteration limit) and times phases like simulation and figure construction. Nothing is recorded until
+enable() is called, and the calls cost a single flag check while disabled.
+
+Counts recorded inside a scope, e.g. a Dash callback wrapped with instrument, get the name of the scope as
+a callback label and are written as a structured log line when the scope ends. render gives all metrics of
+this process in the Prometheus text format. Every process has its own metrics, background jobs send theirs
+back with the job result, see jobs.JobQueue.metrics.
+"""
+import json
+import time
+import logging
+import functools
+import threading
+import contextlib
+import collections
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "gf_"
+
+enabled = False
+
+# (name, labels) -> value for counters and (name, labels) -> [count, seconds] for timings, where labels is
+# a sorted tuple of (label, value) pairs
+_counters = collections.defaultdict(float)
+_timings = collections.defaultdict(lambda: [0, 0.0])
+_lock = threading.Lock()
+_local = threading.local()
+
+_disabled_phase = contextlib.nullcontext()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Forget all metrics and leave the current scope, e.g. in a process forked inside a callback."""
+    with _lock:
+        _counters.clear()
+        _timings.clear()
+    _local.callback = None
+    _local.collected = None
+
+
+def _labels(labels):
+    callback = getattr(_local, "callback", None)
+    if callback is not None:
+        labels = dict(labels, callback=callback)
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _collected_name(name, labels):
+    return "_".join([name] + [str(value) for _, value in sorted(labels.items())])
+
+
+def increment(name, value=1, **labels):
+    """Add value to a counter."""
+    if not enabled:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] += value
+    collected = getattr(_local, "collected", None)
+    if collected is not None:
+        collected[_collected_name(name, labels)] += value
+
+
+def observe(name, seconds, count=1, **labels):
+    """Record the duration of count events in a timing."""
+    if not enabled:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        timing = _timings[key]
+        timing[0] += count
+        timing[1] += seconds
+    collected = getattr(_local, "collected", None)
+    if collected is not None:
+        collected[_collected_name(name, labels) + "_seconds"] += seconds
+
+
+@contextlib.contextmanager
+def _timed_phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("phase", time.perf_counter() - start, phase=name)
+
+
+def phase(name):
+    """Context manager timing a phase, e.g. with metrics.phase("figure")."""
+    if not enabled:
+        return _disabled_phase
+    return _timed_phase(name)
+
+
+def timed(name):
+    """Decorator timing every call of a function as the phase name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def counted(func, name, **labels):
+    """Wrap func so that every call increments the counter name."""
+    if not enabled:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        increment(name, **labels)
+        return func(*args, **kwargs)
+    return wrapper
+
+
+@contextlib.contextmanager
+def scope(callback):
+    """Label everything recorded inside with the callback name and log a summary line at the end."""
+    if not enabled:
+        yield
+        return
+    previous = getattr(_local, "callback", None), getattr(_local, "collected", None)
+    _local.callback = callback
+    _local.collected = collections.Counter()
+    start = time.perf_counter()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    finally:
+        seconds = time.perf_counter() - start
+        collected = _local.collected
+        _local.callback, _local.collected = previous
+        with _lock:
+            timing = _timings[("callback", _labels({"callback": callback, "status": status}))]
+            timing[0] += 1
+            timing[1] += seconds
+        logger.info(json.dumps({
+            "event": "callback",
+            "callback": callback,
+            "status": status,
+            "seconds": round(seconds, 6),
+            **{name: round(value, 6) for name, value in sorted(collected.items())},
+        }))
+
+
+def instrument(callback):
+    """Decorator running a function inside scope(callback)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with scope(callback):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """All metrics as plain data that can be pickled and passed to merge in another process."""
+    with _lock:
+        return {
+            "counters": [(name, dict(labels), value) for (name, labels), value in _counters.items()],
+            "timings": [(name, dict(labels), count, seconds) for (name, labels), (count, seconds) in _timings.items()],
+        }
+
+
+def merge(data):
+    """Add metrics from snapshot, e.g. from a background job, to this process."""
+    for name, labels, value in data["counters"]:
+        increment(name, value, **labels)
+    for name, labels, count, seconds in data["timings"]:
+        observe(name, seconds, count, **labels)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def render():
+    """Metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        timings = sorted(_timings.items())
+
+    previous = None
+    for (name, labels), value in counters:
+        if name != previous:
+            lines.append(f"# TYPE {PREFIX}{name}_total counter")
+            previous = name
+        lines.append(f"{PREFIX}{name}_total{_format_labels(labels)} {float(value)!r}")
+
+    previous = None
+    for (name, labels), (count, seconds) in timings:
+        if name != previous:
+            lines.append(f"# TYPE {PREFIX}{name}_seconds summary")
+            previous = name
+        lines.append(f"{PREFIX}{name}_seconds_count{_format_labels(labels)} {count}")
+        lines.append(f"{PREFIX}{name}_seconds_sum{_format_labels(labels)} {seconds:.6f}")
+    return "\n".join(lines) + "\n"
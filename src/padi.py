@@ -0,0 +1,102 @@
+"""PADI recreational dive table lookups compiled into NumPy index structures.
+
+The bottom time, surface interval and residual nitrogen tables are converted once into sorted arrays,
+so finding a pressure group is a searchsorted call instead of a boolean mask over a DataFrame, and many
+dives can be looked up with a single call.
+"""
+import collections
+import numpy as np
+
+PRESSURE_GROUPS = [chr(c) for c in range(ord("A"), ord("Z") + 1)]
+
+# Offset between columns stacked into one sorted array, larger than any time in the tables
+COLUMN_OFFSET = 1e6
+
+PadiTables = collections.namedtuple(
+    "PadiTables", ["depths", "bottom_times", "btt_rows", "max_bottom_times", "btt_groups",
+                   "surface_intervals", "sfi_groups", "residual_nitrogen"]
+)
+
+
+def _stack_columns(values):
+    """Stack the sorted columns of a 2D array into one sorted 1D array by offsetting column j by j*COLUMN_OFFSET."""
+    return (values + np.arange(values.shape[1]) * COLUMN_OFFSET).T.ravel()
+
+
+def _search_columns(stacked, n_rows, columns, values):
+    """Row of the first value >= values[i] in column columns[i] of a stacked table, n_rows if there is none."""
+    keys = columns * COLUMN_OFFSET + values
+    return np.searchsorted(stacked, keys, side="left") - columns * n_rows
+
+
+def compile_tables(btt, sfi, rnt):
+    """Compile the btt, sfi and rnt DataFrames.
+
+    Pressure groups are integer codes 0..25 for A..Z, and depths are indices into the depth columns of
+    the bottom time table.
+    """
+    depths = btt.columns[1:].astype(int).to_numpy()
+    btt_values = btt.iloc[:, 1:].to_numpy(dtype=float)
+    # Missing entries are at the end of a column. They are filled with the column maximum to keep the
+    # column sorted, and btt_rows limits the search to the real entries.
+    max_bottom_times = np.nanmax(btt_values, axis=0)
+    btt_rows = (~np.isnan(btt_values)).sum(axis=0)
+    bottom_times = _stack_columns(np.where(np.isnan(btt_values), max_bottom_times, btt_values))
+    btt_groups = np.array([PRESSURE_GROUPS.index(g) for g in btt['Pressure group']])
+
+    # Missing entries are at the start of a column and never match
+    sfi_values = sfi[PRESSURE_GROUPS].to_numpy(dtype=float)
+    surface_intervals = _stack_columns(np.where(np.isnan(sfi_values), -1.0, sfi_values))
+    sfi_groups = np.array([PRESSURE_GROUPS.index(g) for g in sfi['Next pressure group']])
+
+    # Residual nitrogen time by depth index and pressure group code, NaN for depths missing from the table
+    rnt_rows = {int(depth): row for row, depth in enumerate(rnt['Depth (fsw)'])}
+    rnt_values = rnt[PRESSURE_GROUPS].to_numpy(dtype=float)
+    residual_nitrogen = np.array([
+        rnt_values[rnt_rows[depth]] if depth in rnt_rows else np.full(len(PRESSURE_GROUPS), np.nan)
+        for depth in depths
+    ])
+
+    return PadiTables(depths, bottom_times, btt_rows, max_bottom_times, btt_groups,
+                      surface_intervals, sfi_groups, residual_nitrogen)
+
+
+def second_dive_no_dec_time(tables, first_dive_time, surface_time, D_feet):
+    """Vectorized maximum no decompression time for a second dive.
+
+    first_dive_time, surface_time (minutes) and D_feet are scalars or arrays. Returns 0 where the first
+    dive is not a no deco dive and NaN where the dive is outside of the tables.
+    """
+    first_dive_time, surface_time, D_feet = np.broadcast_arrays(
+        *[np.atleast_1d(np.asarray(x, dtype=float)) for x in (first_dive_time, surface_time, D_feet)]
+    )
+    depth_index = np.searchsorted(tables.depths, D_feet, side="left")
+    in_depths = depth_index < len(tables.depths)
+    depth_index = np.minimum(depth_index, len(tables.depths) - 1)
+
+    # Pressure group after the first dive
+    n_btt_rows = len(tables.btt_groups)
+    row = _search_columns(tables.bottom_times, n_btt_rows, depth_index, first_dive_time)
+    no_deco = row < tables.btt_rows[depth_index]
+    group = tables.btt_groups[np.minimum(row, n_btt_rows - 1)]
+
+    # Pressure group after the surface interval
+    n_sfi_rows = len(tables.sfi_groups)
+    row = _search_columns(tables.surface_intervals, n_sfi_rows, group, surface_time)
+    in_table = in_depths & (row < n_sfi_rows)
+    next_group = tables.sfi_groups[np.minimum(row, n_sfi_rows - 1)]
+
+    residual_nitrogen = tables.residual_nitrogen[depth_index, next_group]
+    no_deco_time = np.where(in_table, tables.max_bottom_times[depth_index] - residual_nitrogen, np.nan)
+    # Dives deeper than the tables are outside of them even when the first dive is not a no deco dive
+    return np.where(no_deco | ~in_depths, no_deco_time, 0.0)
+
+
+def save_tables(tables, path):
+    """Save compiled tables in a binary file that loads without pandas."""
+    np.savez(path, **tables._asdict())
+
+
+def load_tables(path):
+    with np.load(path) as data:
+        return PadiTables(**{name: data[name] for name in PadiTables._fields})
@@ -0,0 +1,209 @@
+import os
+import time
+import pickle
+import sqlite3
+import threading
+
+
+def default_cache_folder():
+    """Private folder for the cache files, $XDG_CACHE_HOME/gf-recommendation or ~/.cache/gf-recommendation.
+
+    Cached values are pickled, so the file must not be writable by other users. A shared folder such as
+    /tmp would let another user create it first.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "gf-recommendation")
+
+
+DEFAULT_CACHE_PATH = os.path.join(default_cache_folder(), "cache.sqlite")
+# Hit and miss counters and access times are written once per this many lookups, see PlanCache.flush
+FLUSH_EVERY = 100
+# The size limit is enforced once per this many writes
+EVICT_EVERY = 1000
+
+
+def quantize(value, quantum=1e-3):
+    """Round numeric arguments so that tiny floating point differences share the same cache entry."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return value
+    return round(round(value / quantum) * quantum, 9)
+
+
+def _check_private(path):
+    """Create the folder of path for the owner only and refuse files other users could have written."""
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, mode=0o700, exist_ok=True)
+    for name in (folder, path):
+        if not os.path.exists(name):
+            continue
+        info = os.stat(name)
+        if info.st_uid != os.getuid() or info.st_mode & 0o022:
+            raise PermissionError(f"{name} can be written by other users, use a private folder for the cache")
+
+
+class PlanCache:
+    """Bounded LRU/TTL cache for plan calculations stored in SQLite.
+
+    The cache lives in a single file, so all gunicorn workers (and notebook processes) on the same
+    machine share results. Hit and miss counters are stored in the same file. The folder of the file is
+    created readable by the owner only.
+
+    Lookups only read, so workers don't queue on the SQLite write lock for every hit. Each process counts
+    hits and misses and collects the access times in memory and writes them every FLUSH_EVERY lookups,
+    and the least recently used entries over max_entries are evicted every EVICT_EVERY writes, so the
+    cache can go over max_entries by that many entries per process in between.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=100_000, ttl=30*24*3600, quantum=1e-3,
+                 flush_every=FLUSH_EVERY, evict_every=EVICT_EVERY):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.quantum = quantum
+        self.flush_every = flush_every
+        self.evict_every = evict_every
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._reset_pending()
+        _check_private(path)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, created REAL, last_access REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+            conn.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0)")
+
+    def _connect(self):
+        # Connections can't be shared between forked processes or threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _reset_pending(self):
+        self._pid = os.getpid()
+        self._counts = {"hits": 0, "misses": 0}
+        self._accessed = {}
+        self._lookups = 0
+        self._writes = 0
+
+    def _pending(self):
+        # Counts of the parent process are not written again by a forked child
+        if self._pid != os.getpid():
+            self._reset_pending()
+
+    def _count(self, name, key=None, now=None):
+        with self._lock:
+            self._pending()
+            self._counts[name] += 1
+            if key is not None:
+                self._accessed[key] = now
+            self._lookups += 1
+            flush = self._lookups >= self.flush_every
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Write the hit and miss counters and access times collected by this process."""
+        with self._lock:
+            self._pending()
+            counts, accessed = self._counts, self._accessed
+            self._counts, self._accessed, self._lookups = {"hits": 0, "misses": 0}, {}, 0
+        if not any(counts.values()) and not accessed:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany("UPDATE counters SET value = value + ? WHERE name = ?",
+                             [(value, name) for name, value in counts.items() if value])
+            conn.executemany("UPDATE entries SET last_access = max(last_access, ?) WHERE key = ?",
+                             [(now, key) for key, now in accessed.items()])
+
+    def evict(self):
+        """Remove the least recently used entries over the size limit."""
+        conn = self._connect()
+        count = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_access LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def make_key(self, name, *args):
+        return repr((name,) + tuple(quantize(arg, self.quantum) for arg in args))
+
+    def get(self, key):
+        """Return (found, value) for the key."""
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is not None and now - row[1] > self.ttl:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            row = None
+        if row is None:
+            self._count("misses")
+            return False, None
+        self._count("hits", key, now)
+        return True, pickle.loads(row[0])
+
+    def set(self, key, value):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, pickle.dumps(value), now, now))
+        with self._lock:
+            self._pending()
+            self._writes += 1
+            evict = self._writes >= self.evict_every
+            if evict:
+                self._writes = 0
+        if evict:
+            self.evict()
+
+    def update(self, key, func):
+        """Replace the value of key with func(found, value) in one transaction and return the new value.
+
+        Other processes can't change the entry in between, so this works for counters and markers shared
+        by processes. A new value of None deletes the entry.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            found = row is not None and now - row[1] <= self.ttl
+            value = func(found, pickle.loads(row[0]) if found else None)
+            if value is None:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            else:
+                conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, pickle.dumps(value), now, now))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def memoize(self, name, func, *args):
+        """Return func(*args), calculating it only if the quantized arguments are not in the cache."""
+        key = self.make_key(name, *args)
+        found, value = self.get(key)
+        if not found:
+            value = func(*args)
+            self.set(key, value)
+        return value
+
+    def stats(self):
+        self.flush()
+        conn = self._connect()
+        counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        counters["size"] = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return counters
+
+    def clear(self):
+        with self._lock:
+            self._reset_pending()
+        conn = self._connect()
+        conn.execute("DELETE FROM entries")
+        conn.execute("UPDATE counters SET value = 0")
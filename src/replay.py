@@ -0,0 +1,388 @@
+"""Replay dive computer logs through ZHL-16C and StandardAir.
+
+Logs are read from CSV and UDDF files with generators, one dive at a time, and replayed in batches: the
+tissues of all dives of a batch are loaded sample by sample with the exact zhl16c segment solution, so a
+profile of any shape costs one vectorized step per sample. Every dive starts with tissues saturated with
+air at the surface.
+
+For every dive the results are
+  - max_gf, the highest gradient factor the tissues reached (%), to compare with the logged gf_high
+  - max_ceiling, the deepest ZHL-16C ceiling with the gf_high given to replay, like get_max_ceiling
+  - bottom_time and tdt, with the bottom ending when the diver last leaves the deepest 3 m of the dive
+  - pdcs, the StandardAir pDCS of the square dive to the EAD of the maximum depth with that bottom time
+    and decompression time
+  - recommended_gf_high, the GF High fitted to the StandardAir TDT at the pdcs given to replay, like the
+    app recommends it
+
+Files are spread over the worker pool of gf_selection and the results are written as columnar chunks
+into a store directory, read them with load_results. Files already in the store are skipped. Run
+
+    poetry run python -m src.replay <log folder> <store folder>
+
+to replay a folder of logs and print the throughput in profiles per second.
+
+CSV files have a header with time (s) and depth (m) columns, replay checks the headers of all files before
+it starts and raises ValueError if one of them is missing. The optional columns are dive (an id, for
+files with several dives), o2 and he (%, gas breathed from that sample on, air by default) and gf_high and
+gf_low (%, the settings of the dive computer).
+"""
+import os
+import csv
+import sys
+import time
+import argparse
+import functools
+import itertools
+import collections
+import multiprocessing
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
+
+try:
+    from . import gf_selection, gf_table, standair, sweep, zhl16c
+except ImportError:
+    import gf_selection
+    import gf_table
+    import standair
+    import sweep
+    import zhl16c
+
+LOG_EXTENSIONS = (".csv", ".uddf", ".xml")
+REQUIRED_CSV_COLUMNS = ("time", "depth")
+# Dives replayed together in one vectorized batch
+BATCH_SIZE = 256
+# Files replayed by one task of the worker pool at most, small files are batched together
+FILES_PER_TASK = 64
+# Result rows per chunk file of the store
+CHUNK_SIZE = 10_000
+# The bottom ends when the diver last leaves this many meters above the maximum depth
+BOTTOM_RANGE = 3.0
+# (fn2, fhe) breathed until the log says otherwise
+AIR = (0.79, 0.0)
+
+# times in minutes from the start of the dive, depths in meters and fn2 and fhe the gas breathed from each
+# sample on. gf_high and gf_low are the logged settings in percent, NaN if the log doesn't have them.
+LoggedDive = collections.namedtuple("LoggedDive", ["source", "dive", "times", "depths", "fn2", "fhe", "gf_high", "gf_low"])
+ReplayStats = collections.namedtuple("ReplayStats", ["files", "dives", "seconds", "profiles_per_second"])
+
+
+def _number(value, default=np.nan):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _logged_dive(source, dive, samples, gf_high, gf_low):
+    """LoggedDive from (seconds, depth, fn2, fhe) samples, None if it has no profile to replay."""
+    samples = np.array(samples, dtype=float).reshape(-1, 4)
+    samples = samples[~np.isnan(samples[:, :2]).any(axis=1)]
+    samples = samples[np.argsort(samples[:, 0], kind="stable")]
+    if len(samples) < 2 or samples[:, 1].max() <= 0:
+        return None
+    times = (samples[:, 0] - samples[0, 0]) / 60
+    return LoggedDive(source, str(dive), times, np.maximum(samples[:, 1], 0), samples[:, 2], samples[:, 3], gf_high, gf_low)
+
+
+def _cell(row, index):
+    return row[index] if index is not None and index < len(row) else ""
+
+
+def _csv_columns(path, header):
+    """Index of every column of a CSV header, ValueError if a required column is missing."""
+    column = {name.strip(): index for index, name in enumerate(header)}
+    missing = [name for name in REQUIRED_CSV_COLUMNS if name not in column]
+    if missing:
+        raise ValueError(f"{path}: the CSV header has no {' and '.join(missing)} column")
+    return column
+
+
+def check_csv_header(path):
+    """Raise ValueError if the CSV log at path misses a required column."""
+    with open(path, newline="") as file:
+        _csv_columns(path, next(csv.reader(file), []))
+
+
+def iter_csv_dives(path):
+    """Yield the dives of a CSV log one at a time, see the module docstring for the columns."""
+    with open(path, newline="") as file:
+        rows = csv.reader(file)
+        column = _csv_columns(path, next(rows, []))
+        time_column, depth_column = column["time"], column["depth"]
+        dive_column, o2_column, he_column = column.get("dive"), column.get("o2"), column.get("he")
+        gf_high_column, gf_low_column = column.get("gf_high"), column.get("gf_low")
+
+        key, samples, gf = None, [], (np.nan, np.nan)
+        fn2, fhe = AIR
+        for row in rows:
+            if not row:
+                continue
+            dive = _cell(row, dive_column)
+            if dive != key:
+                if samples:
+                    logged = _logged_dive(path, key, samples, *gf)
+                    if logged is not None:
+                        yield logged
+                key, samples, gf = dive, [], (np.nan, np.nan)
+                fn2, fhe = AIR
+            o2, he = _cell(row, o2_column), _cell(row, he_column)
+            if o2 or he:
+                o2, he = _number(o2, 21), _number(he, 0)
+                fn2, fhe = 1 - o2 / 100 - he / 100, he / 100
+            if _cell(row, gf_high_column):
+                gf = (_number(_cell(row, gf_high_column)), _number(_cell(row, gf_low_column)))
+            samples.append((_number(row[time_column]), _number(row[depth_column]), fn2, fhe))
+        if samples:
+            logged = _logged_dive(path, key, samples, *gf)
+            if logged is not None:
+                yield logged
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _child_text(element, name):
+    for child in element:
+        if _local_name(child.tag) == name:
+            return child.text
+    return None
+
+
+def _gradient_factor_percent(text):
+    # UDDF gives fractions, some exporters write percentages
+    value = _number(text)
+    return value * 100 if value <= 1.5 else value
+
+
+def iter_uddf_dives(path):
+    """Yield the dives of a UDDF log one at a time.
+
+    The file is parsed incrementally and every dive is dropped from memory once it has been yielded, so
+    archives with thousands of dives don't have to fit into memory. Gas switches refer to the mixes in
+    gasdefinitions, and gradientfactorhigh and gradientfactorlow apply to the dives after them.
+    """
+    mixes = {}
+    gf_high = gf_low = np.nan
+    samples = None
+    dive_id = None
+    fn2, fhe = AIR
+    for event, element in ET.iterparse(path, events=("start", "end")):
+        name = _local_name(element.tag)
+        if event == "start":
+            if name == "dive":
+                samples, dive_id = [], element.get("id", "")
+                fn2, fhe = AIR
+            continue
+
+        if name == "mix":
+            o2 = _number(_child_text(element, "o2"), 0.21)
+            he = _number(_child_text(element, "he"), 0.0)
+            mixes[element.get("id")] = (1 - o2 - he, he)
+        elif name == "gradientfactorhigh":
+            gf_high = _gradient_factor_percent(element.text)
+        elif name == "gradientfactorlow":
+            gf_low = _gradient_factor_percent(element.text)
+        elif name == "waypoint" and samples is not None:
+            for child in element:
+                if _local_name(child.tag) == "switchmix":
+                    fn2, fhe = mixes.get(child.get("ref"), (fn2, fhe))
+            samples.append((_number(_child_text(element, "divetime")), _number(_child_text(element, "depth")), fn2, fhe))
+            element.clear()
+        elif name == "dive" and samples is not None:
+            logged = _logged_dive(path, dive_id, samples, gf_high, gf_low)
+            samples = None
+            element.clear()
+            if logged is not None:
+                yield logged
+
+
+def iter_dives(path):
+    """Yield the dives of a log file, the format is chosen by the file extension."""
+    if path.lower().endswith(".csv"):
+        return iter_csv_dives(path)
+    return iter_uddf_dives(path)
+
+
+def iter_log_files(paths):
+    """Log files in paths, which can be files or folders searched recursively, in sorted order."""
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, _, files in sorted(os.walk(path)):
+                for name in sorted(files):
+                    if name.lower().endswith(LOG_EXTENSIONS):
+                        yield os.path.join(folder, name)
+        else:
+            yield path
+
+
+def _pad(values, length):
+    """values repeated at the end to length, a repeated sample is a segment of zero minutes."""
+    return np.concatenate((values, np.full(length - len(values), values[-1])))
+
+
+def recommended_gf_high(T, D, TDT, he, pdcs):
+    """GF High fitted to TDT like lookup_gf_high_many, from the GF table where it can answer and with the
+    numpy engine elsewhere. It never starts a worker pool, so it can run inside one."""
+    gf_high = np.full(len(T), np.nan)
+    table = gf_table.load_table()
+    if table is not None:
+        gf_high = table.lookup_many(D, T, he, pdcs)
+    missing = np.isnan(gf_high)
+    if missing.any():
+        df = pd.DataFrame({"T": T[missing], "D": D[missing], "TDT": TDT[missing], "he": he[missing]})
+        gf_high[missing] = gf_selection.fit_gf_to_tdt_df(df, engine="numpy")["gf_high"].to_numpy()
+    return gf_high
+
+
+def replay_dives(dives, gf_high=100, pdcs=0.02):
+    """Replay a batch of LoggedDives and return the results as a dict of columns."""
+    n = len(dives)
+    length = max(len(dive.times) for dive in dives)
+    times, depths, fn2, fhe = [np.array([_pad(getattr(dive, field), length) for dive in dives])
+                               for field in ("times", "depths", "fn2", "fhe")]
+
+    tissues = zhl16c.surface_tissues(n)
+    max_ceiling = np.full(n, -np.inf)
+    max_gf = np.full(n, -np.inf)
+    for k in range(1, length):
+        tissues = zhl16c.segment(tissues, depths[:, k - 1], depths[:, k], times[:, k] - times[:, k - 1],
+                                 fn2[:, k - 1], fhe[:, k - 1])
+        max_ceiling = np.maximum(max_ceiling, zhl16c.ceiling(tissues, gf_high / 100))
+        max_gf = np.maximum(max_gf, zhl16c.gradient_factor(tissues, depths[:, k]))
+
+    max_depth = depths.max(axis=1)
+    # Last sample within BOTTOM_RANGE of the maximum depth
+    at_bottom = depths >= (max_depth - BOTTOM_RANGE)[:, None]
+    last_at_bottom = length - 1 - np.argmax(at_bottom[:, ::-1], axis=1)
+    bottom_time = times[np.arange(n), last_at_bottom]
+    duration = times[:, -1]
+    tdt = duration - bottom_time
+
+    # Equivalent air depth on the gas of the first sample, the same way as the app
+    ead = ((max_depth / 10 + 1) * (fn2[:, 0] + fhe[:, 0]) / 0.79 - 1) * 10
+    he = fhe[:, 0] * 100
+    standair_tdt = standair.tdt(ead, bottom_time, pdcs)
+    with np.errstate(invalid="ignore"):
+        dive_pdcs = standair.pdcs(ead, bottom_time, tdt)
+
+    recommended = np.full(n, np.nan)
+    fit = (ead > 0) & (bottom_time > 0)
+    if fit.any():
+        recommended[fit] = recommended_gf_high(bottom_time[fit], ead[fit], standair_tdt[fit], he[fit], pdcs)
+
+    return {
+        "source": [dive.source for dive in dives],
+        "dive": [dive.dive for dive in dives],
+        "samples": np.array([len(dive.times) for dive in dives]),
+        "duration": duration,
+        "max_depth": max_depth,
+        "bottom_time": bottom_time,
+        "tdt": tdt,
+        "o2": 100 - (fn2[:, 0] + fhe[:, 0]) * 100,
+        "he": he,
+        "ead": ead,
+        "logged_gf_high": np.array([dive.gf_high for dive in dives], dtype=float),
+        "logged_gf_low": np.array([dive.gf_low for dive in dives], dtype=float),
+        "max_gf": max_gf * 100,
+        "max_ceiling": max_ceiling,
+        "pdcs": dive_pdcs,
+        "standair_tdt": standair_tdt,
+        "recommended_gf_high": recommended,
+    }
+
+
+def replay_files(paths, gf_high=100, pdcs=0.02, batch_size=BATCH_SIZE):
+    """Replay all dives of the log files in batches, returns a DataFrame with a row per dive.
+
+    The dives of consecutive files go into the same batches, so logs with a dive per file are vectorized
+    as well as archives with many dives per file.
+    """
+    dives = itertools.chain.from_iterable(iter_dives(path) for path in paths)
+    results = []
+    while True:
+        batch = list(itertools.islice(dives, batch_size))
+        if not batch:
+            break
+        results.append(pd.DataFrame(replay_dives(batch, gf_high, pdcs)))
+    if not results:
+        return pd.DataFrame()
+    return pd.concat(results, ignore_index=True)
+
+
+def load_results(store_path):
+    """All replay results in the store as a DataFrame."""
+    return sweep.load_store(store_path)
+
+
+def replay(paths, store_path, gf_high=100, pdcs=0.02, parallel=True, num_workers=None,
+           batch_size=BATCH_SIZE, chunk_size=CHUNK_SIZE, progress=False):
+    """Replay the log files in paths (files or folders) into the store and return ReplayStats.
+
+    With parallel, groups of up to FILES_PER_TASK files are replayed in the worker pool of gf_selection,
+    and the results are written as the groups finish. Only the results not yet in a chunk are kept in
+    memory, and a chunk always has all dives of its files.
+    """
+    start = time.perf_counter()
+    os.makedirs(store_path, exist_ok=True)
+    stored = load_results(store_path)
+    done = set(stored["source"]) if "source" in stored else set()
+    files = [path for path in iter_log_files(paths) if path not in done]
+    # A bad file would otherwise stop the replay in a worker after other files were written
+    for path in files:
+        if path.lower().endswith(".csv"):
+            check_csv_header(path)
+
+    func = functools.partial(replay_files, gf_high=gf_high, pdcs=pdcs, batch_size=batch_size)
+    files_per_task = FILES_PER_TASK
+    if parallel and len(files) > 1:
+        num_workers = num_workers or multiprocessing.cpu_count()
+        # Several tasks per worker keep the workers busy when some files are much larger than others
+        files_per_task = min(max(1, len(files) // (num_workers * 4)), FILES_PER_TASK)
+    tasks = [files[i:i + files_per_task] for i in range(0, len(files), files_per_task)]
+    if parallel and len(files) > 1:
+        results = gf_selection.get_pool(num_workers).imap_unordered(func, tasks)
+    else:
+        results = map(func, tasks)
+
+    pending = []
+    rows = dives = 0
+    for tasks_done, result in enumerate(results, 1):
+        if len(result):
+            pending.append(result)
+            rows += len(result)
+            dives += len(result)
+        if rows >= chunk_size:
+            sweep.write_chunk(store_path, pd.concat(pending, ignore_index=True))
+            pending, rows = [], 0
+        if progress:
+            print(f"\rReplayed {dives} dives, {tasks_done}/{len(tasks)} groups of files", end="", file=sys.stderr)
+    if pending:
+        sweep.write_chunk(store_path, pd.concat(pending, ignore_index=True))
+    if progress:
+        print(file=sys.stderr)
+
+    seconds = time.perf_counter() - start
+    return ReplayStats(len(files), dives, seconds, dives / seconds if seconds > 0 else 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay dive computer logs through ZHL-16C and StandardAir.")
+    parser.add_argument("logs", nargs="+", help="log files or folders with .csv and .uddf files")
+    parser.add_argument("store", help="folder for the results")
+    parser.add_argument("--gf-high", type=float, default=100, help="GF High of max_ceiling (%%)")
+    parser.add_argument("--pdcs", type=float, default=2.0, help="accepted pDCS of the recommendation (%%)")
+    parser.add_argument("--workers", type=int, help="worker processes, by default one per core")
+    parser.add_argument("--serial", action="store_true", help="replay in this process only")
+    args = parser.parse_args()
+
+    stats = replay(args.logs, args.store, args.gf_high, args.pdcs / 100, parallel=not args.serial,
+                   num_workers=args.workers, progress=True)
+    gf_selection.close_pool()
+    print(f"Replayed {stats.dives} profiles from {stats.files} files in {stats.seconds:.1f} s "
+          f"({stats.profiles_per_second:,.0f} profiles/s)")
+
+
+if __name__ == "__main__":
+    main()
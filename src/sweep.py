@@ -0,0 +1,108 @@
+"""Resumable grid sweeps with an on-disk result store.
+
+A sweep runs a gf_selection chunk function, such as fit_gf_to_tdt_df or get_gf_to_repetative_dives, over
+a DataFrame of parameter points. Results are written in chunks into a store directory, one columnar .npz
+file per chunk, with every row keyed by a hash of its parameters. Running the sweep again only computes
+the points that are not in the store yet, so an interrupted sweep continues where it stopped and a widened
+grid only computes the new points. A store belongs to a single function, use another path for another one.
+"""
+import os
+import re
+import glob
+import hashlib
+import itertools
+import numpy as np
+import pandas as pd
+
+try:
+    from . import gf_selection
+except ImportError:
+    import gf_selection
+
+KEY_COLUMN = "_key"
+# Chunk files of a store. Temporary files start with a dot, so they never match.
+CHUNK_PATTERN = re.compile(r"chunk-(\d+)\.npz")
+
+
+def make_grid(**axes):
+    """DataFrame with every combination of the given parameter values, e.g. make_grid(T=[30, 60], D=[20, 30])."""
+    return pd.DataFrame(list(itertools.product(*axes.values())), columns=list(axes.keys()))
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, (bool, np.bool_))
+
+
+def parameter_keys(points, key_columns=None):
+    """Hash of the parameters of every row. Numbers are hashed as rounded floats, so that recreated grids
+    get the same keys and 10 and 10.0 are the same point."""
+    key_columns = key_columns or list(points.columns)
+    values = points[key_columns].to_numpy(dtype=object)
+    keys = []
+    for row in values:
+        row = tuple(round(float(v), 9) if _is_number(v) else v for v in row)
+        keys.append(hashlib.sha1(repr(row).encode()).hexdigest()[:16])
+    return keys
+
+
+def chunk_paths(store_path):
+    """(number, path) of the chunk files in the store, in order."""
+    chunks = []
+    for path in glob.glob(os.path.join(store_path, "chunk-*.npz")):
+        match = CHUNK_PATTERN.fullmatch(os.path.basename(path))
+        if match:
+            chunks.append((int(match.group(1)), path))
+    return sorted(chunks)
+
+
+def load_store(store_path):
+    """All results in the store as a DataFrame."""
+    chunks = []
+    for _, path in chunk_paths(store_path):
+        with np.load(path, allow_pickle=True) as data:
+            chunks.append(pd.DataFrame({column: data[column] for column in data["_columns"]}))
+    if not chunks:
+        return pd.DataFrame(columns=[KEY_COLUMN])
+    return pd.concat(chunks, ignore_index=True)
+
+
+def write_chunk(store_path, df):
+    """Add the rows of df to the store as a new chunk file."""
+    number = 1 + max([number for number, _ in chunk_paths(store_path)], default=-1)
+    path = os.path.join(store_path, f"chunk-{number:06d}.npz")
+    columns = {column: df[column].to_numpy() for column in df.columns}
+    # Write to a temporary file first so that a crash never leaves a half written chunk. Its name does not
+    # match the chunk files, so a file left behind by a crash is ignored.
+    tmp_path = os.path.join(store_path, f".tmp-chunk-{number:06d}-{os.getpid()}.npz")
+    np.savez(tmp_path, _columns=np.array(list(df.columns), dtype=object), **columns)
+    os.replace(tmp_path, path)
+
+
+def run_sweep(points, func, store_path, key_columns=None, chunk_size=500, parallel=True, progress=False, **kwargs):
+    """Run func over the points that are not in the store yet and return results for all points.
+
+    points is a DataFrame of parameters (see make_grid) and func a function from a DataFrame chunk to the
+    same chunk with result columns added. key_columns are the columns identifying a point, by default all
+    columns of points. With parallel=True every chunk goes through gf_selection.parallelize_dataframe,
+    with kwargs passed on to it.
+    """
+    os.makedirs(store_path, exist_ok=True)
+    points = points.copy()
+    points[KEY_COLUMN] = parameter_keys(points, key_columns)
+    points = points.drop_duplicates(KEY_COLUMN)
+
+    done = set(load_store(store_path)[KEY_COLUMN])
+    todo = points[~points[KEY_COLUMN].isin(done)]
+    for start in range(0, len(todo), chunk_size):
+        chunk = todo.iloc[start:start + chunk_size].copy()
+        if parallel:
+            chunk = gf_selection.parallelize_dataframe(chunk, func, **kwargs)
+        else:
+            chunk = func(chunk)
+        write_chunk(store_path, chunk)
+        if progress:
+            print(f"Sweep: {len(done) + start + len(chunk)} points in store, {len(todo) - start - len(chunk)} to go")
+
+    results = load_store(store_path).drop_duplicates(KEY_COLUMN)
+    results = results.drop(columns=[c for c in points.columns if c != KEY_COLUMN and c in results])
+    return points.merge(results, on=KEY_COLUMN, how="left").drop(columns=KEY_COLUMN)
@@ -0,0 +1,329 @@
+"""Vectorized Buhlmann ZHL-16C engine for square dive profiles.
+
+All dives of a batch are simulated at once. Tissue loadings are NumPy arrays of shape (N, 16), where N
+is the number of dives, and every segment is integrated with the exact Haldane/Schreiner solution, so
+there is no time stepping inside a segment. The profile follows the one used in gf_selection.get_gf_tdt:
+descent, bottom time, ascent with whole minute stops on a 3 m grid. The ascent is on the bottom gas unless
+deco gases are given, see simulate_ascent.
+
+With stop_solver="schreiner" the length of each stop is found by searching directly for the first whole
+minute after which the tissues allow the ascent to the next stop, evaluating the closed form solutions at
+that time. A stop of m minutes then costs about 2*log2(m) evaluations instead of m one minute steps, and
+the schedule is the same as with stop_solver="minutes".
+
+The engine does not reproduce pydplan calculatePlan exactly. tests/test_zhl16c.py compares it with the
+calculatePlan GF High fits in tests/data/calculateplan_gf_fits.csv: a fit brackets the calculatePlan total
+decompression time between two GF High values, which gives the smallest difference to this engine that is
+consistent with the fit. TDT_TOLERANCE is the largest of those differences rounded up to a whole minute.
+They are up to about 10 minutes for dives with less than 2 hours of decompression and grow with it. The
+test also compares the total decompression times directly when the pydplan submodule is checked out.
+"""
+import collections
+import numpy as np
+
+SURFACE_PRESSURE = 1.01325  # bar
+WATER_VAPOUR_PRESSURE = 0.0627  # bar, alveolar at 37 C
+METERS_PER_BAR = 10.0
+AIR_N2 = 0.7902
+
+# Measured difference to pydplan calculatePlan in total decompression time, minutes, see tests/test_zhl16c.py
+TDT_TOLERANCE = 48.0
+
+# ZHL-16C with compartment 1b
+N2_HALF_TIMES = np.array([5.0, 8.0, 12.5, 18.5, 27.0, 38.3, 54.3, 77.0, 109.0, 146.0, 187.0, 239.0, 305.0, 390.0, 498.0, 635.0])
+N2_A = np.array([1.1696, 1.0, 0.8618, 0.7562, 0.6200, 0.5043, 0.4410, 0.4000, 0.3750, 0.3500, 0.3295, 0.3065, 0.2835, 0.2610, 0.2480, 0.2327])
+N2_B = np.array([0.5578, 0.6514, 0.7222, 0.7825, 0.8126, 0.8434, 0.8693, 0.8910, 0.9092, 0.9222, 0.9319, 0.9403, 0.9477, 0.9544, 0.9602, 0.9653])
+HE_HALF_TIMES = np.array([1.88, 3.02, 4.72, 6.99, 10.21, 14.48, 20.53, 29.11, 41.20, 55.19, 70.69, 90.34, 115.29, 147.42, 188.24, 240.03])
+HE_A = np.array([1.6189, 1.3830, 1.1919, 1.0458, 0.9220, 0.8205, 0.7305, 0.6502, 0.5950, 0.5545, 0.5333, 0.5189, 0.5181, 0.5176, 0.5172, 0.5119])
+HE_B = np.array([0.4770, 0.5747, 0.6527, 0.7223, 0.7582, 0.7957, 0.8279, 0.8553, 0.8757, 0.8903, 0.8997, 0.9073, 0.9122, 0.9171, 0.9217, 0.9267])
+
+N2_K = np.log(2) / N2_HALF_TIMES
+HE_K = np.log(2) / HE_HALF_TIMES
+
+Tissues = collections.namedtuple("Tissues", ["n2", "he"])
+# Tissues at the start, after the descent and at the end of the bottom time, with the inputs of the ascent
+BottomState = collections.namedtuple(
+    "BottomState", ["T", "D", "fn2", "fhe", "desc_time", "start_tissues", "descent_tissues", "tissues"]
+)
+
+SquareDiveResult = collections.namedtuple(
+    "SquareDiveResult", ["tdt", "runtime", "max_ceiling", "first_stop", "tissues", "failed", "profile", "cut_off"]
+)
+
+
+def depth_to_pressure(depth):
+    return SURFACE_PRESSURE + np.asarray(depth, dtype=float) / METERS_PER_BAR
+
+
+def pressure_to_depth(pressure):
+    return (pressure - SURFACE_PRESSURE) * METERS_PER_BAR
+
+
+def surface_tissues(n):
+    """Tissues of n divers saturated with air at the surface."""
+    n2 = np.full((n, 16), (SURFACE_PRESSURE - WATER_VAPOUR_PRESSURE) * AIR_N2)
+    return Tissues(n2, np.zeros((n, 16)))
+
+
+def _schreiner(p0, p_inspired, rate, k, t):
+    """Schreiner equation for inspired inert gas pressure changing linearly with rate (bar/min)."""
+    return p_inspired + rate * (t - 1 / k) - (p_inspired - p0 - rate / k) * np.exp(-k * t)
+
+
+def segment(tissues, depth_start, depth_end, duration, fn2, fhe):
+    """Load tissues for a segment changing depth linearly from depth_start to depth_end.
+
+    depth_start, depth_end, duration, fn2 and fhe are scalars or arrays of shape (N,).
+    """
+    duration = np.asarray(duration, dtype=float)[..., None]
+    p_start = depth_to_pressure(depth_start)[..., None] - WATER_VAPOUR_PRESSURE
+    p_end = depth_to_pressure(depth_end)[..., None] - WATER_VAPOUR_PRESSURE
+    safe_duration = np.where(duration > 0, duration, 1.0)
+    rate = np.where(duration > 0, (p_end - p_start) / safe_duration, 0.0)
+    fn2 = np.asarray(fn2, dtype=float)[..., None]
+    fhe = np.asarray(fhe, dtype=float)[..., None]
+    n2 = _schreiner(tissues.n2, p_start * fn2, rate * fn2, N2_K, duration)
+    he = _schreiner(tissues.he, p_start * fhe, rate * fhe, HE_K, duration)
+    return Tissues(n2, he)
+
+
+def ceiling(tissues, gf):
+    """Ceiling depth in meters for each dive with gradient factor gf (fraction). Negative when there is no ceiling."""
+    p = tissues.n2 + tissues.he
+    a = (N2_A * tissues.n2 + HE_A * tissues.he) / p
+    b = (N2_B * tissues.n2 + HE_B * tissues.he) / p
+    gf = np.asarray(gf, dtype=float)[..., None]
+    p_tolerated = (p - a * gf) / (gf / b + 1 - gf)
+    return pressure_to_depth(p_tolerated.max(axis=-1))
+
+
+def gradient_factor(tissues, depth):
+    """Highest supersaturation of the compartments at depth as a fraction of the M-value gradient.
+
+    This is the gradient factor the tissues are at: 1 at the M-value, 0 at ambient pressure and negative
+    below it.
+    """
+    p = tissues.n2 + tissues.he
+    a = (N2_A * tissues.n2 + HE_A * tissues.he) / p
+    b = (N2_B * tissues.n2 + HE_B * tissues.he) / p
+    p_ambient = depth_to_pressure(depth)[..., None]
+    m_value = p_ambient / b + a
+    return ((p - p_ambient) / (m_value - p_ambient)).max(axis=-1)
+
+
+def _gf_at(depth, first_stop, gf_low, gf_high):
+    """Gradient factor slope from GF low at the first stop to GF high at the surface."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = gf_high + (gf_low - gf_high) * depth / first_stop
+    return np.where(np.isnan(first_stop) | (first_stop <= 0), gf_low, np.minimum(slope, gf_low))
+
+
+def deco_gas_fractions(deco_gases, n):
+    """(switch_depth, fn2, fhe) arrays of shape (N,) for every deco gas given as (switch_depth, o2, he)."""
+    fractions = []
+    for switch_depth, o2, he in deco_gases:
+        switch_depth, o2, he = [np.broadcast_to(np.asarray(x, dtype=float), (n,)) for x in (switch_depth, o2, he)]
+        fractions.append((switch_depth, 1 - o2 / 100 - he / 100, he / 100))
+    return fractions
+
+
+def _breathing_gas(depth, fn2, fhe, fractions, rows):
+    """Inert gas fractions at depth: the last deco gas whose switch depth has been reached, else the bottom gas."""
+    for switch_depth, gas_fn2, gas_fhe in fractions:
+        # NaN switch depths are never reached
+        switched = depth <= switch_depth[rows] + 1e-9
+        fn2 = np.where(switched, gas_fn2[rows], fn2)
+        fhe = np.where(switched, gas_fhe[rows], fhe)
+    return fn2, fhe
+
+
+def _stop_length(tissues, depth, next_depth, travel_time, fn2, fhe, gf_next, max_minutes):
+    """Shortest whole minute stop at depth after which the ascent to next_depth is within the ceiling.
+
+    Exponential search for an upper bound followed by bisection, for all stopping dives at once.
+    The stop is assumed to be needed, i.e. the ascent is not allowed after 0 minutes.
+    Dives that can't leave within max_minutes get max_minutes.
+    """
+    def can_leave(minutes):
+        stayed = segment(tissues, depth, depth, minutes, fn2, fhe)
+        moved = segment(stayed, depth, next_depth, travel_time, fn2, fhe)
+        return ceiling(moved, gf_next) <= next_depth + 1e-9
+
+    lo = np.zeros(depth.shape)
+    hi = np.minimum(1.0, max_minutes)
+    ok = can_leave(hi)
+    while not (ok | (hi >= max_minutes)).all():
+        lo = np.where(ok, lo, hi)
+        hi = np.where(ok, hi, np.minimum(2 * hi, max_minutes))
+        ok = can_leave(hi)
+
+    # The answer is in (lo, hi]
+    while (hi - lo > 1).any():
+        mid = np.floor((lo + hi) / 2)
+        ok_mid = can_leave(mid) & (hi - lo > 1)
+        lo = np.where(ok_mid | (hi - lo <= 1), lo, mid)
+        hi = np.where(ok_mid, mid, hi)
+    return hi
+
+
+def simulate_square_dives(T, D, gf_high, gf_low=None, he=0, o2=21, tissues=None,
+                          desc_rate=99, asc_rate_to_deco=10, asc_rate_at_deco=3, asc_rate_to_surface=1,
+                          stop_interval=3, last_stop=3, max_deco_time=1000, stop_solver="schreiner",
+                          record_profile=False, max_tdt=None, deco_gases=None):
+    """Simulate N square dives at once.
+
+    T (bottom time, min), D (depth, m), gf_high and gf_low (percent), he and o2 (percent) are scalars or
+    arrays of shape (N,). Rates are in meters per minute. tissues continues from an earlier state, for
+    example after a surface interval. Dives needing more than max_deco_time minutes of ascent are marked
+    as failed, like calculatePlan raising ValueError when it runs out of iterations. stop_solver is
+    "minutes" to step stops one minute at a time or "schreiner" to solve stop lengths directly.
+
+    max_tdt (scalar or (N,) array) stops the simulation of a dive as soon as its decompression time is
+    known to be longer, which is all a search for a target TDT needs to know. Such dives are marked in
+    cut_off and their tdt is the time so far, a lower bound that is already longer than max_tdt.
+
+    deco_gases is a list of (switch_depth, o2, he) gases for the ascent, see simulate_ascent.
+
+    Returns a SquareDiveResult with arrays of shape (N,). tdt is the runtime minus bottom time, the same
+    way get_gf_tdt calculates it. profile is a (times, depths, ceilings) tuple of (steps, N) arrays if
+    record_profile.
+
+    This is simulate_bottom followed by simulate_ascent. Searches over gradient factors should call those
+    directly, so that the descent and bottom are simulated only once.
+    """
+    bottom = simulate_bottom(T, D, he, o2, tissues, desc_rate)
+    return simulate_ascent(bottom, gf_high, gf_low, asc_rate_to_deco=asc_rate_to_deco,
+                           asc_rate_at_deco=asc_rate_at_deco, asc_rate_to_surface=asc_rate_to_surface,
+                           stop_interval=stop_interval, last_stop=last_stop, max_deco_time=max_deco_time,
+                           stop_solver=stop_solver, record_profile=record_profile, max_tdt=max_tdt,
+                           deco_gases=deco_gases)
+
+
+def _broadcast_tissues(tissues, n):
+    """Copy of tissues with n rows, so that one diver can be broadcast against many."""
+    return Tissues(np.array(np.broadcast_to(tissues.n2, (n, 16))), np.array(np.broadcast_to(tissues.he, (n, 16))))
+
+
+def simulate_bottom(T, D, he=0, o2=21, tissues=None, desc_rate=99):
+    """Descent and bottom phase of N square dives, see simulate_square_dives for the arguments.
+
+    Gradient factors only affect the ascent, so the returned BottomState can be passed to simulate_ascent
+    for any number of gradient factors.
+    """
+    T, D, he, o2 = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float)) for x in (T, D, he, o2)])
+    n = T.shape[0] if tissues is None else np.broadcast_shapes(T.shape, tissues.n2.shape[:1])[0]
+    T, D, he, o2 = [np.broadcast_to(x, (n,)) for x in (T, D, he, o2)]
+    if (D <= 0).any():
+        raise ValueError("Depths must be positive")
+    fhe = he / 100
+    fn2 = 1 - o2 / 100 - fhe
+    start_tissues = surface_tissues(n) if tissues is None else _broadcast_tissues(tissues, n)
+    desc_time = D / desc_rate
+    descent_tissues = segment(start_tissues, 0, D, desc_time, fn2, fhe)
+    bottom_tissues = segment(descent_tissues, D, D, T, fn2, fhe)
+    return BottomState(T, D, fn2, fhe, desc_time, start_tissues, descent_tissues, bottom_tissues)
+
+
+def simulate_ascent(bottom, gf_high, gf_low=None, rows=None, asc_rate_to_deco=10, asc_rate_at_deco=3,
+                    asc_rate_to_surface=1, stop_interval=3, last_stop=3, max_deco_time=1000,
+                    stop_solver="schreiner", record_profile=False, max_tdt=None, deco_gases=None):
+    """Ascent and decompression from a BottomState of simulate_bottom, see simulate_square_dives.
+
+    rows selects dives of bottom. A single dive is broadcast against arrays of gradient factors, so
+    simulate_ascent(simulate_bottom(T, D), [60, 70, 80]) simulates one dive with three GFs. bottom is not
+    modified.
+
+    deco_gases is a list of (switch_depth, o2, he) gases, deepest switch first, with scalars or (N,) arrays
+    that are broadcast like the gradient factors. The diver switches to a gas on arriving at or above its
+    switch depth and the switch takes no time. A NaN switch depth means that the dive does not carry the
+    gas, so dives with a different number of deco gases can be simulated together.
+    """
+    if rows is not None:
+        bottom = BottomState(*[x[rows] for x in bottom[:5]], *[Tissues(t.n2[rows], t.he[rows]) for t in bottom[5:]])
+    gf_high, gf_low = [np.atleast_1d(np.asarray(x, dtype=float)) for x in (gf_high, gf_high if gf_low is None else gf_low)]
+    deco_gases = [] if deco_gases is None else deco_gases
+    n = np.broadcast_shapes(bottom.T.shape, gf_high.shape, gf_low.shape,
+                            *[np.shape(x) for gas in deco_gases for x in gas])[0]
+    fractions = deco_gas_fractions(deco_gases, n)
+    T, D, fn2, fhe, desc_time, gf_high, gf_low = [
+        np.array(np.broadcast_to(x, (n,))) for x in (*bottom[:5], gf_high, gf_low)
+    ]
+    gf_high = gf_high / 100
+    gf_low = gf_low / 100
+    tissues = _broadcast_tissues(bottom.tissues, n)
+    if max_tdt is not None:
+        max_tdt = np.broadcast_to(np.asarray(max_tdt, dtype=float), (n,))
+
+    start_ceiling = ceiling(_broadcast_tissues(bottom.start_tissues, n), gf_low)
+    descent_ceiling = ceiling(_broadcast_tissues(bottom.descent_tissues, n), gf_low)
+    runtime = desc_time + T
+    depth = D.copy()
+    first_stop = np.full(n, np.nan)
+    max_ceiling = np.maximum.reduce([start_ceiling, descent_ceiling, ceiling(tissues, gf_low)])
+    failed = np.zeros(n, dtype=bool)
+    cut_off = np.zeros(n, dtype=bool)
+    active = depth > 0
+    current_ceiling = ceiling(tissues, gf_low)
+    profile = [(np.zeros(n), np.zeros(n), start_ceiling), (desc_time.copy(), D.copy(), descent_ceiling),
+               (runtime.copy(), D.copy(), current_ceiling.copy())]
+
+    if stop_solver not in ("minutes", "schreiner"):
+        raise ValueError(f"Unknown stop solver {stop_solver}")
+
+    # Ascent: move up one grid step if the ceiling allows it, otherwise stop.
+    # Only the dives still in the water are updated on each round.
+    while active.any():
+        i = np.flatnonzero(active)
+        current = Tissues(tissues.n2[i], tissues.he[i])
+        next_depth = (np.ceil(depth[i] / stop_interval - 1e-9) - 1) * stop_interval
+        next_depth = np.where(next_depth < last_stop, 0.0, next_depth)
+        rate = np.where(np.isnan(first_stop[i]), asc_rate_to_deco, asc_rate_at_deco)
+        rate = np.where(next_depth == 0, asc_rate_to_surface, rate)
+        travel_time = (depth[i] - next_depth) / rate
+        gas_fn2, gas_fhe = _breathing_gas(depth[i], fn2[i], fhe[i], fractions, i)
+
+        moved = segment(current, depth[i], next_depth, travel_time, gas_fn2, gas_fhe)
+        gf_next = _gf_at(next_depth, first_stop[i], gf_low[i], gf_high[i])
+        move = ceiling(moved, gf_next) <= next_depth + 1e-9
+
+        first_stop[i] = np.where(~move & np.isnan(first_stop[i]), depth[i], first_stop[i])
+        stop_time = np.ones(len(i))
+        s = ~move
+        if stop_solver == "schreiner" and s.any():
+            j = i[s]
+            gf_stop = _gf_at(next_depth[s], first_stop[j], gf_low[j], gf_high[j])
+            max_minutes = np.maximum(np.floor(max_deco_time - (runtime[j] - T[j] - desc_time[j])) + 1, 1)
+            if max_tdt is not None:
+                # A stop longer than this is cut off anyway
+                max_minutes = np.minimum(max_minutes, np.maximum(np.floor(max_tdt[j] - (runtime[j] - T[j])) + 1, 1))
+            # Leaving a stop is always at the deco ascent rate
+            stop_travel_time = (depth[j] - next_depth[s]) / np.where(next_depth[s] == 0, asc_rate_to_surface, asc_rate_at_deco)
+            stop_time[s] = _stop_length(Tissues(current.n2[s], current.he[s]), depth[j], next_depth[s], stop_travel_time,
+                                        gas_fn2[s], gas_fhe[s], gf_stop, max_minutes)
+        stayed = segment(current, depth[i], depth[i], stop_time, gas_fn2, gas_fhe)
+        tissues.n2[i] = np.where(move[:, None], moved.n2, stayed.n2)
+        tissues.he[i] = np.where(move[:, None], moved.he, stayed.he)
+        runtime[i] += np.where(move, travel_time, stop_time)
+        depth[i] = np.where(move, next_depth, depth[i])
+        gf_now = _gf_at(depth[i], first_stop[i], gf_low[i], gf_high[i])
+        current_ceiling[i] = ceiling(Tissues(tissues.n2[i], tissues.he[i]), gf_now)
+        max_ceiling[i] = np.maximum(max_ceiling[i], current_ceiling[i])
+        if record_profile:
+            profile.append((runtime.copy(), depth.copy(), current_ceiling.copy()))
+
+        failed[i] = runtime[i] - T[i] - desc_time[i] > max_deco_time
+        if max_tdt is not None:
+            cut_off[i] = ~failed[i] & (depth[i] > 0) & (runtime[i] - T[i] > max_tdt[i])
+        active = (depth > 0) & ~failed & ~cut_off
+
+    tdt = np.where(failed, np.nan, runtime - T)
+    if record_profile:
+        profile = tuple(np.array([p[k] for p in profile]) for k in range(3))
+    else:
+        profile = None
+    return SquareDiveResult(tdt, runtime, max_ceiling, first_stop, tissues, failed, profile, cut_off)
+
+
+def surface_interval(tissues, minutes):
+    """Off-gas tissues breathing air at the surface for the given minutes (scalar or (N,) array)."""
+    return segment(tissues, 0, 0, minutes, AIR_N2, 0.0)
@@ -0,0 +1,101 @@
+"""Batch plan validation, deduplication and the /api/plans endpoint."""
+import json
+import numpy as np
+import pytest
+
+from src import batch, gf_selection
+
+
+@pytest.fixture(autouse=True)
+def fitted_lookups(monkeypatch):
+    """GF High lookups with the numpy engine, which does not need pydplan. Records the dives looked up."""
+    calls = []
+
+    def lookup_gf_high_many(T, D, pdcs, he=0):
+        import pandas as pd
+
+        T, D, pdcs, he = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (T, D, pdcs, he)])
+        calls.append(len(T))
+        df = pd.DataFrame({'T': T, 'D': D, 'TDT': gf_selection.get_standair_tdt(D, T, pdcs), 'he': he})
+        return gf_selection.fit_gf_to_tdt_df(df, engine="numpy")['gf_high'].to_numpy()
+
+    monkeypatch.setattr(gf_selection, "lookup_gf_high_many", lookup_gf_high_many)
+    return calls
+
+
+@pytest.mark.parametrize("plans, message", [
+    ({"depth": 30}, "Expected a list of plans"),
+    ([[30, 20]], "Plan 0: expected an object"),
+    ([{"depth": 30, "time": 20, "gas": "air"}], "Plan 0: unknown fields gas"),
+    ([{"depth": 30}], "Plan 0: time is required"),
+    ([{"depth": 30, "time": "20"}], "Plan 0: time must be a number"),
+    ([{"depth": 30, "time": True}], "Plan 0: time must be a number"),
+    ([{"depth": 30, "time": 20}, {"depth": 0, "time": 20}], "Plan 1: depth and time must be positive"),
+    ([{"depth": 30, "time": 20, "o2_percentage": 80, "he_percentage": 30}], "Plan 0: invalid gas 80.0/30.0"),
+    ([{"depth": 30, "time": 20, "pdcs": 100}], "Plan 0: pdcs must be between 0 and 100 %"),
+    ([{"depth": 30, "time": 20, "surface_time": -1}], "Plan 0: surface_time can't be negative"),
+])
+def test_parse_plans_rejects_invalid_plans(plans, message):
+    with pytest.raises(batch.PlanError, match=message):
+        batch.parse_plans(plans)
+
+
+def test_parse_plans_fills_defaults():
+    plans = batch.parse_plans([{"depth": 30, "time": 20}, {"depth": 18, "time": 40, "surface_time": 1.5}])
+    np.testing.assert_array_equal(plans[:, :5], [[30, 20, 21, 0, 2], [18, 40, 21, 0, 2]])
+    assert np.isnan(plans[0, 5]) and plans[1, 5] == 1.5
+    assert batch.parse_plans([]).shape == (0, len(batch.FIELDS))
+
+
+def test_duplicates_are_calculated_once(fitted_lookups):
+    plans = [{"depth": 30, "time": 40}, {"depth": 40, "time": 25, "he_percentage": 20},
+             {"depth": 30, "time": 40}, {"depth": 30, "time": 40, "surface_time": 2}]
+    results = batch.plan_batch(plans)
+    # Two lookups, without and with helium, for each of the three distinct plans
+    assert fitted_lookups == [6]
+    assert results[0] == results[2]
+    # 2 hours on the surface lowers GF High by 37 - 120 / 5 points, the first dive of the day is not adjusted
+    assert results[0]["gf_high_surface_time"] == results[0]["gf_high_he"]
+    assert results[3]["gf_high_surface_time"] == results[0]["gf_high_he"] - 13
+    assert results[0]["gf_high"] == results[0]["gf_high_he"]
+    streamed = dict(batch.iter_results(batch.parse_plans(plans), chunk_size=1))
+    assert [streamed[i] for i in range(len(plans))] == results
+
+
+def test_no_deco_plans_have_no_gf_high(fitted_lookups):
+    # Shallow nitrox has a negative EAD, which counts as the surface
+    results = batch.plan_batch([{"depth": 1, "time": 10, "o2_percentage": 40},
+                                {"depth": 5, "time": 30, "o2_percentage": 100}])
+    assert results == [{"ead": 0.0, "tdt": 0.0, "gf_high": None, "gf_high_he": None, "gf_high_surface_time": None}] * 2
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # app enables the plan cache and creates a job queue on import
+    monkeypatch.setenv("GF_CACHE_PATH", str(tmp_path / "cache.sqlite"))
+    monkeypatch.setenv("GF_JOBS_PATH", str(tmp_path / "jobs.sqlite"))
+    from src import app
+    gf_selection.disable_cache()
+    return app.server.test_client()
+
+
+def test_endpoint_streams_ndjson(client):
+    plans = [{"depth": 30, "time": 40}, {"depth": 1, "time": 10}, {"depth": 30, "time": 40}]
+    response = client.post("/api/plans?stream=1", json=plans)
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert sorted(line.pop("index") for line in lines) == [0, 1, 2]
+    expected = client.post("/api/plans", json={"plans": plans}).get_json()["results"]
+    assert sorted(lines, key=json.dumps) == sorted(expected, key=json.dumps)
+
+    body = "\n".join(json.dumps(plan) for plan in plans) + "\n"
+    response = client.post("/api/plans", data=body, content_type="application/x-ndjson")
+    assert response.get_json()["results"] == expected
+
+
+def test_endpoint_rejects_invalid_plans(client):
+    response = client.post("/api/plans", json=[{"depth": 30}])
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Plan 0: time is required"}
+    response = client.post("/api/plans", data="{not json\n", content_type="application/x-ndjson")
+    assert response.status_code == 400
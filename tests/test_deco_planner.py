@@ -0,0 +1,65 @@
+"""plan_deco gives the same best plans as fitting every gas configuration."""
+import numpy as np
+
+from src import deco_planner, zhl16c
+
+GASES = [(32, 0), (36, 0), (40, 0), (50, 0), (60, 0), (80, 0), (100, 0)]
+
+
+def exhaustive(T, D, TDT, **kwargs):
+    """Every configuration fitted in a single task, ranked like plan_deco."""
+    configurations = deco_planner.candidate_configurations(D, **kwargs)
+    bottom = zhl16c.simulate_bottom(T, D)
+    gf_high, tdt = deco_planner._fit_deco_gases(
+        (bottom, TDT, len(configurations), deco_planner._deco_gas_arrays(configurations)),
+    )
+    plans = [
+        deco_planner.DecoPlan(configuration, int(gf) if not np.isnan(gf) else np.nan, float(deco_time), not np.isnan(gf))
+        for configuration, gf, deco_time in zip(configurations, gf_high, tdt)
+    ]
+    return sorted(plans, key=deco_planner._rank)
+
+
+def test_pruning_keeps_best_plans():
+    for T, D, TDT in [(25, 45, 60), (30, 50, 60), (40, 60, 120)]:
+        result = deco_planner.plan_deco(T, D, TDT, gases=GASES, max_gases=3, parallel=False)
+        expected = exhaustive(T, D, TDT, gases=GASES, max_gases=3)
+        assert result.complete
+        assert result.pruned > 0
+        assert result.evaluated + result.pruned == len(expected)
+        # Plans with the same rank can come in either order
+        assert [deco_planner._rank(plan) for plan in result.plans] == [deco_planner._rank(plan) for plan in expected[:5]]
+
+
+def test_infeasible_target():
+    # No GF High gives 10000 minutes of decompression
+    result = deco_planner.plan_deco(25, 45, 10000, parallel=False)
+    assert result.complete and result.pruned == 0
+    assert not any(plan.feasible for plan in result.plans)
+    assert all(np.isnan(plan.gf_high) for plan in result.plans)
+    # Closest to the target first, the bottom gas only has the longest decompression
+    tdt = [plan.tdt for plan in result.plans]
+    assert tdt == sorted(tdt, reverse=True)
+    assert result.plans[0].deco_gases == ()
+
+
+def test_feasible_plans_rank_first():
+    result = deco_planner.plan_deco(25, 45, 60, parallel=False, top=30)
+    feasible = [plan.feasible for plan in result.plans]
+    assert feasible == sorted(feasible, reverse=True)
+    assert len(result.plans) == result.evaluated
+
+
+def test_time_budget_is_checked_per_chunk():
+    result = deco_planner.plan_deco(40, 60, 120, gases=GASES, max_gases=3, parallel=False, chunk_size=16,
+                                    time_budget=0)
+    assert not result.complete
+    assert result.evaluated == 16
+    assert len(result.plans) == 5
+
+
+def test_parallel_matches_serial():
+    serial = deco_planner.plan_deco(30, 50, 60, gases=GASES, max_gases=2, parallel=False)
+    # parallel_seconds=0 uses the pool however cheap the search is
+    parallel = deco_planner.plan_deco(30, 50, 60, gases=GASES, max_gases=2, num_workers=2, parallel_seconds=0)
+    assert [deco_planner._rank(plan) for plan in parallel.plans] == [deco_planner._rank(plan) for plan in serial.plans]
@@ -0,0 +1,50 @@
+"""Dive days planned from tissue snapshots against simulating the dives again."""
+import numpy as np
+import pytest
+
+from src import dive_day, gf_selection, zhl16c
+
+DEPTHS = [18, 25, 30]
+TIMES = [45, 30, 20]
+SURFACE_TIMES = [0, 60, 90]
+
+
+def assert_same_dive(planned, expected):
+    assert planned._replace(tissues=None) == expected._replace(tissues=None)
+    np.testing.assert_array_equal(planned.tissues, expected.tissues)
+
+
+def test_day_resumes_from_snapshot():
+    day = dive_day.DiveDay()
+    expected = [day.add_dive(*dive) for dive in zip(DEPTHS, TIMES, SURFACE_TIMES)]
+    # The plan of the rest of the day from the snapshot after the first dive, e.g. saved by the app
+    resumed = dive_day.DiveDay(expected[0].tissues)
+    for dive, planned in zip(list(zip(DEPTHS, TIMES, SURFACE_TIMES))[1:], expected[1:]):
+        assert_same_dive(resumed.add_dive(*dive), planned)
+    np.testing.assert_array_equal(resumed.snapshot(), day.snapshot())
+
+
+def test_snapshots_match_simulating_the_whole_day():
+    planned = dive_day.plan_dive_day(DEPTHS, TIMES, SURFACE_TIMES)
+    tissues = zhl16c.surface_tissues(1)
+    for dive in planned:
+        tissues = zhl16c.surface_interval(tissues, dive.surface_time)
+        result = zhl16c.simulate_square_dives(dive.time, dive.depth, dive.dive_gf, tissues=tissues)
+        tissues = result.tissues
+        assert dive.tdt == result.tdt[0]
+        np.testing.assert_allclose(dive.tissues, dive_day.tissue_snapshot(tissues), rtol=1e-12)
+
+
+@pytest.mark.parametrize("depth, first_dive_time, second_dive_time, surface_time", [
+    (18, 50, 30, 60), (24, 25, 25, 45), (30, 15, 20, 120), (12, 100, 80, 30),
+])
+def test_recommendation_matches_find_no_deco_gf_high(depth, first_dive_time, second_dive_time, surface_time):
+    day = dive_day.DiveDay()
+    first = day.add_dive(depth, first_dive_time, gf_high=gf_selection.FIRST_DIVE_GF)
+    # The two agree when the first dive is a no deco dive
+    assert first.max_ceiling <= 0
+    second = day.add_dive(depth, second_dive_time, surface_time)
+    expected, _ = gf_selection.find_no_deco_gf_high(
+        depth, [first_dive_time, second_dive_time], surface_time, backend="schreiner",
+    )
+    assert (second.gf_high if second.gf_high is not None else -1) == expected
@@ -0,0 +1,103 @@
+"""fit_gf_to_tdt gives the same GF High with search="bisect" as with the original linear sweep."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import gf_selection, metrics, zhl16c
+
+
+def prt_and_gf_grid():
+    """Dives of the PRT_and_GF notebook, with the same filter for long dives."""
+    T_values = np.linspace(30, 180, 20)
+    D_values = np.linspace(20, 60, 40)
+    pdcs_values = [0.01, 0.02, 0.03, 0.05]
+    df = pd.DataFrame(
+        [(T, D, pdcs) for T in T_values for D in D_values for pdcs in pdcs_values], columns=['T', 'D', 'pdcs'],
+    )
+    df['TDT'] = gf_selection.get_standair_tdt(df['D'].to_numpy(), df['T'].to_numpy(), df['pdcs'].to_numpy())
+    df['prt'] = (df['D']/10+1) * np.sqrt(df['T'])
+    return df[(df['TDT'] < 500) & (df['prt'] < 40)].reset_index(drop=True)
+
+
+def linear_sweep(df):
+    """The linear sweep of fit_gf_to_tdt for all dives at once: the first GF from 100 down with longer
+    decompression than TDT, 6 if there is none."""
+    gf_values = np.arange(100, 5, -1)
+    T = np.repeat(df['T'].to_numpy(), len(gf_values))
+    D = np.repeat(df['D'].to_numpy(), len(gf_values))
+    gf = np.tile(gf_values, len(df))
+    result = zhl16c.simulate_square_dives(T, D, gf)
+    tdt = np.where(result.failed, np.inf, result.tdt).reshape(len(df), len(gf_values))
+    longer = tdt > df['TDT'].to_numpy()[:, np.newaxis]
+    return np.where(longer.any(axis=1), gf_values[np.argmax(longer, axis=1)], 6)
+
+
+@pytest.fixture(autouse=True)
+def no_cache():
+    gf_selection.disable_cache()
+
+
+def test_bisect_matches_linear_sweep_on_grid():
+    df = prt_and_gf_grid()
+    expected = linear_sweep(df)
+    batch = gf_selection.fit_gf_to_tdt_df(df.copy(), engine="numpy")['gf_high'].to_numpy()
+    np.testing.assert_array_equal(batch, expected)
+    # One bisection at a time is slower, every 5th dive covers all depths and bottom times
+    sample = df.iloc[::5]
+    bisect = [gf_selection.fit_gf_to_tdt(row.T, row.D, row.TDT, backend="schreiner") for row in sample.itertuples()]
+    np.testing.assert_array_equal(bisect, expected[::5])
+
+
+def test_bisect_matches_linear_search():
+    # fit_gf_to_tdt(search="linear") itself is slow, so only every 60th dive of the grid
+    df = prt_and_gf_grid().iloc[::60]
+    for row in df.itertuples():
+        linear = gf_selection.fit_gf_to_tdt(row.T, row.D, row.TDT, search="linear", backend="schreiner")
+        bisect = gf_selection.fit_gf_to_tdt(row.T, row.D, row.TDT, search="bisect", backend="schreiner")
+        assert bisect == linear, (row.T, row.D, row.TDT)
+
+
+@pytest.mark.parametrize("offset", [-20, -3, 0, 2, 30])
+def test_warm_start_does_not_change_result(offset):
+    df = prt_and_gf_grid().iloc[::60]
+    for row in df.itertuples():
+        expected = gf_selection.fit_gf_to_tdt(row.T, row.D, row.TDT, backend="schreiner")
+        start = expected + offset
+        assert gf_selection.fit_gf_to_tdt(row.T, row.D, row.TDT, backend="schreiner", start=start) == expected
+
+
+def test_bisect_matches_linear_search_pydplan():
+    # gf_selection puts the pydplan submodule on the path
+    pytest.importorskip("pydplan.pydplan_profiletools")
+    df = prt_and_gf_grid().iloc[::60]
+    for row in df.itertuples():
+        linear = gf_selection.fit_gf_to_tdt(row.T, row.D, row.TDT, search="linear")
+        bisect = gf_selection.fit_gf_to_tdt(row.T, row.D, row.TDT, search="bisect")
+        assert bisect == linear, (row.T, row.D, row.TDT)
+
+
+def simulations(chunks, warm_start, monkeypatch):
+    """Plan simulations of fit_gf_to_tdt_df over chunks, with the schreiner backend in place of pydplan."""
+    get_gf_tdt = gf_selection.get_gf_tdt
+    monkeypatch.setattr(gf_selection, "get_gf_tdt", lambda *args, backend=None, **kwargs: get_gf_tdt(*args, backend="schreiner", **kwargs))
+    # The schreiner guess of pydplan fits would be the exact answer here, without it the searches without
+    # warm start are cold
+    monkeypatch.setattr(gf_selection, "_schreiner_gf_high", lambda *args, **kwargs: None)
+    monkeypatch.setattr(metrics, "enabled", True)
+    metrics.reset()
+    for chunk in chunks:
+        gf_selection.fit_gf_to_tdt_df(chunk.copy(), warm_start=warm_start)
+    steps = sum(value for name, _, value in metrics.snapshot()["counters"] if name == "simulations")
+    metrics.reset()
+    return steps
+
+
+def test_warm_start_chunks_need_fewer_steps(monkeypatch):
+    df = prt_and_gf_grid()
+    df = df[df['pdcs'] == 0.02]
+    groups = gf_selection.WARM_START_GROUPS["fit_gf_to_tdt_df"]
+    # The chunk size of parallelize_dataframe with 8 workers
+    chunks = gf_selection.dataframe_chunks(df, len(df) // (8 * 16), groups=groups)
+    keys = [set(map(tuple, chunk[['D', 'pdcs']].to_numpy())) for chunk in chunks]
+    assert sum(len(k) for k in keys) == len(set.union(*keys))
+    assert simulations(chunks, True, monkeypatch) < simulations([df], False, monkeypatch)
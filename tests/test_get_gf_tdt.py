@@ -0,0 +1,83 @@
+"""Statuses of get_gf_tdt results and fits of dives that can't be planned."""
+import math
+import pickle
+import functools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import gf_selection, metrics
+
+
+@pytest.fixture(autouse=True)
+def no_cache():
+    gf_selection.disable_cache()
+    yield
+    gf_selection.disable_cache()
+
+
+def test_cut_off_status():
+    full = gf_selection.get_gf_tdt(60, 40, 80, 0, 21, backend="schreiner")
+    cut = gf_selection.get_gf_tdt(60, 40, 80, 0, 21, backend="schreiner", max_tdt=10)
+    assert full.status == gf_selection.PLAN_OK
+    assert cut.status == gf_selection.PLAN_CUT_OFF
+    # A cut off tdt is a lower bound that is already past max_tdt
+    assert 10 < cut.tdt <= full.tdt
+    longer = gf_selection.get_gf_tdt(60, 40, 80, 0, 21, backend="schreiner", max_tdt=full.tdt + 1)
+    assert longer.status == gf_selection.PLAN_OK and longer.tdt == full.tdt
+
+
+def test_iteration_limit_status():
+    result = gf_selection.get_gf_tdt(180, 100, 10, 0, 21, backend="schreiner")
+    assert result.status == gf_selection.PLAN_ITERATION_LIMIT
+    assert result.tdt == math.inf and result.fig is None
+
+
+def test_plan_result_unpacks_as_two_values(tmp_path):
+    deco_time, fig = gf_selection.get_gf_tdt(60, 40, 80, 0, 21, backend="schreiner")
+    assert deco_time > 0 and fig is None
+
+    gf_selection.enable_cache(tmp_path / "cache.sqlite")
+    for max_tdt in [None, 10]:
+        computed = gf_selection.get_gf_tdt(60, 40, 80, 0, 21, backend="schreiner", max_tdt=max_tdt)
+        cached = gf_selection.get_gf_tdt(60, 40, 80, 0, 21, backend="schreiner", max_tdt=max_tdt)
+        assert cached == computed and cached.status == computed.status
+    restored = pickle.loads(pickle.dumps(computed))
+    assert restored.status == gf_selection.PLAN_CUT_OFF and tuple(restored) == tuple(computed)
+
+
+def test_pydplan_bisection_starts_from_schreiner_fit(monkeypatch):
+    # With the schreiner backend in place of pydplan the guess is the answer, which the gallop of
+    # search_gf_high confirms with two plans
+    get_gf_tdt = gf_selection.get_gf_tdt
+    monkeypatch.setattr(gf_selection, "get_gf_tdt", lambda *args, backend=None, **kwargs: get_gf_tdt(*args, backend="schreiner", **kwargs))
+    monkeypatch.setattr(metrics, "enabled", True)
+    for T, D in [(30, 30), (60, 40), (90, 50)]:
+        TDT = gf_selection.get_standair_tdt(D, T, 0.02)
+        metrics.reset()
+        gf_high = gf_selection.fit_gf_to_tdt(T, D, TDT)
+        simulations = sum(value for name, _, value in metrics.snapshot()["counters"] if name == "simulations")
+        assert gf_high == gf_selection.fit_gf_to_tdt(T, D, TDT, backend="schreiner")
+        assert simulations == 2
+    metrics.reset()
+
+
+def test_parallelize_dataframe_with_unplannable_dives():
+    df = pd.DataFrame({
+        'T': [30.0, 60.0, 180.0, 40.0],
+        'D': [30.0, 40.0, 100.0, 20.0],
+        'he': 0.0,
+        'pdcs': 0.02,
+    })
+    df['TDT'] = gf_selection.get_standair_tdt(df['D'].to_numpy(), df['T'].to_numpy(), df['pdcs'].to_numpy())
+    # No GF gives infinite decompression, the fit runs out of GFs like the linear sweep. The 180 min dive
+    # at 100 m fails at every GF, which counts as longer decompression.
+    df.loc[3, 'TDT'] = np.inf
+    expected = gf_selection.fit_gf_to_tdt_df(df.copy(), engine="numpy")['gf_high']
+    assert expected[2] == 100 and expected[3] == 6
+
+    result = gf_selection.parallelize_dataframe(
+        df, functools.partial(gf_selection.fit_gf_to_tdt_df, engine="numpy"), num_workers=2, chunk_size=1,
+    )
+    pd.testing.assert_series_equal(result['gf_high'], expected)
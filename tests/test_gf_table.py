@@ -0,0 +1,64 @@
+"""GF table answers are never above the exact fit and at most MAX_ERROR points below it."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import gf_selection, gf_table
+
+
+def exact_fit(D, T, he, pdcs):
+    df = pd.DataFrame({'D': D, 'T': T, 'he': he, 'pdcs': pdcs})
+    df['TDT'] = gf_selection.get_standair_tdt(df['D'].to_numpy(), df['T'].to_numpy(), df['pdcs'].to_numpy())
+    return gf_selection.fit_gf_to_tdt_df(df, engine="numpy")['gf_high'].to_numpy()
+
+
+def random_dives(axes, n, seed):
+    """Dives inside the grid, with helium and pDCS on the grid half of the time like app queries."""
+    rng = np.random.default_rng(seed)
+    points = []
+    for name in gf_table.AXIS_NAMES:
+        axis = np.asarray(axes[name], dtype=float)
+        values = rng.uniform(axis[0], axis[-1], n)
+        if name in ("he", "pdcs"):
+            values = np.where(rng.uniform(0, 1, n) < 0.5, rng.choice(axis, n), values)
+        points.append(values)
+    return points
+
+
+def assert_within_bound(table, points):
+    answer = table.lookup_many(*points)
+    answered = ~np.isnan(answer)
+    assert answered.any()
+    error = exact_fit(*[p[answered] for p in points]) - answer[answered]
+    assert error.min() >= 0
+    assert error.max() <= gf_table.MAX_ERROR
+
+
+def test_built_table_is_conservative(tmp_path):
+    axes = {
+        "D": np.arange(20, 41, 2), "T": np.arange(20, 81, 10),
+        "he": np.array([0, 10, 20]), "pdcs": np.array([0.01, 0.02, 0.03]),
+    }
+    table = gf_table.build_table(axes, tmp_path / "table.npy", tmp_path / "axes.npz", engine="numpy")
+    assert_within_bound(table, random_dives(axes, 2000, seed=1))
+    # Grid points are answered exactly
+    grid = [np.asarray(axes[name], dtype=float)[[0, 2, 1]] for name in gf_table.AXIS_NAMES]
+    np.testing.assert_array_equal(table.lookup_many(*grid), exact_fit(*grid))
+
+
+def test_numpy_table_is_not_loaded(tmp_path, monkeypatch):
+    axes = {"D": [10, 20], "T": [10, 20], "he": [0, 10], "pdcs": [0.01, 0.02]}
+    gf_table.build_table(axes, tmp_path / "table.npy", tmp_path / "axes.npz", engine="numpy", samples=1)
+    monkeypatch.setattr(gf_table, "_table", None)
+    assert gf_table.load_table(tmp_path / "table.npy", tmp_path / "axes.npz") is None
+
+
+def test_lookup_outside_of_table():
+    table = gf_table.GFTable(np.full((2, 2, 2, 2), 50, dtype=np.uint8),
+                             {"D": [10, 20], "T": [10, 20], "he": [0, 10], "pdcs": [0.01, 0.02]})
+    assert table.lookup(30, 15, 0, 0.01) is None
+    assert table.lookup(15, 15, 5, 0.015) == 50 - gf_table.SAFETY_MARGIN
+    assert table.lookup(10, 20, 0, 0.02) == 50
+    # Float noise next to a grid line is on the grid line
+    assert table.lookup(10.000000000000002, 20, 0, 0.02) == 50
+    assert table.lookup(19.999999999999996, 15, 0, 0.015) == 50 - gf_table.SAFETY_MARGIN
@@ -0,0 +1,30 @@
+"""Importing gf_selection stays fast for the web app."""
+import os
+import sys
+import subprocess
+
+from src import gf_selection
+
+project_folder = os.path.join(os.path.dirname(__file__), "..")
+
+HEAVY_MODULES = ["pandas", "plotly", "matplotlib", "pydplan", "sklearn", "dash"]
+
+
+def run_python(*args):
+    return subprocess.run([sys.executable, *args], cwd=project_folder, capture_output=True, text=True, check=True)
+
+
+def test_import_does_not_load_heavy_modules():
+    code = f"import sys, src.gf_selection; print(*[m for m in {HEAVY_MODULES!r} if m in sys.modules])"
+    assert run_python("-c", code).stdout.split() == []
+
+
+def test_import_time_within_budget():
+    stderr = run_python("-X", "importtime", "-c", "import src.gf_selection").stderr
+    # import time: self [us] | cumulative | imported package
+    cumulative = {
+        fields[-1].strip(): int(fields[1])
+        for fields in (line.split("|") for line in stderr.splitlines() if line.startswith("import time:"))
+        if fields[1].strip().isdigit()
+    }
+    assert cumulative["src.gf_selection"] / 1e6 <= gf_selection.IMPORT_TIME_BUDGET
@@ -0,0 +1,69 @@
+"""Background job queue shared by sessions."""
+import os
+import time
+
+from src import jobs
+
+
+def wait(queue, key, seconds=20):
+    start = time.time()
+    while queue.status(key)[0] in ("pending", "running") and time.time() - start < seconds:
+        time.sleep(0.05)
+    return queue.status(key)
+
+
+def test_cancel_keeps_job_other_session_waits_for(tmp_path):
+    queue = jobs.JobQueue(tmp_path / "jobs.sqlite", max_workers=1)
+    queue.submit("sleep", time.sleep, 0.5)
+    first = queue.submit("sleep", time.sleep, 0.1)
+    second = queue.submit("sleep", time.sleep, 0.1)
+    assert first == second
+    queue.cancel(first)
+    assert wait(queue, second)[0] == "done"
+
+
+def test_cancelled_job_is_an_error(tmp_path):
+    queue = jobs.JobQueue(tmp_path / "jobs.sqlite", max_workers=1)
+    queue.submit("sleep", time.sleep, 0.5)
+    key = queue.submit("sleep", time.sleep, 0.1)
+    queue.cancel(key)
+    assert queue.status(key) == ("error", "The job was cancelled")
+
+
+def test_dead_job_process_is_an_error(tmp_path):
+    queue = jobs.JobQueue(tmp_path / "jobs.sqlite", max_workers=1)
+    key = queue.submit("exit", os._exit, 1)
+    assert wait(queue, key)[0] == "error"
+    # Other processes see the error too, and the pool works again
+    assert jobs.JobQueue(tmp_path / "jobs.sqlite").status(key)[0] == "error"
+    assert wait(queue, queue.submit("sleep", time.sleep, 0))[0] == "done"
+
+
+def test_job_submitted_by_another_process_is_not_started_again(tmp_path):
+    queue = jobs.JobQueue(tmp_path / "jobs.sqlite", max_workers=1)
+    other = jobs.JobQueue(tmp_path / "jobs.sqlite", max_workers=1)
+    key = queue.submit("sleep", time.sleep, 0.1)
+    assert other.submit("sleep", time.sleep, 0.1) == key
+    assert not other._futures
+    assert wait(other, key)[0] == "done"
+
+
+def test_job_without_result_times_out(tmp_path):
+    queue = jobs.JobQueue(tmp_path / "jobs.sqlite", timeout=1)
+    # Submitted by a process that is gone
+    queue.cache.update("submitted:lost", lambda found, marker: (0, time.time() - 2, None))
+    assert queue.status("lost") == ("error", "The job timed out")
+
+
+def test_failed_job_runs_again(tmp_path):
+    queue = jobs.JobQueue(tmp_path / "jobs.sqlite", max_workers=1)
+    path = str(tmp_path / "flag")
+    key = queue.submit("remove", os.remove, path)
+    state, error = wait(queue, key)
+    assert state == "error" and "FileNotFoundError" in error
+    assert not queue.cache.get("result:" + key)[0]
+    # The failure is not kept for the next session
+    open(path, "w").close()
+    assert queue.submit("remove", os.remove, path) == key
+    assert wait(queue, key) == ("done", None)
+    assert not os.path.exists(path)
@@ -0,0 +1,62 @@
+"""Counters, timings and their Prometheus text format."""
+import pytest
+
+from src import metrics
+
+
+@pytest.fixture(autouse=True)
+def enabled_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, "enabled", True)
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_render_format():
+    metrics.increment("simulations", backend="schreiner")
+    metrics.increment("simulations", 2, backend="pydplan")
+    metrics.increment("search_steps", 0.1)
+    metrics.observe("phase", 0.25, phase="simulate")
+    assert metrics.render() == (
+        '# TYPE gf_search_steps_total counter\n'
+        'gf_search_steps_total 0.1\n'
+        '# TYPE gf_simulations_total counter\n'
+        'gf_simulations_total{backend="pydplan"} 2.0\n'
+        'gf_simulations_total{backend="schreiner"} 1.0\n'
+        '# TYPE gf_phase_seconds summary\n'
+        'gf_phase_seconds_count{phase="simulate"} 1\n'
+        'gf_phase_seconds_sum{phase="simulate"} 0.250000\n'
+    )
+
+
+def test_render_keeps_full_precision():
+    metrics.increment("search_steps", 1234567)
+    metrics.increment("fallbacks", 0.1)
+    metrics.increment("fallbacks", 0.2)
+    assert "gf_search_steps_total 1234567.0\n" in metrics.render()
+    assert "gf_fallbacks_total 0.30000000000000004\n" in metrics.render()
+
+
+def test_scope_labels_callback():
+    with metrics.scope("update"):
+        metrics.increment("simulations", backend="schreiner")
+    assert 'gf_simulations_total{backend="schreiner",callback="update"} 1.0' in metrics.render()
+    assert 'gf_callback_seconds_count{callback="update",status="ok"} 1' in metrics.render()
+
+
+def test_merge_adds_snapshot():
+    metrics.increment("simulations", 3, backend="schreiner")
+    metrics.observe("job", 1.5, job="fit", status="done")
+    data = metrics.snapshot()
+    metrics.increment("simulations", backend="schreiner")
+    metrics.merge(data)
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"] == [("simulations", {"backend": "schreiner"}, 7)]
+    assert snapshot["timings"] == [("job", {"job": "fit", "status": "done"}, 2, 3.0)]
+
+
+def test_disabled_records_nothing(monkeypatch):
+    monkeypatch.setattr(metrics, "enabled", False)
+    metrics.increment("simulations")
+    metrics.observe("phase", 1.0, phase="simulate")
+    assert metrics.render() == "\n"
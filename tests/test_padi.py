@@ -0,0 +1,45 @@
+"""The compiled PADI tables give the same second dive no deco times as the original DataFrame lookups."""
+import itertools
+import numpy as np
+import pandas as pd
+
+from src import gf_selection, padi
+
+
+def dataframe_no_dec_time(btt, sfi, rnt, first_dive_time, surface_time, D_feet):
+    """The DataFrame implementation second_dive_no_dec_time had before the tables were compiled, with NaN
+    where it raised IndexError for a dive outside of the tables."""
+    try:
+        depths = btt.columns[1:].astype(int)
+        planned_depth = depths[depths >= D_feet].values[0]
+        possible_pressure_groups = btt.loc[btt[planned_depth.astype(str)] >= first_dive_time, 'Pressure group'].values
+        if len(possible_pressure_groups) == 0:
+            return 0
+        pressure_group = possible_pressure_groups[0]
+        next_pressure_group = sfi.loc[sfi[pressure_group] >= surface_time, 'Next pressure group'].values[0]
+        residual_nitrogen = rnt.loc[rnt['Depth (fsw)'] == planned_depth, next_pressure_group].values[0]
+        return (btt[planned_depth.astype(str)] - residual_nitrogen).max()
+    except IndexError:
+        return np.nan
+
+
+def test_compiled_tables_match_dataframes():
+    dfs = gf_selection.load_padi_dataframes()
+    tables = padi.compile_tables(dfs["btt"], dfs["sfi"], dfs["rnt"])
+    dives = np.array(list(itertools.product(
+        [0, 1, 5, 9, 10, 11, 25, 40, 60, 100, 150, 205, 206],
+        [0, 1, 10, 30, 60, 61, 180, 300, 1440, 2000],
+        [20, 35, 36, 40, 55, 60, 100, 125, 140, 141],
+    )), dtype=float).T
+    expected = [dataframe_no_dec_time(dfs["btt"], dfs["sfi"], dfs["rnt"], *dive) for dive in dives.T]
+    np.testing.assert_array_equal(padi.second_dive_no_dec_time(tables, *dives), expected)
+
+
+def test_saved_tables_load_the_same(tmp_path):
+    dfs = gf_selection.load_padi_dataframes()
+    tables = padi.compile_tables(dfs["btt"], dfs["sfi"], dfs["rnt"])
+    padi.save_tables(tables, tmp_path / "padi_tables.npz")
+    loaded = padi.load_tables(tmp_path / "padi_tables.npz")
+    for name in padi.PadiTables._fields:
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(tables, name))
+    assert gf_selection.second_dive_no_dec_time(40, 60, 60) == padi.second_dive_no_dec_time(tables, 40, 60, 60)[0]
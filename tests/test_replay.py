@@ -0,0 +1,123 @@
+"""Parsing of CSV and UDDF dive logs and replays into a store."""
+import os
+
+import numpy as np
+import pytest
+
+from src import replay
+
+CSV_LOG = """time,depth,dive,o2,he,gf_high,gf_low
+0,0,a,32,0,85,40
+60,10,a,,,,
+1200,30,a,,,,
+1500,6,a,50,,,
+1800,0,a,,,,
+0,0,b,,,,
+120,18,b,,,,
+900,0,b,,,,
+"""
+
+UDDF_LOG = """<?xml version="1.0" encoding="utf-8"?>
+<uddf xmlns="http://www.streit.cc/uddf/3.2/" version="3.2.0">
+  <gasdefinitions>
+    <mix id="ean32"><o2>0.32</o2><he>0.0</he></mix>
+    <mix id="tx2135"><o2>0.21</o2><he>0.35</he></mix>
+  </gasdefinitions>
+  <profiledata>
+    <repetitiongroup>
+      <gradientfactorhigh>0.8</gradientfactorhigh>
+      <gradientfactorlow>30</gradientfactorlow>
+      <dive id="first">
+        <samples>
+          <waypoint><divetime>0</divetime><depth>0</depth><switchmix ref="tx2135"/></waypoint>
+          <waypoint><divetime>120</divetime><depth>40</depth></waypoint>
+          <waypoint><divetime>1500</divetime><depth>40</depth></waypoint>
+          <waypoint><divetime>2400</divetime><depth>0</depth></waypoint>
+        </samples>
+      </dive>
+      <dive id="second">
+        <samples>
+          <waypoint><divetime>0</divetime><depth>0</depth><switchmix ref="ean32"/></waypoint>
+          <waypoint><divetime>900</divetime><depth>12</depth></waypoint>
+          <waypoint><divetime>1200</divetime><depth>0</depth></waypoint>
+        </samples>
+      </dive>
+      <dive id="surface"><samples><waypoint><divetime>0</divetime><depth>0</depth></waypoint></samples></dive>
+    </repetitiongroup>
+  </profiledata>
+</uddf>
+"""
+
+
+def write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def test_csv_dives(tmp_path):
+    first, second = replay.iter_csv_dives(write(tmp_path, "log.csv", CSV_LOG))
+    assert (first.dive, second.dive) == ("a", "b")
+    np.testing.assert_allclose(first.times, [0, 1, 20, 25, 30])
+    np.testing.assert_allclose(first.depths, [0, 10, 30, 6, 0])
+    # Nitrox 32 until the switch to 50 % at 6 m
+    np.testing.assert_allclose(first.fn2, [0.68, 0.68, 0.68, 0.5, 0.5])
+    np.testing.assert_allclose(first.fhe, 0)
+    assert (first.gf_high, first.gf_low) == (85, 40)
+    # Every dive starts on air without logged gradient factors
+    np.testing.assert_allclose(second.fn2, replay.AIR[0])
+    assert np.isnan(second.gf_high) and np.isnan(second.gf_low)
+
+
+def test_csv_without_optional_columns(tmp_path):
+    dives = list(replay.iter_csv_dives(write(tmp_path, "log.csv", "depth,time\n0,0\n12,60\n0,600\n")))
+    assert len(dives) == 1
+    np.testing.assert_allclose(dives[0].depths, [0, 12, 0])
+    np.testing.assert_allclose(dives[0].times, [0, 1, 10])
+
+
+def test_uddf_dives(tmp_path):
+    first, second = replay.iter_uddf_dives(write(tmp_path, "log.uddf", UDDF_LOG))
+    assert (first.dive, second.dive) == ("first", "second")
+    np.testing.assert_allclose(first.times, [0, 2, 25, 40])
+    np.testing.assert_allclose(first.fhe, 0.35)
+    np.testing.assert_allclose(first.fn2, 0.44)
+    np.testing.assert_allclose(second.fn2, 0.68)
+    # Fractions and percentages both give percent
+    assert (first.gf_high, first.gf_low) == (80, 30)
+    assert (second.gf_high, second.gf_low) == (80, 30)
+
+
+def test_missing_csv_column(tmp_path):
+    path = write(tmp_path, "bad.csv", "seconds,depth\n0,0\n60,10\n")
+    with pytest.raises(ValueError, match="bad.csv: the CSV header has no time column"):
+        list(replay.iter_csv_dives(path))
+    with pytest.raises(ValueError, match="no time and depth column"):
+        list(replay.iter_csv_dives(write(tmp_path, "empty.csv", "")))
+
+
+def test_replay_checks_headers_before_writing(tmp_path):
+    logs = tmp_path / "logs"
+    logs.mkdir()
+    write(logs, "a.csv", CSV_LOG)
+    write(logs, "b.csv", "seconds,depth\n0,0\n60,10\n")
+    store = str(tmp_path / "store")
+    with pytest.raises(ValueError, match="b.csv"):
+        replay.replay([str(logs)], store, parallel=False)
+    assert os.listdir(store) == []
+
+
+def test_replay_into_store(tmp_path):
+    logs = tmp_path / "logs"
+    logs.mkdir()
+    write(logs, "a.csv", CSV_LOG)
+    write(logs, "b.uddf", UDDF_LOG)
+    store = str(tmp_path / "store")
+    stats = replay.replay([str(logs)], store, parallel=False)
+    assert (stats.files, stats.dives) == (2, 4)
+    results = replay.load_results(store).set_index("dive")
+    assert results.loc["first", "he"] == pytest.approx(35)
+    assert results.loc["a", "max_depth"] == 30
+    assert results.loc["a", "bottom_time"] == pytest.approx(20)
+    # Files already in the store are skipped
+    assert replay.replay([str(logs)], store, parallel=False).files == 0
@@ -0,0 +1,50 @@
+"""The vectorized StandardAir model against the original scalar formula and its inverses."""
+import math
+import numpy as np
+
+from src import standair
+
+
+def scalar_tdt(D, T, pdcs):
+    """The per dive formula gf_selection.get_standair_tdt had before standair."""
+    D_feet = D * standair.FEET_IN_METER
+    logit = math.log(pdcs / (1 - pdcs))
+    numerator = standair.b * (D_feet - standair.c) * (1 - np.exp(-standair.d * T**standair.f))
+    return max(numerator / (logit - standair.a) + standair.g, 0)
+
+
+def random_dives(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(6, 60, n), rng.uniform(5, 200, n), rng.uniform(0.005, 0.05, n)
+
+
+def test_tdt_matches_scalar_formula():
+    D, T, pdcs = random_dives()
+    expected = [scalar_tdt(*dive) for dive in zip(D, T, pdcs)]
+    np.testing.assert_allclose(standair.tdt(D, T, pdcs), expected, rtol=1e-12, atol=1e-9)
+    assert standair.tdt(30, 40, 0.02).shape == ()
+
+
+def test_pdcs_inverts_tdt():
+    D, T, pdcs = random_dives()
+    TDT = standair.tdt(D, T, pdcs)
+    deco = TDT > 0
+    np.testing.assert_allclose(standair.pdcs(D[deco], T[deco], TDT[deco]), pdcs[deco], rtol=1e-9)
+    # No deco dives stay no deco down to the pDCS for TDT=0, which is NaN when they are for every pDCS
+    assert not (standair.pdcs(D[~deco], T[~deco], 0) > pdcs[~deco] * (1 + 1e-9)).any()
+    # Shallower than c feet every pDCS gives no deco
+    assert np.isnan(standair.pdcs(standair.c / standair.FEET_IN_METER - 1, 60, 0))
+
+
+def test_no_deco_time_round_trip():
+    D, _, pdcs = random_dives()
+    T = standair.no_deco_time(D, pdcs)
+    limited = np.isfinite(T)
+    assert limited.any() and not limited.all()
+    # TDT is 0 at the limit and positive a minute later
+    np.testing.assert_allclose(standair.tdt(D[limited], T[limited], pdcs[limited]), 0, atol=1e-6)
+    assert (standair.tdt(D[limited], T[limited] + 1, pdcs[limited]) > 0).all()
+    # The pDCS of a dive at its limit with TDT=0 is the pDCS the limit was computed for
+    np.testing.assert_allclose(standair.pdcs(D[limited], T[limited], 0), pdcs[limited], rtol=1e-9)
+    # Without a limit no bottom time needs deco
+    assert (standair.tdt(D[~limited], 1e4, pdcs[~limited]) == 0).all()
@@ -0,0 +1,35 @@
+"""Resuming sweeps from the on-disk store."""
+import numpy as np
+
+from src import sweep
+
+
+class CountingFunc:
+    def __init__(self):
+        self.rows = 0
+
+    def __call__(self, df):
+        self.rows += len(df)
+        df = df.copy()
+        df['y'] = df['T'] * 2
+        return df
+
+
+def test_widened_grid_only_computes_new_points(tmp_path):
+    func = CountingFunc()
+    sweep.run_sweep(sweep.make_grid(T=[10, 20, 30]), func, tmp_path, parallel=False)
+    result = sweep.run_sweep(sweep.make_grid(T=[10, 20, 30, 45.5]), func, tmp_path, parallel=False)
+    assert func.rows == 4
+    np.testing.assert_array_equal(result['y'], [20, 40, 60, 91])
+
+
+def test_partial_temporary_files_are_ignored(tmp_path):
+    func = CountingFunc()
+    sweep.run_sweep(sweep.make_grid(T=[10, 20]), func, tmp_path, parallel=False)
+    # Left behind by a crash in the middle of write_chunk, also with the name older versions used
+    (tmp_path / ".tmp-chunk-000001-123.npz").write_bytes(b"partial")
+    (tmp_path / "chunk-000001.npz.tmp.npz").write_bytes(b"partial")
+    result = sweep.run_sweep(sweep.make_grid(T=[10, 20, 30]), func, tmp_path, parallel=False)
+    assert func.rows == 3
+    np.testing.assert_array_equal(result['y'], [20, 40, 60])
+    assert [number for number, _ in sweep.chunk_paths(tmp_path)] == [0, 1]
@@ -0,0 +1,65 @@
+"""The vectorized zhl16c engine against pydplan calculatePlan and its own stop solvers."""
+import os
+import itertools
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import gf_selection, zhl16c
+
+# Depths (m), bottom times (min), GF High and helium (%) of the comparison grid
+DEPTHS = [15, 21, 30, 39, 45, 51, 60]
+TIMES = [10, 20, 30, 45, 60, 90, 120]
+GF_HIGHS = [30, 50, 70, 85, 100]
+HELIUM = [0, 20, 35]
+
+CALCULATEPLAN_FITS = os.path.join(os.path.dirname(__file__), "data", "calculateplan_gf_fits.csv")
+
+
+def grid():
+    return np.array(list(itertools.product(TIMES, DEPTHS, GF_HIGHS, HELIUM)), dtype=float).T
+
+
+def test_schreiner_stop_solver_matches_minutes():
+    T, D, gf_high, he = grid()
+    minutes = zhl16c.simulate_square_dives(T, D, gf_high, he=he, stop_solver="minutes")
+    schreiner = zhl16c.simulate_square_dives(T, D, gf_high, he=he, stop_solver="schreiner")
+    np.testing.assert_array_equal(schreiner.failed, minutes.failed)
+    ok = ~minutes.failed
+    np.testing.assert_allclose(schreiner.tdt[ok], minutes.tdt[ok])
+
+
+def test_tdt_agrees_with_pydplan():
+    # gf_selection puts the pydplan submodule on the path
+    pytest.importorskip("pydplan.pydplan_profiletools")
+    gf_selection.disable_cache()
+    T, D, gf_high, he = grid()
+    result = zhl16c.simulate_square_dives(T, D, gf_high, he=he)
+    for k in range(len(T)):
+        expected = gf_selection.get_gf_tdt(T[k], D[k], gf_high[k], he[k], 21, backend="pydplan")
+        if expected.status != gf_selection.PLAN_OK or result.failed[k]:
+            # Both run out of iterations only for very long decompression, there is no TDT to compare
+            assert result.failed[k] or result.tdt[k] > 300, (T[k], D[k], gf_high[k], he[k])
+            continue
+        assert abs(result.tdt[k] - expected.tdt) <= zhl16c.TDT_TOLERANCE, (T[k], D[k], gf_high[k], he[k], result.tdt[k], expected.tdt)
+
+
+def test_tdt_tolerance_matches_calculateplan_fits():
+    fits = pd.read_csv(CALCULATEPLAN_FITS, comment="#")
+    T, D, gf_high = [fits[c].to_numpy(dtype=float) for c in ("T", "D", "gf_high")]
+    TDT = gf_selection.get_standair_tdt(D, T, fits['pdcs'].to_numpy())
+    # fit_gf_to_tdt returns the highest GF High with calculatePlan TDT longer than the target, so the
+    # calculatePlan TDT is longer than the target at gf_high and at most the target at gf_high + 1
+    at_fit = zhl16c.simulate_square_dives(T, D, gf_high)
+    above_fit = zhl16c.simulate_square_dives(T, D, np.minimum(gf_high + 1, 100))
+    too_short = np.where(at_fit.failed, 0, TDT - at_fit.tdt)
+    too_long = np.where((gf_high < 100) & ~above_fit.failed, above_fit.tdt - TDT, 0)
+    difference = np.maximum.reduce([too_short, too_long, np.zeros(len(T))])
+    assert np.ceil(difference.max()) == zhl16c.TDT_TOLERANCE
+
+
+def test_simulate_bottom_rejects_surface_depths():
+    with pytest.raises(ValueError):
+        zhl16c.simulate_bottom(30, [20, 0])
+    with pytest.raises(ValueError):
+        zhl16c.simulate_square_dives(30, -3, 80)